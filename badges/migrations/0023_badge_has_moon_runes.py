@@ -0,0 +1,63 @@
+# Generated by Django 2.1.5 on 2019-02-24 18:40
+
+from django.db import migrations, models
+
+from badges.proxies.badge.privacy import BadgePrivacyAdapter
+
+
+def contains_moon_runes(unicode_str):
+    try:
+        unicode_str.encode('ISO-8859-1')
+    except UnicodeEncodeError:
+        return True
+    else:
+        return False
+
+
+def get_printable_values(badge, badge_layout):
+    """
+    Historical models do not have the CSV export methods, so this replicates Badge.get_csv_fields.
+    """
+    adapter = BadgePrivacyAdapter(badge)
+
+    if badge_layout == 'trad':
+        return [badge.personnel_class.name, adapter.surname, adapter.first_name, adapter.nick, badge.job_title]
+    elif badge_layout == 'nick':
+        return [badge.personnel_class.name, adapter.nick_or_first_name, adapter.surname_or_full_name, badge.job_title]
+    else:
+        return []
+
+
+def populate_has_moon_runes(apps, schema_editor):
+    Badge = apps.get_model('badges', 'badge')
+    BadgesEventMeta = apps.get_model('badges', 'badgeseventmeta')
+
+    badge_layouts = dict(BadgesEventMeta.objects.values_list('event_id', 'badge_layout'))
+
+    badge_ids = [
+        badge.id
+        for badge in Badge.objects.select_related('personnel_class').iterator()
+        if contains_moon_runes('\n'.join(
+            str(value)
+            for value in get_printable_values(badge, badge_layouts.get(badge.personnel_class.event_id))
+        ))
+    ]
+
+    for i in range(0, len(badge_ids), 1000):
+        Badge.objects.filter(id__in=badge_ids[i:i + 1000]).update(has_moon_runes=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badges', '0022_badge_notes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='badge',
+            name='has_moon_runes',
+            field=models.BooleanField(db_index=True, default=False, editable=False, help_text='Whether the printable text of the badge cannot be encoded into ISO-8859-1. Updated on save.', verbose_name='Has moon runes'),
+        ),
+        migrations.RunPython(populate_has_moon_runes, migrations.RunPython.noop, elidable=True),
+    ]
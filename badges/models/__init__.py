@@ -1,6 +1,6 @@
 # encoding: utf-8
 
-from .count_badges_mixin import CountBadgesMixin
+from .count_badges_mixin import BadgeCounts, CountBadgesMixin
 from .badges_event_meta import BadgesEventMeta
 from .batch import Batch
 from .badge import Badge
\ No newline at end of file
@@ -1,14 +1,20 @@
 import logging
+from collections import defaultdict
 
 from django.conf import settings
 from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.html import escape
+from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
 from core.csv_export import CsvExportMixin
 from core.utils import time_bool_property
 
 from ..proxies.badge.privacy import BadgePrivacyAdapter
+from .batch import contains_moon_runes
+from .count_badges_mixin import invalidate_badge_counts
 
 
 logger = logging.getLogger('kompassi')
@@ -118,6 +124,14 @@ class Badge(models.Model, CsvExportMixin):
     is_printed_separately = time_bool_property('printed_separately_at')
     is_arrived = time_bool_property('arrived_at')
 
+    has_moon_runes = models.BooleanField(
+        default=False,
+        db_index=True,
+        editable=False,
+        verbose_name=_('Has moon runes'),
+        help_text=_('Whether the printable text of the badge cannot be encoded into ISO-8859-1. Updated on save.'),
+    )
+
     notes = models.TextField(
         default='',
         blank=True,
@@ -172,19 +186,12 @@ class Badge(models.Model, CsvExportMixin):
             except cls.DoesNotExist:
                 existing_badge = None
 
-            expected_badge_opts = default_badge_factory(event=event, person=person)
-            new_badge_opts = dict(expected_badge_opts)
-
-            if event.badges_event_meta.is_using_fuzzy_reissuance_hack:
-                # The fuzzy reissuance hack is documented at
-                # badges.models.badges_event_meta:Badge.is_using_fuzzy_reissuance_hack
-                expected_badge_opts.pop('is_first_name_visible', None)
-                expected_badge_opts.pop('is_surname_visible', None)
-                expected_badge_opts.pop('is_nick_visible', None)
+            new_badge_opts = default_badge_factory(event=event, person=person)
+            expected_badge_opts = cls._get_expected_badge_opts(event.badges_event_meta, new_badge_opts)
 
             if existing_badge:
                 # There is an existing un-revoked badge. Check that its information is correct.
-                if any(getattr(existing_badge, key) != value for (key, value) in expected_badge_opts.items()):
+                if not existing_badge._matches_badge_opts(expected_badge_opts):
                     existing_badge.revoke()
                 else:
                     return existing_badge, False
@@ -200,6 +207,104 @@ class Badge(models.Model, CsvExportMixin):
 
             return badge, True
 
+    @staticmethod
+    def _get_expected_badge_opts(meta, new_badge_opts):
+        """
+        Returns those of the badge options that an existing badge must match in order to not be reissued.
+        """
+        expected_badge_opts = dict(new_badge_opts)
+
+        if meta.is_using_fuzzy_reissuance_hack:
+            # The fuzzy reissuance hack is documented at
+            # badges.models.badges_event_meta:Badge.is_using_fuzzy_reissuance_hack
+            expected_badge_opts.pop('is_first_name_visible', None)
+            expected_badge_opts.pop('is_surname_visible', None)
+            expected_badge_opts.pop('is_nick_visible', None)
+
+        return expected_badge_opts
+
+    def _matches_badge_opts(self, badge_opts):
+        for key, value in badge_opts.items():
+            if key == 'personnel_class':
+                # avoid fetching the personnel class of every badge
+                if self.personnel_class_id != (value.id if value is not None else None):
+                    return False
+            elif getattr(self, key) != value:
+                return False
+
+        return True
+
+    @classmethod
+    def reconcile(cls, event, person_ids=None):
+        """
+        Does what Badge.ensure does for many people of an event at once. The expected badges are computed with a
+        handful of queries, and outdated badges are revoked and missing ones created in bulk in one transaction.
+        If person_ids is not given, everyone who has a signup, a programme role or a badge in the event is
+        reconciled.
+
+        Returns (badges_created, badges_revoked).
+        """
+        from badges.utils import default_badge_factory_for_event
+
+        meta = event.badges_event_meta
+
+        with transaction.atomic():
+            new_badge_opts_by_person_id = default_badge_factory_for_event(event, person_ids)
+
+            existing_badges_by_person_id = defaultdict(list)
+            for badge in cls.objects.filter(
+                personnel_class__event=event,
+                person_id__in=list(new_badge_opts_by_person_id),
+                revoked_at__isnull=True,
+            ).order_by('id'):
+                existing_badges_by_person_id[badge.person_id].append(badge)
+
+            badges_to_revoke = []
+            badges_to_create = []
+
+            for person_id, new_badge_opts in new_badge_opts_by_person_id.items():
+                expected_badge_opts = cls._get_expected_badge_opts(meta, new_badge_opts)
+                has_valid_badge = False
+
+                for existing_badge in existing_badges_by_person_id[person_id]:
+                    if not has_valid_badge and existing_badge._matches_badge_opts(expected_badge_opts):
+                        has_valid_badge = True
+                    else:
+                        badges_to_revoke.append(existing_badge)
+
+                if not has_valid_badge and new_badge_opts['personnel_class'] is not None:
+                    badges_to_create.append(cls(person_id=person_id, **new_badge_opts))
+
+            for badge in badges_to_create:
+                badge.has_moon_runes = badge.compute_has_moon_runes(event)
+
+            cls.bulk_revoke(badges_to_revoke)
+            badges_created = cls.objects.bulk_create(badges_to_create)
+
+        if badges_created or badges_to_revoke:
+            invalidate_badge_counts(event.id)
+
+        return badges_created, badges_to_revoke
+
+    @classmethod
+    def bulk_revoke(cls, badges, user=None):
+        """
+        Does what revoke does for many badges with two queries: those that are already in a batch or printed
+        separately are marked revoked, and the rest are deleted.
+        """
+        badge_ids_to_mark = [badge.id for badge in badges if badge.printed_separately_at or badge.batch_id]
+        badge_ids_to_delete = [badge.id for badge in badges if not (badge.printed_separately_at or badge.batch_id)]
+
+        if badge_ids_to_mark:
+            cls.objects.filter(id__in=badge_ids_to_mark).update(
+                revoked_at=now(),
+                revoked_by=user,
+                updated_at=now(),
+            )
+
+        if badge_ids_to_delete:
+            cls.objects.filter(id__in=badge_ids_to_delete).delete()
+
     @classmethod
     def get_csv_fields(cls, event):
         meta = event.badges_event_meta
@@ -286,6 +391,41 @@ class Badge(models.Model, CsvExportMixin):
     def get_printable_text(self, fields):
         return '\n'.join(str(value) for value in self.get_csv_row(self.event, fields, 'comma_separated'))
 
+    def compute_has_moon_runes(self, event=None):
+        if event is None:
+            event = self.event
+
+        if event.badges_event_meta is None:
+            return False
+
+        fields = self.get_csv_fields(event)
+        printable_text = '\n'.join(str(value) for value in self.get_csv_row(event, fields, 'comma_separated'))
+
+        return contains_moon_runes(printable_text)
+
+    @classmethod
+    def refresh_has_moon_runes(cls, badges):
+        """
+        Recomputes has_moon_runes of the badges after something they print, such as the name of the personnel class
+        or the badge layout of the event, has changed. Changed badges are stored with at most two UPDATEs.
+        """
+        badge_ids_by_value = {True: [], False: []}
+
+        for badge in badges.select_related('personnel_class__event', 'person'):
+            has_moon_runes = badge.compute_has_moon_runes()
+            if has_moon_runes != badge.has_moon_runes:
+                badge_ids_by_value[has_moon_runes].append(badge.id)
+
+        for has_moon_runes, badge_ids in badge_ids_by_value.items():
+            if badge_ids:
+                cls.objects.filter(id__in=badge_ids).update(has_moon_runes=has_moon_runes)
+
+    def save(self, *args, **kwargs):
+        if self.personnel_class_id is not None:
+            self.has_moon_runes = self.compute_has_moon_runes()
+
+        return super(Badge, self).save(*args, **kwargs)
+
     def to_html_print(self):
         def format_name_field(value, is_visible):
             if is_visible:
@@ -350,3 +490,29 @@ class Badge(models.Model, CsvExportMixin):
             personnel_class_name=self.personnel_class_name,
             event_name=self.event_name,
         )
+
+
+@receiver(post_save, sender='labour.PersonnelClass')
+def personnel_class_post_save(sender, instance, created, **kwargs):
+    if not created and not kwargs.get('raw'):
+        Badge.refresh_has_moon_runes(Badge.objects.filter(personnel_class=instance))
+
+
+@receiver(post_save, sender='badges.BadgesEventMeta')
+def badges_event_meta_post_save(sender, instance, created, **kwargs):
+    if not created and not kwargs.get('raw'):
+        Badge.refresh_has_moon_runes(Badge.objects.filter(personnel_class__event=instance.event))
+
+
+@receiver(post_save, sender=Badge)
+@receiver(post_delete, sender=Badge)
+def badge_post_change(sender, instance, **kwargs):
+    from labour.models import PersonnelClass
+
+    event_id = (
+        PersonnelClass.objects.filter(id=instance.personnel_class_id)
+            .values_list('event_id', flat=True)
+            .first()
+    )
+    if event_id is not None:
+        invalidate_badge_counts(event_id)
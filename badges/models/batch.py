@@ -9,6 +9,7 @@ from six import text_type
 from core.utils import time_bool_property
 
 from .constants import BADGE_ELIGIBLE_FOR_BATCHING
+from .count_badges_mixin import invalidate_badge_counts
 
 
 def contains_moon_runes(unicode_str):
@@ -41,42 +42,45 @@ class Batch(models.Model):
         else:
             badges = Badge.objects.filter(personnel_class__event=event)
 
+        badges = badges.filter(**BADGE_ELIGIBLE_FOR_BATCHING)
+
         if moon_rune_policy == 'onlyinclude':
-            fields = Badge.get_csv_fields(event)
-            test = lambda badge: contains_moon_runes(badge.get_printable_text(fields))
+            badges = badges.filter(has_moon_runes=True)
         elif moon_rune_policy == 'exclude':
-            fields = Badge.get_csv_fields(event)
-            test = lambda badge: not contains_moon_runes(badge.get_printable_text(fields))
+            badges = badges.filter(has_moon_runes=False)
         elif moon_rune_policy == 'dontcare':
-            test = lambda badge: True
+            pass
         else:
             raise NotImplementedError(moon_rune_policy)
 
+        badge_ids = badges.order_by('created_at', 'id').values('id')
+        if max_items is not None:
+            badge_ids = badge_ids[:max_items]
+
         with transaction.atomic():
             batch = cls(personnel_class=personnel_class, event=event)
             batch.save()
 
-            badges = badges.filter(**BADGE_ELIGIBLE_FOR_BATCHING).order_by('created_at')
-            num_selected_badges = 0
-
-            for badge in badges:
-                if test(badge):
-                    badge.batch = batch
-                    badge.save()
+            # UPDATE ... WHERE id IN (SELECT ... LIMIT max_items)
+            # Eligibility is checked again so that concurrently created batches do not steal each other's badges.
+            Badge.objects.filter(id__in=badge_ids, **BADGE_ELIGIBLE_FOR_BATCHING).update(
+                batch=batch,
+                updated_at=now(),
+            )
 
-                    num_selected_badges += 1
-                    if max_items is not None and num_selected_badges >= max_items:
-                        break
+        invalidate_badge_counts(event.id)
 
         return batch
 
     def confirm(self):
         self.printed_at = now()
         self.save()
+        invalidate_badge_counts(self.event_id)
 
     def cancel(self):
         self.badges.update(batch=None)
         self.delete()
+        invalidate_badge_counts(self.event_id)
 
     def can_cancel(self):
         return self.printed_at is not None
@@ -1,13 +1,20 @@
 # encoding: utf-8
 
+from collections import namedtuple
 from itertools import cycle
 
-from django.db.models import Q
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Q
 from django.utils.translation import ugettext_lazy as _
 
 from .constants import BADGE_ELIGIBLE_FOR_BATCHING, PROGRESS_ELEMENT_MIN_WIDTH
 
 
+BADGE_COUNTS_CACHE_SECONDS = 10
+BADGE_COUNTS_CACHE_KEY_TEMPLATE = 'badges:counts:{event_id}'
+
+
 class Progress(object):
     __slots__ = [
         'css_class',
@@ -21,23 +28,110 @@ class Progress(object):
     from core.utils import simple_object_repr as __repr__
 
 
+class BadgeCounts(namedtuple('BadgeCounts', [
+    'printed',
+    'revoked',
+    'waiting_in_batch',
+    'awaiting_batch',
+    'total',
+])):
+    @classmethod
+    def get_annotations(cls):
+        return dict(
+            printed=Count('id', filter=Q(batch__printed_at__isnull=False) | Q(printed_separately_at__isnull=False)),
+            revoked=Count('id', filter=Q(revoked_at__isnull=False)),
+            waiting_in_batch=Count('id', filter=Q(
+                batch__isnull=False,
+                batch__printed_at__isnull=True,
+                revoked_at__isnull=True,
+            )),
+            awaiting_batch=Count('id', filter=Q(**BADGE_ELIGIBLE_FOR_BATCHING)),
+            total=Count('id'),
+        )
+
+    @classmethod
+    def aggregate(cls, badges):
+        return cls(**badges.order_by().aggregate(**cls.get_annotations()))
+
+    @classmethod
+    def get_by_personnel_class(cls, event, use_cache=False):
+        """
+        Returns the badge counts of all personnel classes of the event with one grouped query as a dict keyed by
+        personnel class ID. Personnel classes without badges are left out. With use_cache, the result is cached for
+        BADGE_COUNTS_CACHE_SECONDS, which is meant for dashboards that are refreshed all the time on print day. The
+        cached counts are dropped by invalidate_badge_counts when batches are created or badges change.
+        """
+        from .badge import Badge
+
+        cache = caches['default']
+        cache_key = BADGE_COUNTS_CACHE_KEY_TEMPLATE.format(event_id=event.id)
+
+        if use_cache:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        counts = {
+            row.pop('personnel_class_id'): cls(**row)
+            for row in Badge.objects.filter(
+                personnel_class__event=event,
+            ).order_by().values('personnel_class_id').annotate(**cls.get_annotations())
+        }
+
+        if use_cache:
+            cache.set(cache_key, counts, BADGE_COUNTS_CACHE_SECONDS)
+
+        return counts
+
+    @classmethod
+    def sum(cls, counts):
+        return cls(*(sum(column) for column in zip(cls.zero(), *counts)))
+
+    @classmethod
+    def zero(cls):
+        return cls(0, 0, 0, 0, 0)
+
+
+def invalidate_badge_counts(event_id):
+    """
+    Drops the cached badge counts of the event. It is dropped again once the current transaction has been
+    committed so that counts computed by a concurrent request before the commit do not linger.
+    """
+    cache = caches['default']
+    cache_key = BADGE_COUNTS_CACHE_KEY_TEMPLATE.format(event_id=event_id)
+
+    cache.delete(cache_key)
+    transaction.on_commit(lambda: cache.delete(cache_key))
+
+
 class CountBadgesMixin(object):
+    """
+    Requires the badges property. The counts are computed with one query when first needed, unless they have been
+    provided with set_badge_counts.
+    """
+
+    def get_badge_counts(self):
+        if getattr(self, '_badge_counts', None) is None:
+            self._badge_counts = BadgeCounts.aggregate(self.badges)
+        return self._badge_counts
+
+    def set_badge_counts(self, badge_counts):
+        self._badge_counts = badge_counts
+
     def count_printed_badges(self):
-        return self.badges.filter(
-            Q(batch__isnull=False, batch__printed_at__isnull=False) | Q(printed_separately_at__isnull=False)
-        ).distinct().count()
+        return self.get_badge_counts().printed
 
     def count_badges_waiting_in_batch(self):
-        return self.badges.filter(batch__isnull=False, batch__printed_at__isnull=True, revoked_at__isnull=True).count()
+        return self.get_badge_counts().waiting_in_batch
 
     def count_badges_awaiting_batch(self):
-        return self.badges.filter(**BADGE_ELIGIBLE_FOR_BATCHING).count()
+        return self.get_badge_counts().awaiting_batch
 
     def count_badges(self):
-        return self.badges.count()
+        return self.get_badge_counts().total
 
     def count_revoked_badges(self):
-        return self.badges.filter(revoked_at__isnull=False).count()
+        return self.get_badge_counts().revoked
 
     def get_progress(self):
         """
@@ -51,15 +145,16 @@ class CountBadgesMixin(object):
         progress bars, not just this particular occasion.
         """
         progress = []
+        badge_counts = self.get_badge_counts()
 
-        pb_max = self.count_badges()
+        pb_max = badge_counts.total
         percentace_consumed_for_inflation = 0
 
         for pb_class, pb_text, pb_value in [
-            ('progress-bar-success', _('Printed'), self.count_printed_badges()),
-            ('progress-bar-danger', _('Revoked'), self.count_revoked_badges()),
-            ('progress-bar-info', _('Waiting in batch'), self.count_badges_waiting_in_batch()),
-            ('progress-bar-grey', _('Awaiting allocation into batch'), self.count_badges_awaiting_batch()),
+            ('progress-bar-success', _('Printed'), badge_counts.printed),
+            ('progress-bar-danger', _('Revoked'), badge_counts.revoked),
+            ('progress-bar-info', _('Waiting in batch'), badge_counts.waiting_in_batch),
+            ('progress-bar-grey', _('Awaiting allocation into batch'), badge_counts.awaiting_batch),
         ]:
 
             if pb_value > 0:
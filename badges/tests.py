@@ -9,7 +9,7 @@ from core.models import Person
 from labour.models import LabourEventMeta, Signup, JobCategory, PersonnelClass
 from programme.models import ProgrammeEventMeta, Programme, ProgrammeRole, Role
 
-from .models import BadgesEventMeta, Badge, Batch
+from .models import BadgeCounts, BadgesEventMeta, Badge, Batch
 
 
 logger = logging.getLogger('kompassi')
@@ -103,6 +103,26 @@ class BadgesTestCase(TestCase):
         assert not created
         assert badge.job_title == jc2.name
 
+    def test_reconcile(self):
+        signup, unused = Signup.get_or_create_dummy(accepted=True)
+        badge, created = Badge.ensure(person=self.person, event=self.event)
+        batch = Batch.create(event=self.event)
+
+        # change the job title behind the back of apply_state
+        Signup.objects.filter(id=signup.id).update(job_title='Chief Hitman Commander to the Queen')
+
+        created, revoked = Badge.reconcile(self.event)
+        assert [badge.job_title for badge in created] == ['Chief Hitman Commander to the Queen']
+        assert [badge.id for badge in revoked] == [badge.id]
+
+        badge = Badge.objects.get(id=badge.id)
+        assert badge.is_revoked
+        assert badge.batch == batch
+
+        created, revoked = Badge.reconcile(self.event)
+        assert not created
+        assert not revoked
+
     def test_condb_429(self):
         """
         If a badge is revoked before it is printed or assigned into a batch, there is no need to
@@ -144,6 +164,71 @@ class BadgesTestCase(TestCase):
         assert created
         assert not badge.is_revoked
 
+    def test_batch_moon_rune_policy(self):
+        signup, unused = Signup.get_or_create_dummy(accepted=True)
+        badge, created = Badge.ensure(person=self.person, event=self.event)
+        assert not badge.has_moon_runes
+
+        badge.job_title = '月のルーン'
+        badge.save()
+        assert badge.has_moon_runes
+
+        batch = Batch.create(event=self.event, moon_rune_policy='exclude')
+        assert not batch.badges.exists()
+
+        batch = Batch.create(event=self.event, moon_rune_policy='onlyinclude', max_items=1)
+        assert list(batch.badges.all()) == [badge]
+
+    def test_moon_runes_follow_personnel_class(self):
+        signup, unused = Signup.get_or_create_dummy(accepted=True)
+        badge, created = Badge.ensure(person=self.person, event=self.event)
+        assert not badge.has_moon_runes
+
+        personnel_class = badge.personnel_class
+        personnel_class.name = '月のルーン'
+        personnel_class.save()
+
+        badge.refresh_from_db()
+        assert badge.has_moon_runes
+
+        batch = Batch.create(event=self.event, moon_rune_policy='exclude')
+        assert not batch.badges.exists()
+
+    def test_badge_counts(self):
+        signup, unused = Signup.get_or_create_dummy(accepted=True)
+        badge, created = Badge.ensure(person=self.person, event=self.event)
+        Batch.create(event=self.event)
+
+        counts = BadgeCounts.get_by_personnel_class(self.event)
+        assert counts == {badge.personnel_class_id: BadgeCounts(
+            printed=0,
+            revoked=0,
+            waiting_in_batch=1,
+            awaiting_batch=0,
+            total=1,
+        )}
+        assert BadgeCounts.sum(counts.values()) == BadgeCounts.aggregate(self.meta.badges)
+        assert self.meta.count_badges_waiting_in_batch() == 1
+
+    def test_cached_badge_counts_follow_changes(self):
+        signup, unused = Signup.get_or_create_dummy(accepted=True)
+        badge, created = Badge.ensure(person=self.person, event=self.event)
+
+        def get_cached_counts():
+            return BadgeCounts.get_by_personnel_class(self.event, use_cache=True)[badge.personnel_class_id]
+
+        assert get_cached_counts().awaiting_batch == 1
+
+        batch = Batch.create(event=self.event)
+        assert get_cached_counts().waiting_in_batch == 1
+
+        batch.confirm()
+        assert get_cached_counts().printed == 1
+
+        badge.refresh_from_db()
+        badge.revoke()
+        assert get_cached_counts().revoked == 1
+
     def test_condb_137_intra_labour(self):
         """
         If the personnel class of the worker changes, the badge shall be revoked and a new one issued.
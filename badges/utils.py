@@ -1,5 +1,7 @@
 # encoding: utf-8
 
+from collections import defaultdict
+
 from labour.models import PersonnelClass
 
 
@@ -43,15 +45,21 @@ def default_badge_factory(event, person):
             ).order_by('role__priority')
         )
 
+    return make_badge_opts(event.badges_event_meta, person, personnel_classes)
+
+
+def make_badge_opts(meta, person, personnel_classes):
+    """
+    Given (personnel_class, job_title) pairs, most privileged first, builds the badge options returned by
+    default_badge_factory.
+    """
     if personnel_classes:
-        personnel_classes.sort(key=get_priority)
+        personnel_classes = sorted(personnel_classes, key=get_priority)
         personnel_class, job_title = personnel_classes[0]
     else:
         personnel_class = None
         job_title = 'THIS BADGE SHOULD NOT PRINT' # This should never get printed.
 
-    meta = event.badges_event_meta
-
     return dict(
         first_name=person.first_name,
         is_first_name_visible=meta.real_name_must_be_visible or person.is_first_name_visible,
@@ -62,3 +70,74 @@ def default_badge_factory(event, person):
         personnel_class=personnel_class,
         job_title=job_title,
     )
+
+
+def default_badge_factory_for_event(event, person_ids=None):
+    """
+    Does what default_badge_factory does for many people of an event at once with a handful of queries. Returns a
+    dictionary mapping person IDs to badge options.
+
+    If person_ids is not given, the people considered are those who have a signup or a programme role in the event
+    or an un-revoked badge for it.
+    """
+    from core.models import Person
+
+    from .models import Badge
+
+    personnel_classes_by_person_id = defaultdict(list)
+    signups = []
+    programme_roles = None
+
+    if event.labour_event_meta is not None:
+        from labour.models import Signup
+
+        signups = Signup.objects.filter(event=event).prefetch_related('personnel_classes', 'job_categories_accepted')
+        if person_ids is not None:
+            signups = signups.filter(person_id__in=person_ids)
+
+    if event.programme_event_meta is not None:
+        from programme.models import ProgrammeRole
+
+        programme_roles = ProgrammeRole.objects.filter(programme__category__event=event)
+        if person_ids is not None:
+            programme_roles = programme_roles.filter(person_id__in=person_ids)
+
+    if person_ids is None:
+        person_ids = set(Badge.objects.filter(
+            personnel_class__event=event,
+            person__isnull=False,
+            revoked_at__isnull=True,
+        ).values_list('person_id', flat=True))
+        person_ids.update(signup.person_id for signup in signups)
+        if programme_roles is not None:
+            person_ids.update(programme_roles.values_list('person_id', flat=True))
+
+    for signup in signups:
+        if not signup.is_active:
+            continue
+
+        if signup.job_title:
+            job_title = signup.job_title
+        else:
+            job_categories = sorted(signup.job_categories_accepted.all(), key=lambda jc: (jc.name, jc.id))
+            job_title = job_categories[0].name if job_categories else 'Työvoima'
+
+        personnel_classes_by_person_id[signup.person_id].extend(
+            (pc, job_title) for pc in signup.personnel_classes.all()
+        )
+
+    if programme_roles is not None:
+        # Insertion order matters (most privileged first). list.sort is guaranteed to be stable.
+        for programme_role in programme_roles.filter(
+            programme__state__in=['accepted', 'published'],
+        ).select_related('role__personnel_class').order_by('role__priority'):
+            personnel_classes_by_person_id[programme_role.person_id].append(
+                (programme_role.role.personnel_class, programme_role.role.public_title)
+            )
+
+    meta = event.badges_event_meta
+
+    return {
+        person.id: make_badge_opts(meta, person, personnel_classes_by_person_id[person.id])
+        for person in Person.objects.filter(id__in=person_ids)
+    }
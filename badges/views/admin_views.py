@@ -15,7 +15,7 @@ from core.csv_export import csv_response, CSV_EXPORT_FORMATS
 from labour.models import PersonnelClass
 
 from ..forms import CreateBatchForm, BadgeForm, HiddenBadgeCrouchingForm
-from ..models import Badge, Batch, CountBadgesMixin
+from ..models import BadgeCounts, Badge, Batch, CountBadgesMixin
 from ..helpers import badges_admin_required
 
 
@@ -42,11 +42,18 @@ class PersonnelClassProxy(CountBadgesMixin):
 def badges_admin_dashboard_view(request, vars, event):
     meta = event.badges_event_meta
 
+    badge_counts = BadgeCounts.get_by_personnel_class(event, use_cache=True)
+    meta.set_badge_counts(BadgeCounts.sum(badge_counts.values()))
+
+    personnel_classes = [
+        PersonnelClassProxy(personnel_class)
+        for personnel_class in PersonnelClass.objects.filter(event=event)
+    ]
+    for personnel_class in personnel_classes:
+        personnel_class.set_badge_counts(badge_counts.get(personnel_class.target.id, BadgeCounts.zero()))
+
     vars.update(
-        personnel_classes=[
-            PersonnelClassProxy(personnel_class)
-            for personnel_class in PersonnelClass.objects.filter(event=event)
-        ],
+        personnel_classes=personnel_classes,
         num_badges_total=meta.count_badges(),
         num_badges_printed=meta.count_printed_badges(),
         num_badges_waiting_in_batch=meta.count_badges_waiting_in_batch(),
@@ -1,14 +1,30 @@
 # encoding: utf-8
-from collections import namedtuple
+from collections import OrderedDict, defaultdict, namedtuple
+from secrets import token_hex
+from tempfile import TemporaryFile
+from threading import Lock
+from time import monotonic
 
 import unicodecsv as csv
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, StreamingHttpResponse
 from django.db import models
+from django.db.models import prefetch_related_objects
+from django.db.models.signals import post_delete, post_save
 
 
 ENCODING = 'ISO-8859-15'
 
+# Number of rows fetched from the database at a time when exporting a queryset
+EXPORT_CHUNK_SIZE = 2000
+
+# Limits of the per-process cache of export metadata (choice lists, export fields)
+EXPORT_METADATA_CACHE_SIZE = 256
+EXPORT_METADATA_CACHE_SECONDS = 300
+
 
 ExportFormat = namedtuple('ExportFormat', [
     'name',
@@ -47,9 +63,22 @@ class CsvExportMixin(object):
     def get_csv_related(self):
         return dict()
 
+    @classmethod
+    def prefetch_csv_related(cls, model_instances):
+        """
+        Called by prepare_csv_export with a chunk of instances about to be exported. Override to load whatever
+        get_csv_related needs for all of them at once.
+        """
+        pass
+
     def get_csv_row(self, event, fields, m2m_mode='separate_columns'):
         result_row = []
-        related = self.get_csv_related()
+        related = getattr(self, '_csv_related', None)
+        if related is None:
+            related = self.get_csv_related()
+
+        # set by prepare_csv_export
+        m2m_choice_ids = getattr(self, '_csv_m2m_choice_ids', {})
 
         for model, field in fields:
             if isinstance(field, str):
@@ -69,11 +98,15 @@ class CsvExportMixin(object):
             if field_type is models.ManyToManyField and field_value is not None:
                 if m2m_mode == 'separate_columns':
                     choices = get_m2m_choices(event, field)
-
-                    result_row.extend(
-                        field_value.filter(pk=choice.pk).exists()
-                        for choice in choices
-                    )
+                    choice_ids = m2m_choice_ids.get((model, field_name))
+
+                    if choice_ids is not None:
+                        result_row.extend(choice.pk in choice_ids for choice in choices)
+                    else:
+                        result_row.extend(
+                            field_value.filter(pk=choice.pk).exists()
+                            for choice in choices
+                        )
                 elif m2m_mode == 'comma_separated':
                     result_row.append(', '.join(item.__str__() for item in field_value.all()))
                 else:
@@ -118,23 +151,117 @@ def write_header_row(event, writer, fields, m2m_mode='separate_columns'):
     writer.writerow(header_row)
 
 
+ExportMetadataCacheEntry = namedtuple('ExportMetadataCacheEntry', [
+    'value',
+    'created_at',
+    'invalidated_by',
+])
+
+
+class ExportMetadataCache(object):
+    """
+    Per-process LRU cache for export metadata that is expensive to compute but rarely changes, such as the lists of
+    many-to-many choices and the export fields of an event. Keys are tuples whose second item is the event id.
+
+    Entries are dropped when any of the models they depend on is saved or deleted in this process, and expire after
+    max_age_seconds so that changes made by other processes are picked up, too.
+    """
+
+    def __init__(self, max_size, max_age_seconds):
+        self.max_size = max_size
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get_or_compute(self, key, compute, invalidated_by=()):
+        now = monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.created_at < self.max_age_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.value
+
+            self.misses += 1
+
+        for model in invalidated_by:
+            self._connect(model)
+
+        value = compute()
+
+        with self._lock:
+            self._entries[key] = ExportMetadataCacheEntry(value, now, frozenset(invalidated_by))
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return value
+
+    def invalidate(self, model, event_id=None):
+        """
+        Drops the entries that depend on the model. If event_id is given, only the entries of that event are dropped.
+        """
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if model in entry.invalidated_by and (event_id is None or key[1] == event_id):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self):
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                size=len(self._entries),
+                max_size=self.max_size,
+            )
+
+    def _connect(self, model):
+        dispatch_uid = 'core.csv_export.ExportMetadataCache:{id}:{label}'.format(
+            id=id(self),
+            label=model._meta.label_lower,
+        )
+
+        post_save.connect(self._handle_change, sender=model, weak=False, dispatch_uid=dispatch_uid)
+        post_delete.connect(self._handle_change, sender=model, weak=False, dispatch_uid=dispatch_uid)
+
+    def _handle_change(self, sender, instance, **kwargs):
+        self.invalidate(sender, getattr(instance, 'event_id', None))
+
+
+export_metadata_cache = ExportMetadataCache(
+    max_size=EXPORT_METADATA_CACHE_SIZE,
+    max_age_seconds=EXPORT_METADATA_CACHE_SECONDS,
+)
+
+
 def get_m2m_choices(event, field):
+    """
+    Returns the choices of a many-to-many field as a list ordered by primary key. Choice models that have an event
+    are limited to the choices of the event.
+    """
     target_model = field.related_model
-    cache_key = (event.id, target_model._meta.app_label, target_model._meta.model_name)
-
-    if cache_key not in get_m2m_choices.cache:
+    cache_key = ('m2m_choices', event.id, target_model._meta.label_lower)
 
+    def compute():
         if any(f.name == 'event' for f in target_model._meta.fields):
             choices = target_model.objects.filter(event=event)
         else:
             choices = target_model.objects.all()
 
-        get_m2m_choices.cache[cache_key] = choices.order_by('pk')
-
-    return get_m2m_choices.cache[cache_key]
-
+        return list(choices.order_by('pk'))
 
-get_m2m_choices.cache = {}
+    return export_metadata_cache.get_or_compute(cache_key, compute, invalidated_by=[target_model])
 
 
 def write_row(event, writer, fields, model_instance, m2m_mode):
@@ -150,44 +277,219 @@ def make_writer(output_stream, dialect):
         return csv.writer(output_stream, encoding=ENCODING, dialect=dialect, errors='ignore')
 
 
-def export_csv(event, model, model_instances, output_file, m2m_mode='separate_columns', dialect='excel-tab'):
+def get_export_fields(event, model, model_instances):
     # XXX Horrible hack.
     try:
         # EventSurveys force us to get this from an instance instead of the model class because they may differ
-        fields = model_instances[0].get_csv_fields(event)
+        return model_instances[0].get_csv_fields(event)
     except IndexError:
         # empty set, use the old way
-        fields = model.get_csv_fields(event)
-    writer = make_writer(output_file, dialect)
+        return model.get_csv_fields(event)
 
-    write_header_row(event, writer, fields, m2m_mode)
+
+def iterate_model_instances(model, model_instances):
+    """
+    Iterates over querysets in chunks instead of loading them to memory at once. Prefetches would be lost with
+    .iterator() so querysets that have them are iterated over normally.
+    """
+    if isinstance(model_instances, models.QuerySet) and not model_instances._prefetch_related_lookups:
+        model_instances = model_instances.iterator(chunk_size=EXPORT_CHUNK_SIZE)
 
     for model_instance in model_instances:
         if isinstance(model_instance, (str, int)):
-            model_instance = model.objects.get(pk=int(model_instances))
+            model_instance = model.objects.get(pk=int(model_instance))
+
+        yield model_instance
+
+
+def prepare_csv_export(event, fields, model_instances, m2m_mode):
+    """
+    Export planner. Given a list of instances about to be exported, loads their related objects, foreign keys and,
+    in separate_columns mode, many-to-many choices with a constant number of queries per field instead of per row.
+    The results are stashed on the instances for get_csv_row.
+    """
+    model_instances = [instance for instance in model_instances if isinstance(instance, CsvExportMixin)]
+    if not model_instances:
+        return
+
+    type(model_instances[0]).prefetch_csv_related(model_instances)
+
+    for instance in model_instances:
+        instance._csv_related = instance.get_csv_related()
+        instance._csv_m2m_choice_ids = {}
+
+    def get_source_instances(model):
+        for instance in model_instances:
+            source_instance = instance._csv_related.get(model) if model in instance._csv_related else instance
+            if source_instance is not None:
+                yield instance, source_instance
+
+    for model, field in fields:
+        field_type = type(field) if not isinstance(field, str) else None
 
+        if field_type is models.ForeignKey:
+            source_instances = [source_instance for (unused, source_instance) in get_source_instances(model)]
+            prefetch_related_objects(source_instances, field.name)
+
+        elif field_type is models.ManyToManyField and m2m_mode == 'separate_columns':
+            instances_and_sources = list(get_source_instances(model))
+            source_attname = field.m2m_field_name()
+            target_attname = field.m2m_reverse_field_name()
+
+            choice_ids_by_source = defaultdict(set)
+            for source_id, target_id in field.remote_field.through.objects.filter(**{
+                source_attname + '__in': [source_instance.pk for (unused, source_instance) in instances_and_sources],
+            }).values_list(source_attname, target_attname):
+                choice_ids_by_source[source_id].add(target_id)
+
+            for instance, source_instance in instances_and_sources:
+                instance._csv_m2m_choice_ids[model, field.name] = choice_ids_by_source.get(source_instance.pk, set())
+
+
+def iterate_prepared_model_instances(event, model, model_instances, fields, m2m_mode):
+    chunk = []
+
+    for model_instance in iterate_model_instances(model, model_instances):
+        chunk.append(model_instance)
+
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            prepare_csv_export(event, fields, chunk, m2m_mode)
+            yield from chunk
+            chunk = []
+
+    prepare_csv_export(event, fields, chunk, m2m_mode)
+    yield from chunk
+
+
+def export_csv(event, model, model_instances, output_file, m2m_mode='separate_columns', dialect='excel-tab'):
+    fields = get_export_fields(event, model, model_instances)
+    writer = make_writer(output_file, dialect)
+
+    write_header_row(event, writer, fields, m2m_mode)
+
+    for model_instance in iterate_prepared_model_instances(event, model, model_instances, fields, m2m_mode):
         write_row(event, writer, fields, model_instance, m2m_mode)
 
     if getattr(writer, 'must_close', False):
         writer.close()
 
 
+class RowBuffer(object):
+    """
+    A file-like object that holds only what has been written since the last .pop().
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(data)
+
+    def pop(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def stream_csv(event, model, model_instances, m2m_mode='separate_columns', dialect='excel-tab'):
+    """
+    Like export_csv, but yields the CSV row by row. Not available for XLSX.
+    """
+    fields = get_export_fields(event, model, model_instances)
+    buffer = RowBuffer()
+    writer = make_writer(buffer, dialect)
+
+    write_header_row(event, writer, fields, m2m_mode)
+    yield buffer.pop()
+
+    for model_instance in iterate_prepared_model_instances(event, model, model_instances, fields, m2m_mode):
+        write_row(event, writer, fields, model_instance, m2m_mode)
+        yield buffer.pop()
+
+
 CONTENT_TYPES = dict(
     xlsx='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
 )
 
 
 def csv_response(*args, **kwargs):
+    """
+    CSV and TSV are streamed to the client as they are generated. XLSX cannot be streamed, so it is written into a
+    temporary file which is then sent.
+    """
     filename = kwargs.pop('filename')
     dialect = kwargs.get('dialect', 'excel')
+    content_type = CONTENT_TYPES.get(dialect, 'text/csv')
+
+    if dialect == 'xlsx':
+        output_file = TemporaryFile()
+        export_csv(*args, output_file=output_file, **kwargs)
+        output_file.seek(0)
+
+        response = FileResponse(output_file, content_type=content_type)
+    else:
+        response = StreamingHttpResponse(stream_csv(*args, **kwargs), content_type=content_type)
 
-    response = HttpResponse(content_type=CONTENT_TYPES.get(dialect, 'text/csv'))
     response['Content-Disposition'] = 'attachment; filename="{filename}"'.format(
         filename=filename
     )
 
-    kwargs['output_file'] = response
+    return response
 
-    export_csv(*args, **kwargs)
 
-    return response
+def get_export_storage():
+    """
+    Exports contain personal information, so they are not stored under MEDIA_ROOT but in EXPORT_ROOT which is only
+    accessible via core_export_download_view.
+    """
+    return FileSystemStorage(location=settings.EXPORT_ROOT)
+
+
+def get_export_path(user_id, token, filename):
+    return '{user_id}/{token}/{filename}'.format(user_id=user_id, token=token, filename=filename)
+
+
+def export_to_storage(event, model, model_instances, path, m2m_mode='separate_columns', dialect='excel'):
+    with TemporaryFile() as output_file:
+        export_csv(event, model, model_instances, output_file, m2m_mode=m2m_mode, dialect=dialect)
+        output_file.seek(0)
+        return get_export_storage().save(path, File(output_file))
+
+
+def start_background_export(request, event, model, model_instances, filename, **kwargs):
+    """
+    Runs the export in a background task that writes the file into EXPORT_ROOT and e-mails the requesting user a
+    download link once it is ready. Returns False without doing anything if background tasks are not available, in
+    which case the caller should fall back to csv_response.
+    """
+    if 'background_tasks' not in settings.INSTALLED_APPS:
+        return False
+
+    from .tasks import export_to_storage_async
+    from .utils import url
+
+    token = token_hex(16)
+    path = get_export_path(request.user.id, token, filename)
+    link = request.build_absolute_uri(url('core_export_download_view', token, filename))
+
+    # only the primary keys are needed, so querysets are not turned into model instances here
+    if isinstance(model_instances, models.QuerySet):
+        pks = list(model_instances.values_list('pk', flat=True))
+    else:
+        pks = [
+            int(model_instance) if isinstance(model_instance, (str, int)) else model_instance.pk
+            for model_instance in model_instances
+        ]
+
+    export_to_storage_async.delay(
+        event_label=event._meta.label,
+        event_id=event.pk,
+        model_label=model._meta.label,
+        pks=pks,
+        path=path,
+        link=link,
+        email=request.user.email,
+        **kwargs
+    )
+
+    return True
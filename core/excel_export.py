@@ -1,11 +1,12 @@
-import io
-
 import xlsxwriter
 
 
 class XlsxWriter(object):
     """
-    An almost csv.writer compatible wrapper for XlsxWriter. Horribly inefficient.
+    An almost csv.writer compatible wrapper for XlsxWriter. Uses the constant memory mode of XlsxWriter in which
+    each row is flushed to a temporary file once the next one is started, so rows must be written in order.
+
+    The output stream must be a seekable binary file, eg. a TemporaryFile.
 
     Must .close() to get the data actually written. Use getattr(writer, 'must_close', False)
     to distinguish from an actual csv.writer.
@@ -13,9 +14,7 @@ class XlsxWriter(object):
 
     def __init__(self, output_stream):
         self.row = 0
-        self.output_stream = output_stream
-        self.buf = io.BytesIO()
-        self.workbook = xlsxwriter.Workbook(self.buf)
+        self.workbook = xlsxwriter.Workbook(output_stream, {'constant_memory': True})
         self.worksheet = self.workbook.add_worksheet()
         self.must_close = True
 
@@ -34,6 +33,3 @@ class XlsxWriter(object):
 
     def close(self):
         self.workbook.close()
-        self.buf.seek(0)
-        self.output_stream.write(self.buf.read())
-        self.buf.close()
@@ -37,3 +37,23 @@ def person_apply_state_new_user_async(person_id, password):
 @shared_task(ignore_result=True)
 def run_admin_command(*args, **kwargs):
     call_command(*args, **kwargs)
+
+
+@shared_task(ignore_result=True)
+def export_to_storage_async(event_label, event_id, model_label, pks, path, link, email, **kwargs):
+    from django.apps import apps
+    from .csv_export import export_to_storage
+
+    event = apps.get_model(event_label).objects.get(pk=event_id)
+    model = apps.get_model(model_label)
+    model_instances_by_pk = model.objects.in_bulk(pks)
+    model_instances = [model_instances_by_pk[pk] for pk in pks if pk in model_instances_by_pk]
+
+    export_to_storage(event, model, model_instances, path, **kwargs)
+
+    EmailMessage(
+        subject='{event}: Tiedosto valmis'.format(event=event),
+        body='Pyytämäsi tiedosto on valmis ladattavaksi osoitteessa:\n\n{link}\n'.format(link=link),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=(email,),
+    ).send(fail_silently=False)
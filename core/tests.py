@@ -1,11 +1,14 @@
 from datetime import datetime, timedelta
 
 from django.forms import ValidationError
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from babel import Locale
 from dateutil.tz import tzlocal
 
+from .csv_export import ExportMetadataCache, csv_response, export_metadata_cache, get_m2m_choices
 from .utils import full_hours_between, slugify, format_interval
 
 
@@ -113,3 +116,65 @@ class UtilsTestCase(TestCase):
             format_interval(d0, d2, locale=locale),
             'ke 27.4. klo 21.00 – to 28.4. klo 1.00'
         )
+
+
+class CsvExportTestCase(TestCase):
+    def test_csv_response(self):
+        from labour.models import Signup
+
+        signup, unused = Signup.get_or_create_dummy()
+        signups = Signup.objects.filter(event=signup.event)
+
+        response = csv_response(signup.event, Signup, signups, dialect='excel', filename='signups.csv')
+        rows = b''.join(response.streaming_content).decode('ISO-8859-15').splitlines()
+        assert len(rows) == 2
+        assert rows[0].startswith('id,')
+        assert rows[1].startswith('{signup.person.id},'.format(signup=signup))
+
+        response = csv_response(signup.event, Signup, signups, dialect='xlsx', filename='signups.xlsx')
+        assert b''.join(response.streaming_content).startswith(b'PK')
+
+    def test_queries_do_not_depend_on_rows(self):
+        from core.models import Person
+        from labour.models import Signup
+
+        signup, unused = Signup.get_or_create_dummy()
+
+        def count_queries():
+            signups = Signup.objects.filter(event=signup.event)
+            with CaptureQueriesContext(connection) as context:
+                response = csv_response(signup.event, Signup, signups, dialect='excel', filename='signups.csv')
+                b''.join(response.streaming_content)
+            return len(context.captured_queries)
+
+        # warm up process level caches (choices, content types)
+        count_queries()
+        num_queries = count_queries()
+
+        for i in range(3):
+            person = Person.objects.create(first_name='Testi', surname='Testinen {i}'.format(i=i))
+            Signup.objects.create(person=person, event=signup.event).job_categories.set(signup.job_categories.all())
+
+        assert count_queries() == num_queries
+
+    def test_export_metadata_cache(self):
+        from labour.models import JobCategory, Signup
+
+        signup, unused = Signup.get_or_create_dummy()
+        event = signup.event
+        field = Signup._meta.get_field('job_categories')
+
+        choices = get_m2m_choices(event, field)
+        stats = export_metadata_cache.get_stats()
+        assert get_m2m_choices(event, field) == choices
+        assert export_metadata_cache.get_stats()['hits'] == stats['hits'] + 1
+
+        JobCategory.objects.create(event=event, name='Uusi tehtävä')
+        assert len(get_m2m_choices(event, field)) == len(choices) + 1
+
+        cache = ExportMetadataCache(max_size=2, max_age_seconds=60)
+        for key in ['a', 'b', 'a', 'c']:
+            cache.get_or_compute((key, event.id), lambda: key)
+        assert cache.get_stats() == dict(hits=1, misses=3, size=2, max_size=2)
+        assert cache.get_or_compute(('a', event.id), lambda: 'x') == 'a'
+        assert cache.get_or_compute(('b', event.id), lambda: 'x') == 'x'
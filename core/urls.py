@@ -5,6 +5,7 @@ from .views import (
     core_email_verification_request_view,
     core_email_verification_view,
     core_event_view,
+    core_export_download_view,
     core_frontpage_view,
     core_login_view,
     core_logout_view,
@@ -53,5 +54,11 @@ urlpatterns = [
     url(r'^profile/email/verify$', core_email_verification_request_view, name='core_email_verification_request_view'),
     url(r'^profile/email/verify/(?P<code>[a-f0-9]+)$', core_email_verification_view, name='core_email_verification_view'),
 
+    url(
+        r'^profile/exports/(?P<token>[a-f0-9]+)/(?P<filename>[^/]+)$',
+        core_export_download_view,
+        name='core_export_download_view',
+    ),
+
     url(r'^impersonate/(?P<username>[a-zA-Z0-9_-]+)$', core_admin_impersonate_view, name='core_admin_impersonate_view'),
 ]
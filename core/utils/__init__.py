@@ -24,6 +24,7 @@ from .misc_utils import (
     groups_of_n,
     mutate_query_params,
     pick_attrs,
+    reconcile_group_membership,
     set_attrs,
     set_defaults,
     simple_object_init,
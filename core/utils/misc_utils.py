@@ -59,6 +59,65 @@ def ensure_user_is_member_of_group(user, group, should_belong_to_group=True):
         cr_ensure_user_group_membership(user, group.name, should_belong_to_group)
 
 
+def reconcile_group_membership(users, groups, desired_memberships):
+    """
+    Makes the memberships of the given users in the given groups match desired_memberships, a set of
+    (user_id, group_id) tuples, reading the current memberships with one query and changing them in bulk.
+    Memberships in other groups or of other users are left alone. Only the net changes are pushed to Crowd.
+
+    Returns (memberships_added, memberships_removed) as sets of (user_id, group_id) tuples.
+    """
+    from django.db import transaction
+
+    Membership = User.groups.through
+    users_by_id = {user.id: user for user in users}
+    groups_by_id = {group.id: group for group in groups}
+
+    desired_memberships = set(
+        (user_id, group_id)
+        for (user_id, group_id) in desired_memberships
+        if user_id in users_by_id and group_id in groups_by_id
+    )
+
+    with transaction.atomic():
+        current_memberships = set(
+            Membership.objects.filter(
+                user_id__in=list(users_by_id),
+                group_id__in=list(groups_by_id),
+            ).select_for_update().values_list('user_id', 'group_id')
+        )
+
+        memberships_to_add = desired_memberships - current_memberships
+        memberships_to_remove = current_memberships - desired_memberships
+
+        Membership.objects.bulk_create([
+            Membership(user_id=user_id, group_id=group_id)
+            for (user_id, group_id) in sorted(memberships_to_add)
+        ])
+
+        for group_id, memberships in groupby(sorted(memberships_to_remove, key=lambda m: m[1]), key=lambda m: m[1]):
+            Membership.objects.filter(
+                group_id=group_id,
+                user_id__in=[user_id for (user_id, unused) in memberships],
+            ).delete()
+
+    if 'crowd_integration' in settings.INSTALLED_APPS:
+        from crowd_integration.utils import ensure_user_group_membership as cr_ensure_user_group_membership
+
+        for should_belong_to_group, memberships in [
+            (True, memberships_to_add),
+            (False, memberships_to_remove),
+        ]:
+            for user_id, group_id in sorted(memberships):
+                cr_ensure_user_group_membership(
+                    users_by_id[user_id],
+                    groups_by_id[group_id].name,
+                    should_belong_to_group,
+                )
+
+    return memberships_to_add, memberships_to_remove
+
+
 def ensure_groups_exist(group_names):
     groups = [Group.objects.get_or_create(name=group_name)[0] for group_name in group_names]
 
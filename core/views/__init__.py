@@ -7,6 +7,10 @@ from .email_verification_views import (
     core_email_verification_view,
 )
 
+from .export_views import (
+    core_export_download_view,
+)
+
 from .login_views import (
     core_login_view,
     core_logout_view,
@@ -0,0 +1,21 @@
+from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, Http404
+from django.views.decorators.http import require_safe
+
+from ..csv_export import get_export_path, get_export_storage
+
+
+@login_required
+@require_safe
+def core_export_download_view(request, token, filename):
+    # Exports are stored per user, so users can only download their own exports.
+    path = get_export_path(request.user.id, token, filename)
+    storage = get_export_storage()
+
+    if not storage.exists(path):
+        raise Http404()
+
+    response = FileResponse(storage.open(path), content_type='application/octet-stream')
+    response['Content-Disposition'] = 'attachment; filename="{filename}"'.format(filename=filename)
+
+    return response
@@ -68,6 +68,12 @@ USE_TZ = True
 
 MEDIA_ROOT = mkpath('media')
 MEDIA_URL = '/media/'
+
+# Files exported in the background. Must not be publicly served.
+EXPORT_ROOT = env('EXPORT_ROOT', default=mkpath('exports'))
+
+# Pre-rendered programme schedules. Served only via the schedule views.
+PROGRAMME_SNAPSHOT_ROOT = env('PROGRAMME_SNAPSHOT_ROOT', default=mkpath('snapshots'))
 STATIC_ROOT = mkpath('static')
 STATIC_URL = '/static/'
 
@@ -387,6 +393,9 @@ if 'lippukala' in INSTALLED_APPS:
     LIPPUKALA_PRINT_LOGO_PATH = mkpath('events', 'mimicon2016', 'static', 'images', 'mimicon2016_logo.png')
     LIPPUKALA_PRINT_LOGO_SIZE_CM = (3.0, 3.0)
 
+    # Rendered e-ticket PDFs are cached here. Must not be publicly served. Set to empty to disable.
+    TICKETS_ETICKETS_CACHE_DIR = env('TICKETS_ETICKETS_CACHE_DIR', default=mkpath('tmp', 'etickets'))
+
 
 if env('BROKER_URL', default=''):
     INSTALLED_APPS = INSTALLED_APPS + ('background_tasks',)
@@ -1,5 +1,3 @@
-from sys import stderr
-
 from django.core.management.base import BaseCommand
 
 
@@ -16,11 +14,16 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         from core.models import Event
+        from badges.models import Badge
 
         for event_slug in options['event_slugs']:
             event = Event.objects.get(slug=event_slug)
+            person_ids = set(event.signup_set.values_list('person_id', flat=True))
+
+            created, revoked = Badge.reconcile(event, person_ids)
 
-            for signup in event.signup_set.all():
-                signup.apply_state_create_badges()
-                stderr.write('.')
-                stderr.flush()
+            self.stdout.write('{event_slug}: {num_created} badges created, {num_revoked} revoked'.format(
+                event_slug=event.slug,
+                num_created=len(created),
+                num_revoked=len(revoked),
+            ))
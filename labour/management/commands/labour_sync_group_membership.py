@@ -1,18 +1,34 @@
 # encoding: utf-8
 
-import sys
-
 from django.core.management.base import BaseCommand
 
+
 class Command(BaseCommand):
-    args = ''
+    args = '[event_slug...]'
     help = 'Make sure all users belong to their respective labour groups'
 
-    def handle(*args, **options):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'event_slugs',
+            nargs='*',
+            metavar='EVENT_SLUG',
+            help='Events to process (default: all events with signups)',
+        )
+
+    def handle(self, *args, **options):
+        from core.models import Event
         from labour.models import Signup
-        for signup in Signup.objects.all():
-            signup.apply_state()
-            sys.stdout.write('.')
-            sys.stdout.flush()
 
-        print()
\ No newline at end of file
+        if options['event_slugs']:
+            events = Event.objects.filter(slug__in=options['event_slugs'])
+        else:
+            events = Event.objects.filter(id__in=Signup.objects.values('event_id'))
+
+        for event in events.order_by('id'):
+            added, removed = Signup.reconcile_group_membership(event)
+
+            self.stdout.write('{event_slug}: {num_added} memberships added, {num_removed} removed'.format(
+                event_slug=event.slug,
+                num_added=len(added),
+                num_removed=len(removed),
+            ))
@@ -0,0 +1,46 @@
+# Generated by Django 2.1.5 on 2019-02-24 14:12
+
+from django.db import migrations
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_requirements(apps, schema_editor):
+    """
+    Duplicate requirements of the same job and hour used to be summed, so their counts are summed into one.
+    """
+    JobRequirement = apps.get_model('labour', 'jobrequirement')
+
+    duplicates = (
+        JobRequirement.objects
+        .order_by()
+        .values('job_id', 'start_time')
+        .annotate(num_requirements=Count('id'), total_count=Sum('count'))
+        .filter(num_requirements__gt=1)
+    )
+
+    for duplicate in duplicates:
+        requirements = JobRequirement.objects.filter(
+            job_id=duplicate['job_id'],
+            start_time=duplicate['start_time'],
+        ).order_by('id')
+
+        requirement = requirements.first()
+        requirements.exclude(id=requirement.id).delete()
+
+        requirement.count = duplicate['total_count']
+        requirement.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labour', '0033_auto_20170802_1500'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_requirements, migrations.RunPython.noop, elidable=True),
+        migrations.AlterUniqueTogether(
+            name='jobrequirement',
+            unique_together={('job', 'start_time')},
+        ),
+    ]
@@ -6,6 +6,7 @@ from .roster import (
     Job,
     JobRequirement,
     SetJobRequirementsRequest,
+    SetRequirementsRequest,
     Shift,
     WorkPeriod,
 )
@@ -14,7 +15,7 @@ from .perk import Perk
 from .personnel_class import PersonnelClass
 from .job_category import JobCategory
 from .alternative_signup_forms import AlternativeFormMixin, AlternativeSignupForm
-from .signup import Signup
+from .signup import MassStateChangeProgress, Signup
 from .signup_extras import ObsoleteSignupExtraBaseV1, ObsoleteEmptySignupExtraV1, SignupExtraBase, EmptySignupExtra
 from .info_link import InfoLink
 from .survey import Survey, SurveyRecord
@@ -8,6 +8,9 @@ from django.utils.translation import ugettext_lazy as _
 
 from core.utils import NONUNIQUE_SLUG_FIELD_PARAMS, slugify, pick_attrs, omit_keys
 
+from ..roster_changes import get_roster_changes, get_roster_version
+from ..roster_matrix import get_roster_matrix
+
 
 def format_job_categories(job_categories):
     return ", ".join(jc.name for jc in job_categories)
@@ -138,19 +141,19 @@ class JobCategory(models.Model):
 
         return [jc1, jc2]
 
-    def _make_requirements(self):
+    def _make_requirements(self, roster_matrix=None):
         """
         Returns an array of integers representing the sum of JobRequirements for this JobCategory
         where indexes correspond to those of work_hours for this event.
         """
-        from .roster import JobRequirement
-        requirements = JobRequirement.objects.filter(job__job_category=self)
-        return JobRequirement.requirements_as_integer_array(self.event, requirements)
+        if roster_matrix is None:
+            roster_matrix = get_roster_matrix(self.event)
+        return roster_matrix.get_job_category_requirements(self.id)
 
-    def _make_allocated(self):
-        from .roster import JobRequirement, Shift
-        shifts = Shift.objects.filter(job__job_category=self)
-        return JobRequirement.allocated_as_integer_array(self.event, shifts)
+    def _make_allocated(self, roster_matrix=None):
+        if roster_matrix is None:
+            roster_matrix = get_roster_matrix(self.event)
+        return roster_matrix.get_job_category_allocated(self.id)
 
     def _make_people(self):
         """
@@ -169,7 +172,14 @@ class JobCategory(models.Model):
 
         return super(JobCategory, self).save(*args, **kwargs)
 
-    def as_dict(self, include_jobs=False, include_requirements=False, include_people=False, include_shifts=False):
+    def as_dict(
+        self,
+        include_jobs=False,
+        include_requirements=False,
+        include_people=False,
+        include_shifts=False,
+        roster_matrix=None,
+    ):
         assert not (include_shifts and not include_jobs), 'If include_shifts is specified, must specify also include_jobs'
 
         doc = pick_attrs(self,
@@ -177,12 +187,18 @@ class JobCategory(models.Model):
             'slug',
         )
 
+        if (include_jobs or include_requirements) and roster_matrix is None:
+            roster_matrix = get_roster_matrix(self.event)
+
         if include_jobs:
-            doc['jobs'] = [job.as_dict(include_shifts=include_shifts) for job in self.job_set.all()]
+            doc['jobs'] = [
+                job.as_dict(include_shifts=include_shifts, roster_matrix=roster_matrix)
+                for job in self.job_set.all()
+            ]
 
         if include_requirements:
-            doc['requirements'] = self._make_requirements()
-            doc['allocated'] = self._make_allocated()
+            doc['requirements'] = self._make_requirements(roster_matrix)
+            doc['allocated'] = self._make_allocated(roster_matrix)
 
         if include_people:
             doc['people'] = self._make_people()
@@ -190,4 +206,52 @@ class JobCategory(models.Model):
         return doc
 
     def as_roster_api_dict(self):
-        return self.as_dict(include_jobs=True, include_people=True, include_shifts=True)
+        version = get_roster_version(self.id)
+
+        doc = self.as_dict(include_jobs=True, include_people=True, include_shifts=True)
+        doc['version'] = version
+
+        return doc
+
+    def as_roster_api_changes_dict(self, since):
+        """
+        Returns the changes to the roster of this JobCategory after the version since. Jobs are returned without
+        their shifts; changed shifts and people are listed separately. If the changes are no longer known, the
+        whole roster is returned with full set.
+        """
+        from .roster import Shift
+
+        changes = get_roster_changes(self.id, since)
+        if changes is None:
+            doc = self.as_roster_api_dict()
+            doc['full'] = True
+            return doc
+
+        roster_matrix = get_roster_matrix(self.event)
+
+        return dict(
+            slug=self.slug,
+            since=since,
+            version=changes.version,
+            full=False,
+            jobs=[
+                job.as_dict(roster_matrix=roster_matrix)
+                for job in self.job_set.filter(id__in=changes.job_ids)
+            ],
+            deletedJobs=sorted(changes.deleted_job_slugs),
+            shifts=[
+                shift.as_dict()
+                for shift in Shift.objects.filter(
+                    id__in=changes.shift_ids,
+                    job__job_category=self,
+                ).select_related('job', 'signup__person')
+            ],
+            deletedShifts=sorted(changes.deleted_shift_ids),
+            people=[
+                signup.as_dict()
+                for signup in self.accepted_signup_set.filter(
+                    is_active=True,
+                    person_id__in=changes.person_ids,
+                ).select_related('person')
+            ],
+        )
@@ -1,19 +1,34 @@
 # encoding: utf-8
 
-from collections import namedtuple, defaultdict
+from collections import OrderedDict, namedtuple
 from datetime import timedelta
 
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
 from dateutil.parser import parse as parse_date
 from dateutil.tz import tzlocal
 
-from api.utils import JSONSchemaObject
-from core.utils import NONUNIQUE_SLUG_FIELD_PARAMS, ONE_HOUR, slugify, pick_attrs, format_datetime, format_interval
+from api.utils import BadRequest, JSONSchemaObject
+from core.utils import (
+    NONUNIQUE_SLUG_FIELD_PARAMS,
+    ONE_HOUR,
+    format_datetime,
+    format_interval,
+    full_hours_between,
+    pick_attrs,
+    slugify,
+)
 from core.csv_export import CsvExportMixin
 
+from ..roster_matrix import get_roster_matrix, invalidate_roster_matrix
+
+
+JOB_REQUIREMENT_BULK_SET_BATCH_SIZE = 1000
+
 
 class WorkPeriod(models.Model):
     event = models.ForeignKey('core.Event', on_delete=models.CASCADE, verbose_name=_('event'))
@@ -59,32 +74,40 @@ class Job(models.Model):
     admin_get_event.short_description = _('event')
     admin_get_event.admin_order_field = 'job_category__event'
 
-    def _make_requirements(self):
+    def _make_requirements(self, roster_matrix=None):
         """
         Returns an array of integers representing the sum of JobRequirements for this Job
         where indexes correspond to those of work_hours for this event.
         """
-        return JobRequirement.requirements_as_integer_array(self.job_category.event, self.requirements.all())
+        if roster_matrix is None:
+            roster_matrix = get_roster_matrix(self.job_category.event)
+        return roster_matrix.get_job_requirements(self.id)
 
-    def _make_allocated(self):
+    def _make_allocated(self, roster_matrix=None):
         """
         Returns an array of integers representing the number of Shifts for this Job
         where indexes correspond to those of work_hours for this event.
         """
-        return JobRequirement.allocated_as_integer_array(self.job_category.event, self.shifts.all())
+        if roster_matrix is None:
+            roster_matrix = get_roster_matrix(self.job_category.event)
+        return roster_matrix.get_job_allocated(self.id)
 
     def _make_shifts(self):
         return [shift.as_dict() for shift in self.shifts.all()]
 
-    def as_dict(self, include_requirements=True, include_shifts=False):
+    def as_dict(self, include_requirements=True, include_shifts=False, roster_matrix=None):
         doc = pick_attrs(self,
+            'id',
             'slug',
             'title',
         )
 
         if include_requirements:
-            doc['requirements'] = self._make_requirements()
-            doc['allocated'] = self._make_allocated()
+            if roster_matrix is None:
+                roster_matrix = get_roster_matrix(self.job_category.event)
+
+            doc['requirements'] = self._make_requirements(roster_matrix)
+            doc['allocated'] = self._make_allocated(roster_matrix)
 
         if include_shifts:
             doc['shifts'] = self._make_shifts()
@@ -104,36 +127,72 @@ class JobRequirement(models.Model):
     start_time = models.DateTimeField(verbose_name=_('starting time'))
     end_time = models.DateTimeField(verbose_name=_('ending time'))
 
-    @staticmethod
-    def requirements_as_integer_array(event, requirements):
-        work_hours = event.labour_event_meta.work_hours
-
-        requirements_by_start_time = defaultdict(list)
-        for requirement in requirements:
-            requirements_by_start_time[requirement.start_time].append(requirement)
-
-        return [sum(r.count for r in requirements_by_start_time[t]) for t in work_hours]
-
-    @staticmethod
-    def allocated_as_integer_array(event, shifts):
-        work_hours = event.labour_event_meta.work_hours
-
-        allocated_by_start_time = defaultdict(int)
-        for shift in shifts:
-            for start_time in shift.work_hours:
-                allocated_by_start_time[start_time] += 1
-
-        return [allocated_by_start_time[t] for t in work_hours]
-
     def save(self, *args, **kwargs):
         if self.start_time and not self.end_time:
             self.end_time = self.start_time + ONE_HOUR
 
         return super(JobRequirement, self).save(*args, **kwargs)
 
+    @classmethod
+    def bulk_set(cls, requirements, batch_size=JOB_REQUIREMENT_BULK_SET_BATCH_SIZE):
+        """
+        Sets the required worker counts given as (job_id, start_time, count) tuples, creating the JobRequirements
+        that do not exist yet, with one INSERT ... ON CONFLICT DO UPDATE per batch_size requirements. If the same
+        job and starting time occurs many times, the last count wins. Returns the number of requirements set.
+
+        Signals are not sent, so the roster matrices of the affected events are invalidated here.
+        """
+        counts = OrderedDict(((job_id, start_time), count) for (job_id, start_time, count) in requirements)
+        if not counts:
+            return 0
+
+        meta = cls._meta
+        qn = connection.ops.quote_name
+        job_column = qn(meta.get_field('job').column)
+        start_time_field = meta.get_field('start_time')
+        end_time_field = meta.get_field('end_time')
+        count_column = qn(meta.get_field('count').column)
+
+        rows = list(counts.items())
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i:i + batch_size]
+
+                params = []
+                for (job_id, start_time), count in batch:
+                    params.extend((
+                        job_id,
+                        start_time_field.get_db_prep_value(start_time, connection),
+                        end_time_field.get_db_prep_value(start_time + ONE_HOUR, connection),
+                        count,
+                    ))
+
+                cursor.execute(
+                    'INSERT INTO {table} ({job}, {start_time}, {end_time}, {count}) VALUES {values} '
+                    'ON CONFLICT ({job}, {start_time}) DO UPDATE '
+                    'SET {count} = EXCLUDED.{count}, {end_time} = EXCLUDED.{end_time}'.format(
+                        table=qn(meta.db_table),
+                        job=job_column,
+                        start_time=qn(start_time_field.column),
+                        end_time=qn(end_time_field.column),
+                        count=count_column,
+                        values=', '.join(['(%s, %s, %s, %s)'] * len(batch)),
+                    ),
+                    params,
+                )
+
+            job_ids = set(job_id for (job_id, start_time) in counts)
+            event_ids = Job.objects.filter(id__in=job_ids).values_list('job_category__event_id', flat=True)
+            for event_id in set(event_ids):
+                invalidate_roster_matrix(event_id)
+
+        return len(rows)
+
     class Meta:
         verbose_name = _('job requirement')
         verbose_name_plural = _('job requirements')
+        unique_together = [('job', 'start_time')]
 
 
 class Shift(models.Model, CsvExportMixin):
@@ -239,6 +298,28 @@ class Shift(models.Model, CsvExportMixin):
         ordering = ('job', 'start_time')
 
 
+@receiver(post_save, sender=JobRequirement)
+@receiver(post_delete, sender=JobRequirement)
+@receiver(post_save, sender=Shift)
+@receiver(post_delete, sender=Shift)
+def roster_post_change(sender, instance, **kwargs):
+    for event_id in Job.objects.filter(id=instance.job_id).values_list('job_category__event_id', flat=True):
+        invalidate_roster_matrix(event_id)
+
+
+@receiver(post_save, sender=Job)
+@receiver(post_delete, sender=Job)
+def job_post_change(sender, instance, **kwargs):
+    from .job_category import JobCategory
+
+    for event_id in JobCategory.objects.filter(id=instance.job_category_id).values_list('event_id', flat=True):
+        invalidate_roster_matrix(event_id)
+
+
+@receiver(post_save, sender='labour.LabourEventMeta')
+def labour_event_meta_post_save(sender, instance, **kwargs):
+    invalidate_roster_matrix(instance.event_id)
+
 
 SetJobRequirementsRequestBase = namedtuple('SetJobRequirementsRequest', 'startTime hours required')
 class SetJobRequirementsRequest(SetJobRequirementsRequestBase, JSONSchemaObject):
@@ -252,6 +333,90 @@ class SetJobRequirementsRequest(SetJobRequirementsRequestBase, JSONSchemaObject)
         required=list(SetJobRequirementsRequestBase._fields),
     )
 
+    def get_requirements(self, job):
+        """
+        Returns the requirements to set as (job_id, start_time, count) tuples for JobRequirement.bulk_set. Hours
+        outside the work hours of the event are left out.
+        """
+        meta = job.job_category.event.labour_event_meta
+
+        start_time = parse_date(self.startTime)
+        end_time = start_time + timedelta(hours=self.hours - 1)  # -1 due to end parameter being inclusive
+
+        start_time = max(start_time, meta.work_begins)
+        end_time = min(end_time, meta.work_ends)
+
+        if start_time > end_time:
+            return []
+
+        return [(job.id, hour, self.required) for hour in full_hours_between(start_time, end_time)]
+
+
+SetRequirementsRequestBase = namedtuple('SetRequirementsRequest', 'ranges matrix')
+class SetRequirementsRequest(SetRequirementsRequestBase, JSONSchemaObject):
+    """
+    Sets requirements of many jobs of a job category at once. ranges is a list of requirement ranges like those of
+    SetJobRequirementsRequest with the job slug added. matrix maps job slugs to arrays of required counts whose
+    indexes correspond to those of work_hours for the event. Ranges are applied after the matrix.
+    """
+
+    schema = dict(
+        type='object',
+        properties=dict(
+            ranges=dict(
+                type='array',
+                items=dict(
+                    type='object',
+                    properties=dict(
+                        job=dict(type='string', minLength=1),
+                        startTime=dict(type='string', format='date-time'),
+                        hours=dict(type='integer', minimum=1, maximum=99),
+                        required=dict(type='integer', minimum=0, maximum=99),
+                    ),
+                    required=['job', 'startTime', 'hours', 'required'],
+                ),
+            ),
+            matrix=dict(
+                type='object',
+                additionalProperties=dict(
+                    type='array',
+                    items=dict(type='integer', minimum=0, maximum=99),
+                ),
+            ),
+        ),
+    )
+
+    def get_requirements(self, job_category):
+        """
+        Returns the requirements to set as (job_id, start_time, count) tuples for JobRequirement.bulk_set.
+        """
+        ranges = self.ranges or []
+        matrix = self.matrix or {}
+
+        job_slugs = set(matrix.keys()) | set(r['job'] for r in ranges)
+        jobs_by_slug = {job.slug: job for job in job_category.job_set.filter(slug__in=job_slugs)}
+        if len(jobs_by_slug) != len(job_slugs):
+            raise BadRequest('Unknown job')
+
+        for job in jobs_by_slug.values():
+            job.job_category = job_category
+
+        work_hours = job_category.event.labour_event_meta.work_hours
+        requirements = []
+
+        for job_slug, counts in matrix.items():
+            if len(counts) != len(work_hours):
+                raise BadRequest('Matrix rows must have one count per work hour')
+
+            job = jobs_by_slug[job_slug]
+            requirements.extend((job.id, hour, count) for hour, count in zip(work_hours, counts))
+
+        for r in ranges:
+            range_request = SetJobRequirementsRequest(r['startTime'], r['hours'], r['required'])
+            requirements.extend(range_request.get_requirements(jobs_by_slug[r['job']]))
+
+        return requirements
+
 
 EditJobRequestBase = namedtuple('EditJobRequest', 'title')
 class EditJobRequest(EditJobRequestBase, JSONSchemaObject):
@@ -1,18 +1,20 @@
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict, namedtuple
 
 from django.conf import settings
+from django.core.cache import caches
 from django.db import models
-from django.db.models import Sum
+from django.db.models import Sum, prefetch_related_objects
 from django.db.models.functions import Coalesce
+from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
 from six import text_type
 
-from core.csv_export import CsvExportMixin
+from core.csv_export import CsvExportMixin, export_metadata_cache
 from core.utils import (
     alias_property,
-    ensure_user_group_membership,
     get_previous_and_next,
+    reconcile_group_membership,
     time_bool_property,
 )
 
@@ -31,6 +33,61 @@ from .constants import (
 )
 
 
+MASS_STATE_CHANGE_CHUNK_SIZE = 100
+MASS_STATE_CHANGE_CONCURRENCY = 4
+MASS_STATE_CHANGE_CACHE_KEY_TEMPLATE = 'labour:mass_state_change:{event_id}'
+MASS_STATE_CHANGE_CACHE_SECONDS = 24 * 60 * 60
+
+
+class MassStateChangeProgress(namedtuple('MassStateChangeProgress', [
+    'old_state',
+    'new_state',
+    'num_signups',
+    'num_processed',
+])):
+    """
+    Progress of a mass state change of the signups of an event, kept in the cache for the admin UI.
+    """
+
+    @classmethod
+    def get(cls, event_id):
+        cache = caches['default']
+        cache_key = MASS_STATE_CHANGE_CACHE_KEY_TEMPLATE.format(event_id=event_id)
+
+        progress = cache.get(cache_key)
+        if progress is None:
+            return None
+
+        num_processed = cache.get(cache_key + ':processed', 0)
+        return cls(*progress)._replace(num_processed=min(num_processed, progress[2]))
+
+    def save(self, event_id):
+        cache = caches['default']
+        cache_key = MASS_STATE_CHANGE_CACHE_KEY_TEMPLATE.format(event_id=event_id)
+
+        cache.set(cache_key, tuple(self), MASS_STATE_CHANGE_CACHE_SECONDS)
+        cache.set(cache_key + ':processed', self.num_processed, MASS_STATE_CHANGE_CACHE_SECONDS)
+
+    @classmethod
+    def increment(cls, event_id, num_processed):
+        cache = caches['default']
+        cache_key = MASS_STATE_CHANGE_CACHE_KEY_TEMPLATE.format(event_id=event_id)
+
+        try:
+            cache.incr(cache_key + ':processed', num_processed)
+        except ValueError:
+            # expired or cleared
+            pass
+
+    @property
+    def is_finished(self):
+        return self.num_processed >= self.num_signups
+
+    @property
+    def percentage(self):
+        return 100 * self.num_processed // self.num_signups if self.num_signups else 100
+
+
 class StateTransition(object):
     """
     This class represents a potential state transition of a Signup from its current state to
@@ -425,17 +482,116 @@ class Signup(models.Model, CsvExportMixin):
 
     @classmethod
     def _mass_state_change(cls, old_state, new_state, signups, filter_func=None):
+        """
+        Starts moving the signups from old_state to new_state. The state timestamps are updated and apply_state
+        is run by a background job if background tasks are enabled. Returns the number of signups selected.
+        """
         if filter_func is None:
             signups = signups.filter(**Signup.get_state_query_params(old_state))
         else:
             signups = filter_func(signups)
 
+        signup_ids_by_event_id = defaultdict(set)
+        for event_id, signup_id in signups.order_by().values_list('event_id', 'id'):
+            signup_ids_by_event_id[event_id].add(signup_id)
+
+        for event_id, signup_ids in signup_ids_by_event_id.items():
+            cls.start_mass_state_change(event_id, old_state, new_state, sorted(signup_ids))
+
+        return sum(len(signup_ids) for signup_ids in signup_ids_by_event_id.values())
+
+    @classmethod
+    def start_mass_state_change(cls, event_id, old_state, new_state, signup_ids):
+        MassStateChangeProgress(old_state, new_state, len(signup_ids), 0).save(event_id)
+
+        if 'background_tasks' in settings.INSTALLED_APPS:
+            from ..tasks import signup_mass_state_change
+            signup_mass_state_change.delay(event_id, old_state, new_state, signup_ids)
+        else:
+            cls._mass_state_change_job(event_id, old_state, new_state, signup_ids)
+
+    @classmethod
+    def _mass_state_change_job(cls, event_id, old_state, new_state, signup_ids):
+        """
+        Moves the signups that are still in old_state to new_state with one UPDATE and runs apply_state for all of
+        the given signups that are now in new_state in chunks of MASS_STATE_CHANGE_CHUNK_SIZE. Safe to run again
+        for the same signups if interrupted.
+        """
+        cls.bulk_change_state(old_state, new_state, signup_ids)
+
+        signup_ids = list(cls.objects.filter(
+            id__in=signup_ids,
+            **cls.get_state_query_params(new_state)
+        ).order_by('id').values_list('id', flat=True))
+
+        MassStateChangeProgress(old_state, new_state, len(signup_ids), 0).save(event_id)
+
+        chunks = [
+            signup_ids[i:i + MASS_STATE_CHANGE_CHUNK_SIZE]
+            for i in range(0, len(signup_ids), MASS_STATE_CHANGE_CHUNK_SIZE)
+        ]
+
+        if 'background_tasks' in settings.INSTALLED_APPS:
+            from celery import chain
+            from ..tasks import signup_apply_state_chunk
+
+            # Chunks are processed by at most MASS_STATE_CHANGE_CONCURRENCY workers at a time
+            for lane in range(MASS_STATE_CHANGE_CONCURRENCY):
+                lane_chunks = chunks[lane::MASS_STATE_CHANGE_CONCURRENCY]
+                if lane_chunks:
+                    chain(*[signup_apply_state_chunk.si(event_id, chunk) for chunk in lane_chunks]).delay()
+        else:
+            for chunk in chunks:
+                cls._apply_state_chunk(event_id, chunk)
+
+    @classmethod
+    def bulk_change_state(cls, old_state, new_state, signup_ids):
+        """
+        Moves those of the signups that are in old_state to new_state with a single UPDATE. Timestamps of the state
+        flags that become set are set to the current time and those that become unset are cleared, like the state
+        setter does. Returns the number of signups changed.
+        """
+        t = now()
+        changes = dict(updated_at=t)
+
+        old_flags = STATE_FLAGS_BY_NAME[old_state]
+        new_flags = STATE_FLAGS_BY_NAME[new_state]
+
+        # First state flag is not a time bool field, but an actual bona fide boolean field.
+        for i, (time_field_name, old_flag, new_flag) in enumerate(zip(STATE_TIME_FIELDS, old_flags, new_flags)):
+            if old_flag == new_flag:
+                continue
+            elif i == 0:
+                changes['is_active'] = new_flag
+            else:
+                changes[time_field_name] = t if new_flag else None
+
+        return cls.objects.filter(
+            id__in=signup_ids,
+            **cls.get_state_query_params(old_state)
+        ).update(**changes)
+
+    @classmethod
+    def _apply_state_chunk(cls, event_id, signup_ids):
+        """
+        Does what apply_state does for each of the signups, but reconciles the group memberships of the whole
+        chunk at once.
+        """
+        from core.models import Event
+
+        event = Event.objects.get(id=event_id)
+        signups = list(cls.objects.filter(id__in=signup_ids, event=event).select_related('person__user', 'event'))
+
         for signup in signups:
-            signup.state = new_state
-            signup.save()
-            signup.apply_state()
+            signup.apply_state_sync()
 
-        return signups
+        cls.reconcile_group_membership(event, signups)
+
+        for signup in signups:
+            signup.apply_state_email_aliases()
+            signup.apply_state_send_messages()
+
+        MassStateChangeProgress.increment(event_id, len(signup_ids))
 
     def apply_state(self):
         self.apply_state_sync()
@@ -460,40 +616,74 @@ class Signup(models.Model, CsvExportMixin):
         self.apply_state_send_messages()
 
     def apply_state_group_membership(self):
-        from .job_category import JobCategory
-        from .personnel_class import PersonnelClass
+        Signup.reconcile_group_membership(self.event, [self])
 
-        groups_to_add = set()
-        groups_to_remove = set()
+    @classmethod
+    def reconcile_group_membership(cls, event, signups=None):
+        """
+        Makes the users of the signups members of the state, job category and personnel class groups of the event
+        they should belong to, and removes them from the rest. If signups is not given, all signups of the event are
+        reconciled. The number of queries does not depend on the number of signups.
 
-        for group_suffix in SIGNUP_STATE_GROUPS:
-            should_belong_to_group = getattr(self, 'is_{group_suffix}'.format(group_suffix=group_suffix))
-            group = self.event.labour_event_meta.get_group(group_suffix)
+        Returns (memberships_added, memberships_removed) as sets of (user_id, group_id) tuples.
+        """
+        from django.contrib.auth.models import Group
 
-            if should_belong_to_group:
-                groups_to_add.add(group)
-            else:
-                groups_to_remove.add(group)
+        from .job_category import JobCategory
+        from .labour_event_meta import LabourEventMeta
+        from .personnel_class import PersonnelClass
 
-        for job_category in JobCategory.objects.filter(event=self.event):
-            should_belong_to_group = self.job_categories_accepted.filter(pk=job_category.pk).exists()
-            group = self.event.labour_event_meta.get_group(job_category.slug)
+        if signups is None:
+            signups = cls.objects.filter(event=event).select_related('person__user')
 
-            if should_belong_to_group:
-                groups_to_add.add(group)
-            else:
-                groups_to_remove.add(group)
+        signups = [signup for signup in signups if signup.person.user_id is not None]
 
-        for personnel_class in PersonnelClass.objects.filter(event=self.event, app_label='labour'):
-            should_belong_to_group = self.personnel_classes.filter(pk=personnel_class.pk).exists()
-            group = self.event.labour_event_meta.get_group(personnel_class.slug)
+        job_category_slugs = dict(JobCategory.objects.filter(event=event).values_list('id', 'slug'))
+        personnel_class_slugs = dict(
+            PersonnelClass.objects.filter(event=event, app_label='labour').values_list('id', 'slug')
+        )
 
-            if should_belong_to_group:
-                groups_to_add.add(group)
-            else:
-                groups_to_remove.add(group)
+        group_suffixes = SIGNUP_STATE_GROUPS + list(job_category_slugs.values()) + list(personnel_class_slugs.values())
+        group_names = {suffix: LabourEventMeta.make_group_name(event, suffix) for suffix in group_suffixes}
+        groups = list(Group.objects.filter(name__in=group_names.values()))
+        group_ids = {group.name: group.id for group in groups}
+
+        def get_group_id(suffix):
+            return group_ids.get(group_names[suffix])
+
+        signup_ids = [signup.id for signup in signups]
+        accepted_slugs = defaultdict(set)
+        for signup_id, job_category_id in cls.job_categories_accepted.through.objects.filter(
+            signup_id__in=signup_ids,
+            jobcategory_id__in=list(job_category_slugs),
+        ).values_list('signup_id', 'jobcategory_id'):
+            accepted_slugs[signup_id].add(job_category_slugs[job_category_id])
+        for signup_id, personnel_class_id in cls.personnel_classes.through.objects.filter(
+            signup_id__in=signup_ids,
+            personnelclass_id__in=list(personnel_class_slugs),
+        ).values_list('signup_id', 'personnelclass_id'):
+            accepted_slugs[signup_id].add(personnel_class_slugs[personnel_class_id])
+
+        desired_memberships = set()
+        for signup in signups:
+            suffixes = set(accepted_slugs[signup.id])
+            suffixes.update(
+                group_suffix
+                for group_suffix in SIGNUP_STATE_GROUPS
+                if getattr(signup, 'is_{group_suffix}'.format(group_suffix=group_suffix))
+            )
 
-        ensure_user_group_membership(self.person.user, groups_to_add, groups_to_remove)
+            desired_memberships.update(
+                (signup.person.user_id, get_group_id(suffix))
+                for suffix in suffixes
+                if get_group_id(suffix) is not None
+            )
+
+        return reconcile_group_membership(
+            users=[signup.person.user for signup in signups],
+            groups=groups,
+            desired_memberships=desired_memberships,
+        )
 
     def apply_state_email_aliases(self):
         if 'access' not in settings.INSTALLED_APPS:
@@ -741,52 +931,61 @@ class Signup(models.Model, CsvExportMixin):
 
     @classmethod
     def get_csv_fields(cls, event):
-        if getattr(event, '_signup_csv_fields', None) is None:
-            from core.models import Person
+        from .labour_event_meta import LabourEventMeta
+
+        return export_metadata_cache.get_or_compute(
+            ('signup_csv_fields', event.id),
+            lambda: cls._get_csv_fields(event),
+            invalidated_by=[LabourEventMeta],
+        )
+
+    @classmethod
+    def _get_csv_fields(cls, event):
+        from core.models import Person
 
-            event._signup_csv_fields = []
+        fields = []
 
-            related_models = [Person, Signup]
+        related_models = [Person, Signup]
 
-            fields_to_skip = [
-                # useless & non-serializable
-                (Person, 'user'),
-                (Signup, 'person'),
+        fields_to_skip = [
+            # useless & non-serializable
+            (Person, 'user'),
+            (Signup, 'person'),
 
-                # too official
-                (Person, 'official_first_names'),
-                (Person, 'muncipality'),
-            ]
+            # too official
+            (Person, 'official_first_names'),
+            (Person, 'muncipality'),
+        ]
 
-            SignupExtra = event.labour_event_meta.signup_extra_model
-            if SignupExtra is not None:
-                related_models.append(SignupExtra)
-                fields_to_skip.extend([
-                    # SignupExtraBase ("V2")
-                    (SignupExtra, 'event'),
-                    (SignupExtra, 'person'),
+        SignupExtra = event.labour_event_meta.signup_extra_model
+        if SignupExtra is not None:
+            related_models.append(SignupExtra)
+            fields_to_skip.extend([
+                # SignupExtraBase ("V2")
+                (SignupExtra, 'event'),
+                (SignupExtra, 'person'),
 
-                    # ObsoleteSignupExtraBaseV1
-                    (SignupExtra, 'signup'),
-                ])
+                # ObsoleteSignupExtraBaseV1
+                (SignupExtra, 'signup'),
+            ])
 
-            # XXX HACK jv-kortin numero
-            if 'labour_common_qualifications' in settings.INSTALLED_APPS:
-                from labour_common_qualifications.models import JVKortti
-                related_models.append(JVKortti)
-                fields_to_skip.append((JVKortti, 'personqualification'))
+        # XXX HACK jv-kortin numero
+        if 'labour_common_qualifications' in settings.INSTALLED_APPS:
+            from labour_common_qualifications.models import JVKortti
+            related_models.append(JVKortti)
+            fields_to_skip.append((JVKortti, 'personqualification'))
 
-            for model in related_models:
-                for field in model._meta.fields:
-                    if (model, field.name) in fields_to_skip:
-                        continue
+        for model in related_models:
+            for field in model._meta.fields:
+                if (model, field.name) in fields_to_skip:
+                    continue
 
-                    event._signup_csv_fields.append((model, field))
+                fields.append((model, field))
 
-                for field in model._meta.many_to_many:
-                    event._signup_csv_fields.append((model, field))
+            for field in model._meta.many_to_many:
+                fields.append((model, field))
 
-        return event._signup_csv_fields
+        return fields
 
     def get_csv_related(self):
         from core.models import Person
@@ -799,14 +998,62 @@ class Signup(models.Model, CsvExportMixin):
         # XXX HACK jv-kortin numero
         if 'labour_common_qualifications' in settings.INSTALLED_APPS:
             from labour_common_qualifications.models import JVKortti
-            try:
-                jv_kortti = JVKortti.objects.get(personqualification__person=self.person)
-                related[JVKortti] = jv_kortti
-            except JVKortti.DoesNotExist:
-                related[JVKortti] = None
+            if hasattr(self, '_jv_kortti'):
+                related[JVKortti] = self._jv_kortti
+            else:
+                try:
+                    jv_kortti = JVKortti.objects.get(personqualification__person=self.person)
+                    related[JVKortti] = jv_kortti
+                except JVKortti.DoesNotExist:
+                    related[JVKortti] = None
 
         return related
 
+    @classmethod
+    def prefetch_csv_related(cls, signups):
+        """
+        Loads the persons, signup extras and JV cards of the signups being exported in one query each.
+        """
+        prefetch_related_objects(signups, 'person', 'event')
+
+        signups_by_extra_model = defaultdict(list)
+        for signup in signups:
+            if not hasattr(signup, '_signup_extra') and signup.signup_extra_model is not None:
+                signups_by_extra_model[signup.signup_extra_model].append(signup)
+
+        for SignupExtra, extra_signups in signups_by_extra_model.items():
+            if SignupExtra.schema_version >= 2:
+                signup_extras = SignupExtra.objects.filter(
+                    event__in=set(signup.event_id for signup in extra_signups),
+                    person__in=[signup.person_id for signup in extra_signups],
+                )
+                signup_extras_by_key = {(extra.event_id, extra.person_id): extra for extra in signup_extras}
+                get_key = lambda signup: (signup.event_id, signup.person_id)
+                make_empty = lambda signup: SignupExtra(event=signup.event, person=signup.person)
+            else:
+                signup_extras = SignupExtra.objects.filter(signup__in=extra_signups)
+                signup_extras_by_key = {extra.signup_id: extra for extra in signup_extras}
+                get_key = lambda signup: signup.pk
+                make_empty = lambda signup: SignupExtra(signup=signup)
+
+            # same as SignupExtra.for_signup
+            for signup in extra_signups:
+                signup_extra = signup_extras_by_key.get(get_key(signup))
+                signup._signup_extra = signup_extra if signup_extra is not None else make_empty(signup)
+
+        if 'labour_common_qualifications' in settings.INSTALLED_APPS:
+            from labour_common_qualifications.models import JVKortti
+
+            jv_korttis_by_person_id = {
+                jv_kortti.personqualification.person_id: jv_kortti
+                for jv_kortti in JVKortti.objects.filter(
+                    personqualification__person__in=[signup.person_id for signup in signups],
+                ).select_related('personqualification')
+            }
+
+            for signup in signups:
+                signup._jv_kortti = jv_korttis_by_person_id.get(signup.person_id)
+
     def as_dict(self):
         # XXX?
         signup_extra = self.signup_extra
@@ -0,0 +1,113 @@
+from collections import namedtuple
+from time import time
+
+from django.core.cache import caches
+
+
+ROSTER_CHANGES_CACHE_SECONDS = 24 * 60 * 60
+ROSTER_CHANGES_MAX_VERSIONS = 500
+ROSTER_VERSION_CACHE_KEY_TEMPLATE = 'labour:roster_version:{job_category_id}'
+ROSTER_CHANGE_CACHE_KEY_TEMPLATE = 'labour:roster_change:{job_category_id}:{version}'
+
+
+RosterChanges = namedtuple('RosterChanges', [
+    'version',
+    'job_ids',
+    'deleted_job_slugs',
+    'shift_ids',
+    'deleted_shift_ids',
+    'person_ids',
+])
+
+
+def get_roster_version(job_category_id):
+    """
+    Returns the current roster version of the job category. Versions start from the current time in milliseconds
+    so that they keep increasing even if the cache is cleared.
+    """
+    cache = caches['default']
+    cache_key = ROSTER_VERSION_CACHE_KEY_TEMPLATE.format(job_category_id=job_category_id)
+
+    cache.add(cache_key, int(time() * 1000), None)
+    return cache.get(cache_key)
+
+
+def record_roster_change(
+    job_category_id,
+    job_ids=(),
+    deleted_job_slugs=(),
+    shift_ids=(),
+    deleted_shift_ids=(),
+    person_ids=(),
+):
+    """
+    Records a change to the roster of the job category and returns the new roster version. Call this after the
+    change has been saved. Only the identifiers of the changed objects are recorded; their current state is
+    serialized when the changes are requested.
+    """
+    cache = caches['default']
+    version_cache_key = ROSTER_VERSION_CACHE_KEY_TEMPLATE.format(job_category_id=job_category_id)
+
+    get_roster_version(job_category_id)
+    try:
+        version = cache.incr(version_cache_key)
+    except ValueError:
+        # evicted in between
+        get_roster_version(job_category_id)
+        version = cache.incr(version_cache_key)
+
+    change_cache_key = ROSTER_CHANGE_CACHE_KEY_TEMPLATE.format(job_category_id=job_category_id, version=version)
+    cache.set(change_cache_key, dict(
+        job_ids=list(job_ids),
+        deleted_job_slugs=list(deleted_job_slugs),
+        shift_ids=list(shift_ids),
+        deleted_shift_ids=list(deleted_shift_ids),
+        person_ids=list(person_ids),
+    ), ROSTER_CHANGES_CACHE_SECONDS)
+
+    return version
+
+
+def get_roster_changes(job_category_id, since):
+    """
+    Returns the RosterChanges of the job category that happened after the version since, merged into one. Returns
+    None if they are no longer known, in which case the client needs to reload the whole roster.
+    """
+    cache = caches['default']
+    version = get_roster_version(job_category_id)
+
+    if version is None or since > version or version - since > ROSTER_CHANGES_MAX_VERSIONS:
+        return None
+
+    cache_keys = [
+        ROSTER_CHANGE_CACHE_KEY_TEMPLATE.format(job_category_id=job_category_id, version=v)
+        for v in range(since + 1, version + 1)
+    ]
+    entries = cache.get_many(cache_keys)
+    if len(entries) != len(cache_keys):
+        return None
+
+    job_ids = set()
+    deleted_job_slugs = set()
+    shift_ids = set()
+    deleted_shift_ids = set()
+    person_ids = set()
+
+    for cache_key in cache_keys:
+        entry = entries[cache_key]
+
+        job_ids.update(entry['job_ids'])
+        deleted_job_slugs.update(entry['deleted_job_slugs'])
+        shift_ids.update(entry['shift_ids'])
+        shift_ids.difference_update(entry['deleted_shift_ids'])
+        deleted_shift_ids.update(entry['deleted_shift_ids'])
+        person_ids.update(entry['person_ids'])
+
+    return RosterChanges(
+        version=version,
+        job_ids=job_ids,
+        deleted_job_slugs=deleted_job_slugs,
+        shift_ids=shift_ids,
+        deleted_shift_ids=deleted_shift_ids,
+        person_ids=person_ids,
+    )
@@ -0,0 +1,141 @@
+from collections import defaultdict
+from itertools import accumulate
+
+from django.core.cache import caches
+from django.db import transaction
+
+from core.utils import ONE_HOUR
+
+
+ROSTER_MATRIX_CACHE_SECONDS = 60 * 60
+ROSTER_MATRIX_CACHE_KEY_TEMPLATE = 'labour:roster_matrix:{event_id}'
+
+
+class RosterMatrix(object):
+    """
+    Job × work hour arrays of required and allocated workers for a whole event. Indexes of the arrays correspond
+    to those of work_hours of the event. Arrays of job categories are the column sums of their jobs.
+    """
+
+    def __init__(self, num_hours, requirements_by_job_id, allocated_by_job_id, job_ids_by_job_category_id):
+        self.num_hours = num_hours
+        self.requirements_by_job_id = requirements_by_job_id
+        self.allocated_by_job_id = allocated_by_job_id
+
+        self.requirements_by_job_category_id = {}
+        self.allocated_by_job_category_id = {}
+        for job_category_id, job_ids in job_ids_by_job_category_id.items():
+            self.requirements_by_job_category_id[job_category_id] = self._sum_rows(
+                requirements_by_job_id[job_id] for job_id in job_ids
+            )
+            self.allocated_by_job_category_id[job_category_id] = self._sum_rows(
+                allocated_by_job_id[job_id] for job_id in job_ids
+            )
+
+    def _sum_rows(self, rows):
+        return [sum(column) for column in zip([0] * self.num_hours, *rows)]
+
+    def _get_row(self, rows, key):
+        row = rows.get(key)
+        return list(row) if row is not None else [0] * self.num_hours
+
+    def get_job_requirements(self, job_id):
+        return self._get_row(self.requirements_by_job_id, job_id)
+
+    def get_job_allocated(self, job_id):
+        return self._get_row(self.allocated_by_job_id, job_id)
+
+    def get_job_category_requirements(self, job_category_id):
+        return self._get_row(self.requirements_by_job_category_id, job_category_id)
+
+    def get_job_category_allocated(self, job_category_id):
+        return self._get_row(self.allocated_by_job_category_id, job_category_id)
+
+
+def get_roster_matrix(event, use_cache=True):
+    """
+    Returns the RosterMatrix of the event. It is cached for ROSTER_MATRIX_CACHE_SECONDS and invalidated when
+    shifts, job requirements, jobs or work hours of the event change.
+    """
+    cache = caches['default']
+    cache_key = ROSTER_MATRIX_CACHE_KEY_TEMPLATE.format(event_id=event.id)
+
+    if use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    roster_matrix = compute_roster_matrix(event)
+    cache.set(cache_key, roster_matrix, ROSTER_MATRIX_CACHE_SECONDS)
+
+    return roster_matrix
+
+
+def invalidate_roster_matrix(event_id):
+    """
+    Drops the cached RosterMatrix of the event. It is dropped again once the current transaction has been
+    committed so that a matrix computed by a concurrent request before the commit does not linger.
+    """
+    cache = caches['default']
+    cache_key = ROSTER_MATRIX_CACHE_KEY_TEMPLATE.format(event_id=event_id)
+
+    cache.delete(cache_key)
+    transaction.on_commit(lambda: cache.delete(cache_key))
+
+
+def compute_roster_matrix(event):
+    """
+    Builds the RosterMatrix of the event with three queries. Shifts are added as intervals into a difference
+    array per job which is then prefix summed, so the cost does not depend on the length of the shifts.
+    """
+    from .models import Job, JobRequirement, Shift
+
+    meta = event.labour_event_meta
+    num_hours = len(meta.work_hours)
+
+    def get_hour_index(t):
+        delta = t - meta.work_begins
+        if delta % ONE_HOUR:
+            return None
+        return delta // ONE_HOUR
+
+    job_ids_by_job_category_id = defaultdict(list)
+    for job_id, job_category_id in Job.objects.filter(job_category__event=event).values_list('id', 'job_category_id'):
+        job_ids_by_job_category_id[job_category_id].append(job_id)
+
+    requirements_by_job_id = defaultdict(lambda: [0] * num_hours)
+    for job_id, start_time, count in JobRequirement.objects.filter(
+        job__job_category__event=event,
+    ).values_list('job_id', 'start_time', 'count'):
+        index = get_hour_index(start_time)
+        if index is not None and 0 <= index < num_hours:
+            requirements_by_job_id[job_id][index] += count
+
+    differences_by_job_id = defaultdict(lambda: [0] * (num_hours + 1))
+    for job_id, start_time, hours in Shift.objects.filter(
+        job__job_category__event=event,
+    ).values_list('job_id', 'start_time', 'hours'):
+        begin = get_hour_index(start_time)
+        if begin is None:
+            continue
+
+        end = min(begin + hours, num_hours)
+        begin = max(begin, 0)
+        if begin < end:
+            differences = differences_by_job_id[job_id]
+            differences[begin] += 1
+            differences[end] -= 1
+
+    allocated_by_job_id = {
+        job_id: list(accumulate(differences[:num_hours]))
+        for job_id, differences in differences_by_job_id.items()
+    }
+
+    job_ids = [job_id for job_ids in job_ids_by_job_category_id.values() for job_id in job_ids]
+
+    return RosterMatrix(
+        num_hours=num_hours,
+        requirements_by_job_id={job_id: requirements_by_job_id[job_id] for job_id in job_ids},
+        allocated_by_job_id={job_id: allocated_by_job_id.get(job_id, [0] * num_hours) for job_id in job_ids},
+        job_ids_by_job_category_id=dict(job_ids_by_job_category_id),
+    )
@@ -41,6 +41,65 @@ function enrichJobCategory(jobCategory) {
   return jobCategory;
 }
 
+
+// Turns an enriched job category back into the form returned by the API.
+function stripJobCategory(jobCategory) {
+  return {
+    title: jobCategory.title,
+    slug: jobCategory.slug,
+    version: jobCategory.version,
+    people: jobCategory.people,
+    jobs: jobCategory.jobs.map(job => _.assign(_.omit(job, 'jobCategory', 'requirementCells', 'lanes'), {
+      shifts: job.shifts.map(shift => _.assign({}, shift, {
+        job: job.id,
+        person: shift.person ? shift.person.id : null,
+      })),
+    })),
+  };
+}
+
+
+function applyChanges(jobCategory, changes) {
+  if (changes.full) {
+    return enrichJobCategory(changes);
+  }
+
+  if (changes.since !== jobCategory.version) {
+    // someone else has changed the roster in between, so fetch their changes too
+    return getJobCategoryChanges(jobCategory);
+  }
+
+  const doc = stripJobCategory(jobCategory);
+  const deletedShifts = _.concat(changes.deletedShifts, _.map(changes.shifts, 'id'));
+
+  doc.version = changes.version;
+  doc.people = _.values(_.assign(_.keyBy(doc.people, 'id'), _.keyBy(changes.people, 'id')));
+  doc.jobs = doc.jobs.filter(job => !_.includes(changes.deletedJobs, job.slug));
+
+  changes.jobs.forEach(changedJob => {
+    const job = _.find(doc.jobs, {id: changedJob.id});
+    if (job) {
+      _.assign(job, changedJob);
+    } else {
+      doc.jobs.push(_.assign({shifts: []}, changedJob));
+    }
+  });
+
+  doc.jobs.forEach(job => {
+    job.shifts = job.shifts.filter(shift => !_.includes(deletedShifts, shift.id));
+  });
+
+  changes.shifts.forEach(shift => {
+    const job = _.find(doc.jobs, {id: shift.job});
+    if (job) {
+      job.shifts.push(shift);
+    }
+  });
+
+  return enrichJobCategory(doc);
+}
+
+
 export function getJobCategories() {
   return getJSON(config.urls.jobCategoryApi).then(enrichJobCategories);
 }
@@ -51,43 +110,49 @@ export function getJobCategory(slug) {
 }
 
 
+export function getJobCategoryChanges(jobCategory) {
+  return getJSON(`${config.urls.jobCategoryApi}/${jobCategory.slug}?since=${jobCategory.version}`)
+  .then(changes => applyChanges(jobCategory, changes));
+}
+
+
 export function setRequirement(job, doc) {
   return postJSON(`${config.urls.jobCategoryApi}/${job.jobCategory.slug}/jobs/${job.slug}/requirements`, doc)
-  .then(enrichJobCategory);
+  .then(changes => applyChanges(job.jobCategory, changes));
 }
 
 
 export function createJob(jobCategory, newJob) {
   return postJSON(`${config.urls.jobCategoryApi}/${jobCategory.slug}/jobs`, newJob)
-  .then(enrichJobCategory);
+  .then(changes => applyChanges(jobCategory, changes));
 }
 
 
 export function updateJob(job, update) {
   const url = `${config.urls.jobCategoryApi}/${job.jobCategory.slug}/jobs/${job.slug}`;
-  return putJSON(url, update).then(enrichJobCategory);
+  return putJSON(url, update).then(changes => applyChanges(job.jobCategory, changes));
 }
 
 
 export function deleteJob(job) {
   const url = `${config.urls.jobCategoryApi}/${job.jobCategory.slug}/jobs/${job.slug}`;
-  return deleteJSON(url).then(enrichJobCategory);
+  return deleteJSON(url).then(changes => applyChanges(job.jobCategory, changes));
 }
 
 
 export function createShift(jobCategory, newShift) {
   return postJSON(`${config.urls.jobCategoryApi}/${jobCategory.slug}/shifts`, newShift)
-  .then(enrichJobCategory);
+  .then(changes => applyChanges(jobCategory, changes));
 }
 
 
 export function updateShift(shift, update) {
   const url = `${config.urls.jobCategoryApi}/${shift.job.jobCategory.slug}/shifts/${shift.id}`;
-  return putJSON(url, update).then(enrichJobCategory);
+  return putJSON(url, update).then(changes => applyChanges(shift.job.jobCategory, changes));
 }
 
 
 export function deleteShift(shift) {
   const url = `${config.urls.jobCategoryApi}/${shift.job.jobCategory.slug}/shifts/${shift.id}`;
-  return deleteJSON(url).then(enrichJobCategory);
+  return deleteJSON(url).then(changes => applyChanges(shift.job.jobCategory, changes));
 }
@@ -6,6 +6,7 @@ import {
   createJob,
   deleteJob,
   getJobCategory,
+  getJobCategoryChanges,
   setRequirement,
   updateJob,
 } from '../services/RosterService';
@@ -73,7 +74,12 @@ export default class JobCategory {
 
   setupRoutes() {
     page('/:jobCategorySlug', (ctx) => {
-      getJobCategory(ctx.params.jobCategorySlug).then(jobCategory => this.loadJobCategory(jobCategory))
+      const current = this.jobCategory();
+      if (current && current.slug === ctx.params.jobCategorySlug) {
+        getJobCategoryChanges(current).then(jobCategory => this.loadJobCategory(jobCategory));
+      } else {
+        getJobCategory(ctx.params.jobCategorySlug).then(jobCategory => this.loadJobCategory(jobCategory));
+      }
     });
   }
 }
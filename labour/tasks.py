@@ -14,4 +14,16 @@ def signup_apply_state(signup_pk):
 def labour_event_meta_create_groups(meta_pk):
     from .models import LabourEventMeta
     meta = LabourEventMeta.objects.get(pk=meta_pk)
-    meta.create_groups()
\ No newline at end of file
+    meta.create_groups()
+
+
+@shared_task(ignore_result=True)
+def signup_mass_state_change(event_id, old_state, new_state, signup_ids):
+    from .models import Signup
+    Signup._mass_state_change_job(event_id, old_state, new_state, signup_ids)
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def signup_apply_state_chunk(event_id, signup_ids):
+    from .models import Signup
+    Signup._apply_state_chunk(event_id, signup_ids)
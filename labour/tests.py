@@ -2,7 +2,7 @@ from django.test import TestCase
 
 from core.models import Person
 
-from .models import LabourEventMeta, Qualification, JobCategory, Signup
+from .models import LabourEventMeta, MassStateChangeProgress, Qualification, JobCategory, Signup
 
 
 class LabourEventAdminTest(TestCase):
@@ -53,6 +53,25 @@ class SignupTest(TestCase):
         self.assertFalse(params['time_accepted__isnull'])
         self.assertTrue(params['time_finished__isnull'])
 
+    def test_mass_reject(self):
+        signup, unused = Signup.get_or_create_dummy()
+        meta = signup.event.labour_event_meta
+        meta.create_groups()
+        assert signup.state == 'new'
+
+        assert Signup.mass_reject(Signup.objects.filter(event=signup.event)) == 1
+
+        signup = Signup.objects.get(id=signup.id)
+        assert signup.state == 'rejected'
+        assert signup.time_rejected is not None
+        assert signup.person.user.groups.filter(id=meta.get_group('rejected').id).exists()
+        assert MassStateChangeProgress.get(signup.event.id).is_finished
+
+        # running it again for the same signups does not change anything
+        time_rejected = signup.time_rejected
+        Signup._mass_state_change_job(signup.event.id, 'new', 'rejected', [signup.id])
+        assert Signup.objects.get(id=signup.id).time_rejected == time_rejected
+
 
 class JobCategoryTestCase(TestCase):
     def test_group(self):
@@ -72,3 +91,101 @@ class JobCategoryTestCase(TestCase):
 
         rg = RecipientGroup.objects.get(job_category=jc)
         assert rg.verbose_name == jc.name
+
+    def test_roster_matrix(self):
+        from datetime import timedelta
+
+        from .models import Job, JobRequirement, Shift
+
+        signup, unused = Signup.get_or_create_dummy(accepted=True)
+        jc, unused = JobCategory.get_or_create_dummy()
+        meta = jc.event.labour_event_meta
+        meta.work_begins = meta.work_begins.replace(minute=0, second=0, microsecond=0)
+        meta.work_ends = meta.work_begins + timedelta(hours=4)
+        meta.save()
+
+        t = meta.work_begins
+        job = Job.objects.create(job_category=jc, title='Dummy job')
+        JobRequirement.objects.create(job=job, start_time=t + timedelta(hours=1), count=2)
+
+        doc = jc.as_dict(include_requirements=True)
+        assert doc['requirements'] == [0, 2, 0, 0, 0]
+        assert doc['allocated'] == [0, 0, 0, 0, 0]
+
+        # writing a shift invalidates the cached matrix
+        Shift.objects.create(job=job, signup=signup, start_time=t + timedelta(hours=3), hours=3)
+
+        doc = jc.as_roster_api_dict()
+        assert doc['jobs'][0]['requirements'] == [0, 2, 0, 0, 0]
+        assert doc['jobs'][0]['allocated'] == [0, 0, 0, 1, 1]
+
+    def test_roster_changes(self):
+        from .models import Job
+        from .roster_changes import record_roster_change
+
+        jc, unused = JobCategory.get_or_create_dummy()
+        meta = jc.event.labour_event_meta
+        meta.work_begins = meta.work_begins.replace(minute=0, second=0, microsecond=0)
+        meta.work_ends = meta.work_begins
+        meta.save()
+
+        since = jc.as_roster_api_dict()['version']
+
+        job = Job.objects.create(job_category=jc, title='Dummy job')
+        record_roster_change(jc.id, job_ids=[job.id])
+        version = record_roster_change(jc.id, deleted_shift_ids=[1234])
+
+        doc = jc.as_roster_api_changes_dict(since=since)
+        assert doc['version'] == version
+        assert not doc['full']
+        assert [job_doc['slug'] for job_doc in doc['jobs']] == [job.slug]
+        assert doc['deletedShifts'] == [1234]
+
+        # changes that are too old are no longer known
+        assert jc.as_roster_api_changes_dict(since=0)['full']
+
+    def test_job_requirement_bulk_set(self):
+        from datetime import timedelta
+
+        from .models import Job, JobRequirement, SetRequirementsRequest
+
+        jc, unused = JobCategory.get_or_create_dummy()
+        meta = jc.event.labour_event_meta
+        meta.work_begins = meta.work_begins.replace(minute=0, second=0, microsecond=0)
+        meta.work_ends = meta.work_begins + timedelta(hours=2)
+        meta.save()
+
+        t = meta.work_begins
+        job1 = Job.objects.create(job_category=jc, title='Dummy job 1')
+        job2 = Job.objects.create(job_category=jc, title='Dummy job 2')
+        JobRequirement.objects.create(job=job1, start_time=t, count=5)
+
+        request = SetRequirementsRequest.from_dict(dict(
+            matrix={job1.slug: [1, 2, 3]},
+            ranges=[dict(job=job2.slug, startTime=t.isoformat(), hours=10, required=4)],
+        ))
+        assert JobRequirement.bulk_set(request.get_requirements(jc)) == 6
+
+        assert JobRequirement.objects.filter(job__job_category=jc).count() == 6
+        doc = jc.as_roster_api_dict()
+        assert [job_doc['requirements'] for job_doc in doc['jobs']] == [[1, 2, 3], [4, 4, 4]]
+
+
+class GroupMembershipTestCase(TestCase):
+    def test_reconcile_group_membership(self):
+        signup, unused = Signup.get_or_create_dummy(accepted=True)
+        meta = signup.event.labour_event_meta
+        meta.create_groups()
+        user = signup.person.user
+
+        meta.get_group('rejected').user_set.add(user)
+
+        added, removed = Signup.reconcile_group_membership(signup.event)
+
+        group_names = set(user.groups.values_list('name', flat=True))
+        assert meta.get_group('accepted').name in group_names
+        assert meta.get_group(signup.job_categories_accepted.get().slug).name in group_names
+        assert meta.get_group('rejected').name not in group_names
+        assert (user.id, meta.get_group('rejected').id) in removed
+
+        assert Signup.reconcile_group_membership(signup.event) == (set(), set())
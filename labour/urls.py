@@ -19,6 +19,7 @@ from .views import (
     labour_api_job_view,
     labour_api_shift_view,
     labour_api_set_job_requirements_view,
+    labour_api_set_requirements_view,
     labour_confirm_view,
     labour_person_disqualify_view,
     labour_person_qualification_view,
@@ -193,6 +194,11 @@ urlpatterns = [
         labour_api_set_job_requirements_view,
         name='labour_api_set_job_requirements_view'
     ),
+    url(
+        r'^api/v1/events/(?P<event_slug>[a-z0-9-]+)/jobcategories/(?P<job_category_slug>[a-z0-9-]+)/requirements/?$',
+        labour_api_set_requirements_view,
+        name='labour_api_set_requirements_view'
+    ),
     url(
         r'^api/v1/events/(?P<event_slug>[a-z0-9-]+)/jobcategories/(?P<job_category_slug>[a-z0-9-]+)/shifts/?$',
         labour_api_shift_view,
@@ -2,7 +2,7 @@
 
 import json
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from django.conf import settings
 from django.views.decorators.http import require_http_methods, require_safe, require_POST
@@ -10,10 +10,8 @@ from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 
 from dateutil.tz import tzlocal
-from dateutil.parser import parse as parse_datetime
 
 from api.utils import api_view, MethodNotAllowed
-from core.utils import full_hours_between
 
 from ..helpers import labour_admin_required, labour_event_required
 from ..models import (
@@ -23,8 +21,11 @@ from ..models import (
     JobCategory,
     JobRequirement,
     SetJobRequirementsRequest,
+    SetRequirementsRequest,
     Shift,
 )
+from ..roster_changes import record_roster_change
+from ..roster_matrix import get_roster_matrix
 
 
 logger = logging.getLogger('kompassi')
@@ -34,8 +35,10 @@ logger = logging.getLogger('kompassi')
 @require_safe
 @api_view
 def labour_api_job_categories_view(request, vars, event):
+    roster_matrix = get_roster_matrix(event)
+
     return [
-        jc.as_dict(include_requirements=True)
+        jc.as_dict(include_requirements=True, roster_matrix=roster_matrix)
         for jc in JobCategory.objects.filter(event=event, app_label='labour')
     ]
 
@@ -44,11 +47,13 @@ def labour_api_job_categories_view(request, vars, event):
 @require_safe
 @api_view
 def labour_api_job_category_view(request, vars, event, job_category_slug):
-    return get_object_or_404(JobCategory, event=event, slug=job_category_slug).as_dict(
-        include_jobs=True,
-        include_shifts=True,
-        include_people=True,
-    )
+    job_category = get_object_or_404(JobCategory, event=event, slug=job_category_slug)
+
+    since = request.GET.get('since')
+    if since:
+        return job_category.as_roster_api_changes_dict(since=int(since))
+
+    return job_category.as_roster_api_dict()
 
 
 @labour_admin_required
@@ -64,15 +69,18 @@ def labour_api_job_view(request, vars, event, job_category_slug, job_slug=None):
         job = get_object_or_404(Job, job_category=job_category, slug=job_slug)
     elif request.method == 'DELETE' and job_slug is not None:
         job = get_object_or_404(Job, job_category=job_category, slug=job_slug)
+        person_ids = list(job.shifts.values_list('signup__person_id', flat=True))
         job.delete()
-        return job_category.as_roster_api_dict()
+        version = record_roster_change(job_category.id, deleted_job_slugs=[job.slug], person_ids=person_ids)
+        return job_category.as_roster_api_changes_dict(since=version - 1)
     else:
         raise MethodNotAllowed(request.method)
 
     job.title = body.title
     job.save()
 
-    return job_category.as_roster_api_dict()
+    version = record_roster_change(job_category.id, job_ids=[job.id])
+    return job_category.as_roster_api_changes_dict(since=version - 1)
 
 
 @labour_admin_required
@@ -88,15 +96,30 @@ def labour_api_shift_view(request, vars, event, job_category_slug, shift_id=None
         edit_shift_request = EditShiftRequest.from_json(request.body)
     elif request.method == 'DELETE' and shift_id is not None:
         shift = get_object_or_404(Shift, id=int(shift_id), job__job_category=job_category)
+        deleted_shift_id = shift.id
         shift.delete()
-        return job_category.as_roster_api_dict()
+        version = record_roster_change(job_category.id,
+            job_ids=[shift.job_id],
+            deleted_shift_ids=[deleted_shift_id],
+            person_ids=[shift.signup.person_id],
+        )
+        return job_category.as_roster_api_changes_dict(since=version - 1)
     else:
         raise MethodNotAllowed(request.method)
 
+    # a shift may be moved to another job or person, in which case both the old and the new one change
+    job_ids = [shift.job_id] if shift.pk else []
+    person_ids = [shift.signup.person_id] if shift.pk else []
+
     edit_shift_request.update(job_category, shift)
     shift.save()
 
-    return job_category.as_roster_api_dict()
+    version = record_roster_change(job_category.id,
+        job_ids=job_ids + [shift.job_id],
+        shift_ids=[shift.id],
+        person_ids=person_ids + [shift.signup.person_id],
+    )
+    return job_category.as_roster_api_changes_dict(since=version - 1)
 
 
 @labour_admin_required
@@ -107,25 +130,22 @@ def labour_api_set_job_requirements_view(request, vars, event, job_category_slug
     job = get_object_or_404(Job, job_category=job_category, slug=job_slug)
 
     body = SetJobRequirementsRequest.from_json(request.body)
+    job.job_category = job_category
+    JobRequirement.bulk_set(body.get_requirements(job))
 
-    start_time = parse_datetime(body.startTime)
-    end_time = start_time + timedelta(hours=body.hours - 1) # -1 due to end parameter being inclusive
+    version = record_roster_change(job_category.id, job_ids=[job.id])
+    return job_category.as_roster_api_changes_dict(since=version - 1)
 
-    start_time = max(start_time, event.labour_event_meta.work_begins)
-    end_time = min(end_time, event.labour_event_meta.work_ends)
 
-    for hour in full_hours_between(start_time, end_time): # start/end inclusive
-        requirement, created = JobRequirement.objects.get_or_create(
-            job=job,
-            start_time=hour,
-            defaults=dict(
-                count=body.required,
-            ),
-        )
+@labour_admin_required
+@require_POST
+@api_view
+def labour_api_set_requirements_view(request, vars, event, job_category_slug):
+    job_category = get_object_or_404(JobCategory, event=event, slug=job_category_slug)
 
-        if not created:
-            requirement.count = body.required
-            requirement.save()
+    body = SetRequirementsRequest.from_json(request.body)
+    requirements = body.get_requirements(job_category)
+    JobRequirement.bulk_set(requirements)
 
-    # Successful result emulates that of /api/v1/events/tracon11/jobcategories/conitea
-    return job_category.as_roster_api_dict()
+    version = record_roster_change(job_category.id, job_ids=set(job_id for (job_id, hour, count) in requirements))
+    return job_category.as_roster_api_changes_dict(since=version - 1)
@@ -1,16 +1,18 @@
 from collections import OrderedDict, namedtuple
 
+from django.conf import settings
+from django.contrib import messages
 from django.views.decorators.http import require_http_methods
 from django.shortcuts import render, redirect
 from django.utils.timezone import now
 
 from core.sort_and_filter import Sorter, Filter
-from core.csv_export import CSV_EXPORT_FORMATS, EXPORT_FORMATS, csv_response
+from core.csv_export import CSV_EXPORT_FORMATS, EXPORT_FORMATS, csv_response, start_background_export
 from event_log.utils import emit
 
 from ..helpers import labour_admin_required
 from ..filters import SignupStateFilter
-from ..models import Signup
+from ..models import MassStateChangeProgress, Signup
 from ..proxies.signup.certificate import SignupCertificateProxy
 
 
@@ -72,13 +74,20 @@ def labour_admin_signups_view(request, vars, event, format='screen'):
     if request.method == 'POST':
         action = request.POST.get('action', None)
         if action == 'reject':
-            SignupClass.mass_reject(signups)
+            num_signups = SignupClass.mass_reject(signups)
         elif action == 'request_confirmation':
-            SignupClass.mass_request_confirmation(signups)
+            num_signups = SignupClass.mass_request_confirmation(signups)
         elif action == 'send_shifts':
-            SignupClass.mass_send_shifts(signups)
+            num_signups = SignupClass.mass_send_shifts(signups)
         else:
             messages.error(request, 'Ei semmosta toimintoa oo.')
+            num_signups = None
+
+        if num_signups and 'background_tasks' in settings.INSTALLED_APPS:
+            messages.success(request,
+                'Massatoiminto käynnistettiin {num_signups} hakemukselle. Se suoritetaan taustalla.'
+                .format(num_signups=num_signups)
+            )
 
         return redirect('labour_admin_signups_view', event.slug)
 
@@ -109,10 +118,12 @@ def labour_admin_signups_view(request, vars, event, format='screen'):
         ])
 
         vars.update(
+            background_export_available='background_tasks' in settings.INSTALLED_APPS,
             export_formats=EXPORT_FORMATS,
             job_category_accepted_filters=job_category_accepted_filters,
             job_category_filters=job_category_filters,
             mass_operations=mass_operations,
+            mass_state_change=MassStateChangeProgress.get(event.id),
             night_work_filter=night_work_filter,
             num_all_signups=num_all_signups,
             num_signups=signups.count(),
@@ -142,6 +153,15 @@ def labour_admin_signups_view(request, vars, event, format='screen'):
 
         emit('core.person.exported', request=request, event=event)
 
+        # Exporting all signups of a large event may take long, so it can be done in the background
+        if request.GET.get('background') and start_background_export(request, event, SignupClass, signups,
+            dialect=CSV_EXPORT_FORMATS[format],
+            filename=filename,
+            m2m_mode='separate_columns',
+        ):
+            messages.success(request, 'Tiedosto muodostetaan taustalla. Saat sähköpostiisi latauslinkin, kun se on valmis.')
+            return redirect('labour_admin_signups_view', event.slug)
+
         return csv_response(event, SignupClass, signups,
             dialect=CSV_EXPORT_FORMATS[format],
             filename=filename,
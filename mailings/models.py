@@ -1,18 +1,18 @@
 from hashlib import sha1
 import logging
 from datetime import datetime, timedelta
+from time import sleep
 
 from django.utils import timezone
 from django.dispatch import receiver
 from django.db.models.signals import pre_save, post_save
 
-from math import ceil
-
 from django.conf import settings
 from django.db import models
 from django.template import Template, Context
 from django.utils import timezone
 
+from core.utils import groups_of_n
 from labour.models import JobCategory
 from labour.models import PersonnelClass
 
@@ -22,7 +22,9 @@ APP_LABEL_CHOICES = [
     ('labour', 'Työvoima')
 ]
 
-DELAY_PER_MESSAGE_FRAGMENT_MILLIS = 350
+# E-mails are sent over one SMTP connection in chunks of this many, pausing in between not to trip rate limits
+EMAIL_CHUNK_SIZE = 100
+EMAIL_CHUNK_DELAY_SECONDS = 1
 
 
 class RecipientGroup(models.Model):
@@ -132,33 +134,104 @@ class Message(models.Model):
             self._send(recipients, resend)
 
     def _send(self, recipients, resend):
-        from django.contrib.auth.models import User
+        """
+        Creates the missing PersonMessages of the recipients in bulk and sends them, along with the existing ones if
+        resend is set. The number of queries does not depend on the number of recipients.
+        """
+        from core.models import Person
+
+        if self.channel != 'email':
+            raise NotImplementedError(self.channel)
 
         if recipients is None:
-            recipients = [user.person for user in self.recipient.group.user_set.all()]
-
-        # TODO this delay stuff should not be here (only applies to SMS messages)
-        delay = 0
-        for person in recipients:
-            try:
-                person_message, created = PersonMessage.objects.get_or_create(
-                    person=person,
-                    message=self,
-                )
-            except PersonMessage.MultipleObjectsReturned:
+            recipients = Person.objects.filter(user__groups=self.recipient.group).distinct()
+
+        persons_by_id = {person.id: person for person in recipients}
+
+        person_messages_by_person_id = dict()
+        for person_message in (
+            PersonMessage.objects.filter(message=self, person_id__in=persons_by_id.keys())
+                .select_related('subject', 'body')
+                .order_by('id')
+        ):
+            if person_message.person_id in person_messages_by_person_id:
                 # This actually happens sometimes.
                 logger.warning('A Person doth multiple PersonMessages for a single Message have!')
-                person_message = PersonMessage.objects.filter(
-                    person=person,
-                    message=self
-                ).first()
-                created = False
-
-            if created or resend:
-                person_message.actually_send(delay)
-                bodylen = len(person_message.body.text)
-                delayfactor = ceil(bodylen / 153)
-                delay += DELAY_PER_MESSAGE_FRAGMENT_MILLIS * delayfactor
+            else:
+                person_message.person = persons_by_id[person_message.person_id]
+                person_message.message = self
+                person_messages_by_person_id[person_message.person_id] = person_message
+
+        new_persons = [person for person in persons_by_id.values() if person.id not in person_messages_by_person_id]
+        new_person_messages = PersonMessage.bulk_create_for_message(self, new_persons)
+
+        person_messages = new_person_messages
+        if resend:
+            person_messages = list(person_messages_by_person_id.values()) + person_messages
+
+        self._send_emails(person_messages)
+
+    def _send_emails(self, person_messages):
+        from django.core.mail import get_connection
+
+        if not person_messages:
+            return
+
+        meta = self.app_event_meta
+        connection = get_connection(fail_silently=True)
+        connection.open()
+        try:
+            for index, chunk in enumerate(groups_of_n(person_messages, EMAIL_CHUNK_SIZE)):
+                if index > 0:
+                    sleep(EMAIL_CHUNK_DELAY_SECONDS)
+
+                connection.send_messages([person_message.make_email_message(meta) for person_message in chunk])
+        finally:
+            connection.close()
+
+    def get_message_vars_by_person_id(self, persons):
+        """
+        Returns the template variables of the message for each of the persons, by person id. Signups of the persons
+        are fetched in one go along with what their formatted job categories and shifts need.
+        """
+        event = self.event
+
+        message_vars_by_person_id = {
+            person.id: dict(
+                event=event,
+                person=person,
+            )
+            for person in persons
+        }
+
+        # TODO need a way to make app-specific vars in the apps themselves
+        if 'labour' in settings.INSTALLED_APPS:
+            from labour.models import Signup
+
+            signups_by_person_id = {
+                signup.person_id: signup
+                for signup in (
+                    Signup.objects.filter(event=event, person_id__in=message_vars_by_person_id.keys())
+                        .prefetch_related('job_categories_accepted', 'shifts__job__job_category')
+                )
+            }
+
+            for person_id, message_vars in message_vars_by_person_id.items():
+                message_vars.update(signup=signups_by_person_id.get(person_id))
+
+        return message_vars_by_person_id
+
+    @property
+    def compiled_subject_template(self):
+        if not hasattr(self, '_compiled_subject_template'):
+            self._compiled_subject_template = Template(self.subject_template)
+        return self._compiled_subject_template
+
+    @property
+    def compiled_body_template(self):
+        if not hasattr(self, '_compiled_body_template'):
+            self._compiled_body_template = Template(self.body_template)
+        return self._compiled_body_template
 
     def expire(self):
         assert self.expired_at is None, 're-expiring an expired message does not make sense'
@@ -208,6 +281,24 @@ class Message(models.Model):
 
 
 class DedupMixin(object):
+    @classmethod
+    def get_or_create_many(cls, texts):
+        """
+        Returns a dict of text -> instance for the texts, creating the missing ones with one query.
+        """
+        digests = {text: sha1(text.encode('UTF-8')).hexdigest() for text in set(texts)}
+
+        instances = dict()
+        for instance in cls.objects.filter(digest__in=set(digests.values())).order_by('id'):
+            if instance.text in digests:
+                instances.setdefault(instance.text, instance)
+
+        missing = [cls(digest=digest, text=text) for (text, digest) in digests.items() if text not in instances]
+        for instance in cls.objects.bulk_create(missing):
+            instances[instance.text] = instance
+
+        return instances
+
     @classmethod
     def get_or_create(cls, text):
         the_hash = sha1(text.encode('UTF-8')).hexdigest()
@@ -245,34 +336,54 @@ class PersonMessage(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def save(self, *args, **kwargs):
-        self.subject, unused = PersonMessageSubject.get_or_create(self.render_message(self.message.subject_template))
-        self.body, unused = PersonMessageBody.get_or_create(self.render_message(self.message.body_template))
+        self.subject, unused = PersonMessageSubject.get_or_create(
+            self.render_message(self.message.compiled_subject_template)
+        )
+        self.body, unused = PersonMessageBody.get_or_create(
+            self.render_message(self.message.compiled_body_template)
+        )
 
         return super(PersonMessage, self).save(*args, **kwargs)
 
-    @property
-    def message_vars(self):
-        if not hasattr(self, '_message_vars'):
-            self._message_vars = dict(
-                event=self.message.event,
-                person=self.person,
-            )
+    @classmethod
+    def bulk_create_for_message(cls, message, persons):
+        """
+        Renders the message for the persons and creates their PersonMessages without saving them one by one.
+        """
+        message_vars_by_person_id = message.get_message_vars_by_person_id(persons)
+
+        person_messages = []
+        subject_texts = []
+        body_texts = []
+        for person in persons:
+            person_message = cls(message=message, person=person)
+            person_message._message_vars = message_vars_by_person_id[person.id]
+
+            person_messages.append(person_message)
+            subject_texts.append(person_message.render_message(message.compiled_subject_template))
+            body_texts.append(person_message.render_message(message.compiled_body_template))
 
-            # TODO need a way to make app-specific vars in the apps themselves
-            if 'labour' in settings.INSTALLED_APPS:
-                from labour.models import Signup
+        subjects = PersonMessageSubject.get_or_create_many(subject_texts)
+        bodies = PersonMessageBody.get_or_create_many(body_texts)
 
-                try:
-                    signup = Signup.objects.get(event=self.message.event, person=self.person)
-                except Signup.DoesNotExist:
-                    signup = None
+        for person_message, subject_text, body_text in zip(person_messages, subject_texts, body_texts):
+            person_message.subject = subjects[subject_text]
+            person_message.body = bodies[body_text]
 
-                self._message_vars.update(signup=signup)
+        return cls.objects.bulk_create(person_messages, batch_size=500)
+
+    @property
+    def message_vars(self):
+        if not hasattr(self, '_message_vars'):
+            self._message_vars = self.message.get_message_vars_by_person_id([self.person])[self.person.id]
 
         return self._message_vars
 
     def render_message(self, template):
-        return Template(template).render(Context(self.message_vars))
+        if not isinstance(template, Template):
+            template = Template(template)
+
+        return template.render(Context(self.message_vars))
 
     def actually_send(self, delay=0):
         if self.message.channel == 'email':
@@ -283,10 +394,12 @@ class PersonMessage(models.Model):
             raise NotImplementedError(self.message.channel)
 
     def _actually_send_email(self):
+        self.make_email_message(self.message.app_event_meta).send(fail_silently=True)
+
+    def make_email_message(self, meta):
         from django.core.mail import EmailMessage
 
         msgbcc = []
-        meta = self.message.app_event_meta
 
         if meta.monitor_email:
             msgbcc.append(meta.monitor_email)
@@ -294,13 +407,13 @@ class PersonMessage(models.Model):
         if settings.DEBUG:
             print(self.body.text)
 
-        EmailMessage(
+        return EmailMessage(
             subject=self.subject.text,
             body=self.body.text,
             from_email=meta.cloaked_contact_email,
             to=(self.person.name_and_email,),
             bcc=msgbcc
-        ).send(fail_silently=True)
+        )
 
     # def _actually_send_sms(self, delay=0):
     #     from sms.models import SMSMessageOut, SMSEventMeta
@@ -0,0 +1,34 @@
+from django.core import mail
+from django.test import TestCase
+
+from labour.models import JobCategory, Signup
+
+from .models import Message, PersonMessage, RecipientGroup
+
+
+class MessageTestCase(TestCase):
+    def test_send(self):
+        signup, unused = Signup.get_or_create_dummy(accepted=True)
+        job_category, unused = JobCategory.get_or_create_dummy()
+        recipient_group = RecipientGroup.objects.get(job_category=job_category)
+        recipient_group.group.user_set.add(signup.person.user)
+
+        message = Message.objects.create(
+            recipient=recipient_group,
+            subject_template='Tervetuloa {{ event.name }}',
+            body_template='{{ signup.formatted_job_categories_accepted }}',
+        )
+
+        message._send(None, resend=False)
+        assert len(mail.outbox) == 1
+        assert mail.outbox[0].subject == 'Tervetuloa {name}'.format(name=signup.event.name)
+        assert job_category.name in mail.outbox[0].body
+        assert PersonMessage.objects.filter(message=message, person=signup.person).count() == 1
+
+        # already sent
+        message._send(None, resend=False)
+        assert len(mail.outbox) == 1
+
+        message._send([signup.person], resend=True)
+        assert len(mail.outbox) == 2
+        assert PersonMessage.objects.filter(message=message).count() == 1
@@ -0,0 +1,164 @@
+from collections import defaultdict, namedtuple
+from heapq import heappop, heappush
+
+from django.core.cache import caches
+from django.db import transaction
+
+
+CONFLICT_INDEX_CACHE_SECONDS = 60
+CONFLICT_INDEX_CACHE_KEY_TEMPLATE = 'programme:conflict_index:{event_id}'
+
+
+# kind is 'room' or 'person' and key_id the id of the room or person. programme_ids is a sorted pair.
+Conflict = namedtuple('Conflict', [
+    'kind',
+    'key_id',
+    'programme_ids',
+    'start_time',
+    'end_time',
+])
+
+# programme_id -> (room_id, start_time, end_time, person_ids)
+ProgrammeSlot = namedtuple('ProgrammeSlot', [
+    'room_id',
+    'start_time',
+    'end_time',
+    'person_ids',
+])
+
+
+def _make_conflict(kind, key_id, a, b):
+    a_start_time, a_end_time, a_programme_id = a
+    b_start_time, b_end_time, b_programme_id = b
+
+    return Conflict(
+        kind=kind,
+        key_id=key_id,
+        programme_ids=tuple(sorted((a_programme_id, b_programme_id))),
+        start_time=max(a_start_time, b_start_time),
+        end_time=min(a_end_time, b_end_time),
+    )
+
+
+class ConflictIndex(object):
+    """
+    Overlapping programmes of an event, both in the same room and with the same host. Intervals are sorted by start
+    time per room and per person, and each sorted list is swept once with a heap of the intervals still running, so
+    building the index takes O(n log n) plus the number of conflicts found.
+
+    The index is not updated in place. When programmes or their hosts change, the cached index is dropped and
+    rebuilt on next use (see invalidate_conflict_index).
+    """
+
+    def __init__(self, slots_by_programme_id):
+        # (kind, key_id) -> list of (start_time, end_time, programme_id) sorted by start time
+        self.intervals = defaultdict(list)
+
+        self.conflicts = set()
+
+        for programme_id, slot in slots_by_programme_id.items():
+            for key in self._get_keys(slot):
+                self.intervals[key].append((slot.start_time, slot.end_time, programme_id))
+
+        for (kind, key_id), intervals in self.intervals.items():
+            intervals.sort()
+            self.conflicts.update(self._sweep(kind, key_id, intervals))
+
+    @staticmethod
+    def _get_keys(slot):
+        if slot.room_id is not None:
+            yield ('room', slot.room_id)
+
+        for person_id in slot.person_ids:
+            yield ('person', person_id)
+
+    def _sweep(self, kind, key_id, intervals):
+        running = []
+        for interval in intervals:
+            start_time, end_time, programme_id = interval
+
+            while running and running[0][0] <= start_time:
+                heappop(running)
+
+            for unused, other in running:
+                yield _make_conflict(kind, key_id, other, interval)
+
+            heappush(running, (end_time, interval))
+
+    def get_conflicts(self, programme_id=None):
+        conflicts = self.conflicts
+        if programme_id is not None:
+            conflicts = (conflict for conflict in conflicts if programme_id in conflict.programme_ids)
+
+        return sorted(conflicts, key=lambda conflict: (conflict.start_time, conflict.kind, conflict.programme_ids))
+
+    @classmethod
+    def build(cls, event):
+        """
+        Builds the index of the event with two queries.
+        """
+        from .models import Programme, ProgrammeRole
+
+        return cls(get_programme_slots(
+            Programme.objects.filter(category__event=event),
+            ProgrammeRole.objects.filter(programme__category__event=event),
+        ))
+
+
+def get_programme_slots(programmes, programme_roles):
+    """
+    Returns the ProgrammeSlots of those of the programmes that are active and scheduled, by programme id.
+    """
+    from .models.programme import PROGRAMME_STATES_ACTIVE
+
+    person_ids_by_programme_id = defaultdict(list)
+    for programme_id, person_id in programme_roles.filter(is_active=True).values_list('programme_id', 'person_id'):
+        person_ids_by_programme_id[programme_id].append(person_id)
+
+    return {
+        programme_id: ProgrammeSlot(
+            room_id=room_id,
+            start_time=start_time,
+            end_time=end_time,
+            person_ids=tuple(sorted(set(person_ids_by_programme_id[programme_id]))),
+        )
+        for (programme_id, room_id, start_time, end_time) in programmes.filter(
+            state__in=PROGRAMME_STATES_ACTIVE,
+            start_time__isnull=False,
+            end_time__isnull=False,
+        ).values_list('id', 'room_id', 'start_time', 'end_time')
+        if start_time < end_time
+    }
+
+
+def get_conflict_index(event, use_cache=True):
+    """
+    Returns the ConflictIndex of the event. It is cached for CONFLICT_INDEX_CACHE_SECONDS and dropped when
+    programmes or their hosts change. The cache entry is short-lived because with a per-process cache the other
+    processes do not see it dropped.
+    """
+    cache = caches['default']
+    cache_key = CONFLICT_INDEX_CACHE_KEY_TEMPLATE.format(event_id=event.id)
+
+    if use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    conflict_index = ConflictIndex.build(event)
+    cache.set(cache_key, conflict_index, CONFLICT_INDEX_CACHE_SECONDS)
+
+    return conflict_index
+
+
+def invalidate_conflict_index(event_id):
+    """
+    Drops the cached ConflictIndex of the event so that it is rebuilt on next use. It is dropped again once the
+    current transaction has been committed so that an index built by a concurrent request before the commit does
+    not linger. Updating the cached index in place would lose updates when two programmes are saved at once.
+    """
+    cache = caches['default']
+    cache_key = CONFLICT_INDEX_CACHE_KEY_TEMPLATE.format(event_id=event_id)
+
+    cache.delete(cache_key)
+    transaction.on_commit(lambda: cache.delete(cache_key))
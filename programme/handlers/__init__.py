@@ -1 +1 @@
-from . import room, view_room, view  # noqa
+from . import conflict_index, room, schedule, view_room, view  # noqa
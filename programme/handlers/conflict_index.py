@@ -0,0 +1,25 @@
+from django.dispatch import receiver
+from django.db.models.signals import post_delete, post_save
+
+from ..conflict_index import invalidate_conflict_index
+from ..models import Category, Programme, ProgrammeRole
+
+
+@receiver(post_save, sender=Programme)
+@receiver(post_delete, sender=Programme)
+def programme_post_change(sender, instance, **kwargs):
+    event_id = Category.objects.filter(id=instance.category_id).values_list('event_id', flat=True).first()
+    if event_id is not None:
+        invalidate_conflict_index(event_id)
+
+
+@receiver(post_save, sender=ProgrammeRole)
+@receiver(post_delete, sender=ProgrammeRole)
+def programme_role_post_change(sender, instance, **kwargs):
+    event_id = (
+        Programme.objects.filter(id=instance.programme_id)
+            .values_list('category__event_id', flat=True)
+            .first()
+    )
+    if event_id is not None:
+        invalidate_conflict_index(event_id)
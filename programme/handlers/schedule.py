@@ -0,0 +1,97 @@
+from django.dispatch import receiver
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from ..models import (
+    Category,
+    FreeformOrganizer,
+    Programme,
+    ProgrammeEventMeta,
+    ProgrammeRole,
+    Role,
+    Room,
+    SpecialStartTime,
+    Tag,
+    TimeBlock,
+    View,
+    ViewRoom,
+)
+from ..models.schedule import invalidate_schedule_grids
+from ..schedule_snapshot import refresh_schedule_snapshots
+
+
+def schedule_changed(event_id):
+    invalidate_schedule_grids(event_id)
+    refresh_schedule_snapshots(event_id)
+
+
+@receiver(post_save, sender=Programme)
+@receiver(post_delete, sender=Programme)
+def programme_post_change(sender, instance, **kwargs):
+    event_id = Category.objects.filter(id=instance.category_id).values_list('event_id', flat=True).first()
+    if event_id is not None:
+        schedule_changed(event_id)
+
+
+@receiver(m2m_changed, sender=Programme.tags.through)
+def programme_tags_changed(sender, instance, action, **kwargs):
+    if not action.startswith('post_'):
+        return
+
+    if isinstance(instance, Programme):
+        programme_post_change(sender, instance)
+    else:
+        event_schedule_post_change(sender, instance)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProgrammeEventMeta)
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+@receiver(post_save, sender=SpecialStartTime)
+@receiver(post_delete, sender=SpecialStartTime)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=TimeBlock)
+@receiver(post_delete, sender=TimeBlock)
+@receiver(post_save, sender=View)
+@receiver(post_delete, sender=View)
+def event_schedule_post_change(sender, instance, **kwargs):
+    if instance.event_id is not None:
+        schedule_changed(instance.event_id)
+
+
+@receiver(post_save, sender=ViewRoom)
+@receiver(post_delete, sender=ViewRoom)
+def view_room_post_change(sender, instance, **kwargs):
+    event_id = View.objects.filter(id=instance.view_id).values_list('event_id', flat=True).first()
+    if event_id is not None:
+        schedule_changed(event_id)
+
+
+@receiver(post_save, sender=ProgrammeRole)
+@receiver(post_delete, sender=ProgrammeRole)
+@receiver(post_save, sender=FreeformOrganizer)
+@receiver(post_delete, sender=FreeformOrganizer)
+def programme_host_post_change(sender, instance, **kwargs):
+    event_id = (
+        Programme.objects.filter(id=instance.programme_id)
+            .values_list('category__event_id', flat=True)
+            .first()
+    )
+    if event_id is not None:
+        schedule_changed(event_id)
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def role_post_change(sender, instance, **kwargs):
+    from labour.models import PersonnelClass
+
+    event_id = (
+        PersonnelClass.objects.filter(id=instance.personnel_class_id)
+            .values_list('event_id', flat=True)
+            .first()
+    )
+    if event_id is not None:
+        schedule_changed(event_id)
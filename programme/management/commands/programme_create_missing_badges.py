@@ -1,5 +1,3 @@
-from sys import stderr
-
 from django.core.management.base import BaseCommand
 
 
@@ -7,13 +5,28 @@ class Command(BaseCommand):
     args = '[event_slug...]'
     help = 'Create missing badges for programme'
 
-    def handle(*args, **opts):
-        from programme.models import Programme
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'event_slugs',
+            nargs='+',
+            metavar='EVENT_SLUG',
+        )
+
+    def handle(self, *args, **options):
+        from programme.models import ProgrammeRole
         from core.models import Event
         from badges.models import Badge
 
-        for event_slug in args[1:]:
+        for event_slug in options['event_slugs']:
             event = Event.objects.get(slug=event_slug)
+            person_ids = set(
+                ProgrammeRole.objects.filter(programme__category__event=event).values_list('person_id', flat=True)
+            )
+
+            created, revoked = Badge.reconcile(event, person_ids)
 
-            for programme in Programme.objects.filter(category__event=event):
-                programme.apply_state()
+            self.stdout.write('{event_slug}: {num_created} badges created, {num_revoked} revoked'.format(
+                event_slug=event.slug,
+                num_created=len(created),
+                num_revoked=len(revoked),
+            ))
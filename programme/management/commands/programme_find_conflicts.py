@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    args = '[event_slug...]'
+    help = 'List programmes that overlap in the same room or with the same host'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'event_slugs',
+            nargs='+',
+            metavar='EVENT_SLUG',
+        )
+
+    def handle(self, *args, **options):
+        from core.models import Event
+        from core.utils import format_datetime
+        from programme.conflict_index import get_conflict_index
+        from programme.models import Programme
+
+        for event_slug in options['event_slugs']:
+            event = Event.objects.get(slug=event_slug)
+            conflicts = get_conflict_index(event, use_cache=False).get_conflicts()
+
+            titles = dict(Programme.objects.filter(category__event=event).values_list('id', 'title'))
+
+            for conflict in conflicts:
+                self.stdout.write('{event_slug}: {kind} {key_id}: {first} / {second} ({start_time} – {end_time})'.format(
+                    event_slug=event.slug,
+                    kind=conflict.kind,
+                    key_id=conflict.key_id,
+                    first=titles.get(conflict.programme_ids[0]),
+                    second=titles.get(conflict.programme_ids[1]),
+                    start_time=format_datetime(conflict.start_time),
+                    end_time=format_datetime(conflict.end_time),
+                ))
+
+            self.stdout.write('{event_slug}: {num_conflicts} conflicts'.format(
+                event_slug=event.slug,
+                num_conflicts=len(conflicts),
+            ))
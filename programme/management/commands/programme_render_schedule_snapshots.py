@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    args = '[event_slug...]'
+    help = 'Render the static snapshots of the public programme schedule'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'event_slugs',
+            nargs='+',
+            metavar='EVENT_SLUG',
+        )
+
+    def handle(self, *args, **options):
+        from core.models import Event
+        from programme.schedule_snapshot import render_schedule_snapshots
+
+        for event_slug in options['event_slugs']:
+            event = Event.objects.get(slug=event_slug)
+            manifest = render_schedule_snapshots(event)
+
+            self.stdout.write('{event_slug}: {num_snapshots} snapshots rendered'.format(
+                event_slug=event.slug,
+                num_snapshots=len(manifest),
+            ))
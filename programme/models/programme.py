@@ -4,7 +4,7 @@ from datetime import timedelta
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
-from django.db.models import Q
+from django.db.models import Prefetch, Q
 from django.db.transaction import atomic
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
@@ -707,18 +707,29 @@ class Programme(models.Model, CsvExportMixin):
         from .programme_role import ProgrammeRole
         return ProgrammeRole.objects.filter(programme=self)
 
-    @property
-    def formatted_hosts(self):
-        if not hasattr(self, '_formatted_hosts'):
+    def _get_public_hosts(self):
+        """
+        Returns the texts of the freeform organizers and the persons in public programme roles. Uses those
+        prefetched by prefetch_for_json if available.
+        """
+        if hasattr(self, 'public_programme_roles'):
+            freeform_organizers = self.freeform_organizers.all()
+            public_programme_roles = self.public_programme_roles
+        else:
             from .freeform_organizer import FreeformOrganizer
 
-            parts = [f.text for f in FreeformOrganizer.objects.filter(programme=self)]
-
+            freeform_organizers = FreeformOrganizer.objects.filter(programme=self)
             public_programme_roles = self.programme_roles.filter(
                 role__is_public=True
             ).select_related('person')
 
-            parts.extend(pr.person.display_name for pr in public_programme_roles)
+        return [f.text for f in freeform_organizers], [pr.person for pr in public_programme_roles]
+
+    @property
+    def formatted_hosts(self):
+        if not hasattr(self, '_formatted_hosts'):
+            parts, persons = self._get_public_hosts()
+            parts.extend(person.display_name for person in persons)
 
             self._formatted_hosts = ', '.join(parts)
 
@@ -727,20 +738,18 @@ class Programme(models.Model, CsvExportMixin):
     @property
     def ropecon_formatted_hosts(self):
         if not hasattr(self, '_formatted_hosts'):
-            from .freeform_organizer import FreeformOrganizer
-
-            parts = [f.text for f in FreeformOrganizer.objects.filter(programme=self)]
-
-            public_programme_roles = self.programme_roles.filter(
-                role__is_public=True
-            ).select_related('person')
-
-            parts.extend(pr.person.get_formatted_name('firstname_surname') for pr in public_programme_roles)
+            parts, persons = self._get_public_hosts()
+            parts.extend(person.get_formatted_name('firstname_surname') for person in persons)
 
             self._formatted_hosts = ', '.join(parts)
 
         return self._formatted_hosts
 
+    @property
+    def tag_slugs(self):
+        # not values_list so that prefetched tags are used
+        return [tag.slug for tag in self.tags.all()]
+
     @property
     def is_blank(self):
         return False
@@ -828,6 +837,29 @@ class Programme(models.Model, CsvExportMixin):
     def is_public(self):
         return self.state == 'published' and self.category is not None and self.category.public
 
+    @classmethod
+    def prefetch_for_json(cls, programmes):
+        """
+        Fetches everything as_json needs in all of its formats for the given queryset of programmes with a constant
+        number of queries. Genres and styles are plain fields of the programme and need no prefetching.
+        """
+        from .programme_role import ProgrammeRole
+
+        return (
+            programmes
+                .select_related('category__event')
+                .select_related('room')
+                .prefetch_related(
+                    'freeform_organizers',
+                    'tags',
+                    Prefetch(
+                        'programmerole_set',
+                        queryset=ProgrammeRole.objects.filter(role__is_public=True).select_related('person'),
+                        to_attr='public_programme_roles',
+                    ),
+                )
+        )
+
     def as_json(self, format='default'):
         from core.utils import pick_attrs
 
@@ -857,7 +889,7 @@ class Programme(models.Model, CsvExportMixin):
                 location=self.room.name if self.room else None,
                 location_slug=self.room.slug if self.room else None,
                 presenter=self.formatted_hosts,
-                tags=list(self.tags.values_list('slug', flat=True)),
+                tags=self.tag_slugs,
             )
         elif format == 'ropecon':
             return pick_attrs(self,
@@ -881,7 +913,7 @@ class Programme(models.Model, CsvExportMixin):
                 min_players=self.min_players if self.category.slug == 'roolipeli' else None,
                 max_players=self.max_players if self.category.slug == 'roolipeli' else None,
                 identifier='p{id}'.format(id=self.id),
-                tags=list(self.tags.values_list('slug', flat=True)),
+                tags=self.tag_slugs,
                 genres=self.ropecon_genres,
                 styles=self.ropecon_styles,
 
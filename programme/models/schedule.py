@@ -1,8 +1,11 @@
 import logging
+from bisect import bisect_left
 from collections import defaultdict
 from datetime import timedelta
+from uuid import uuid4
 
 from django.contrib import messages
+from django.core.cache import caches
 from django.db import models
 from django.db.models import Max
 from django.utils.translation import ugettext_lazy as _
@@ -17,6 +20,9 @@ from .programme import Programme
 logger = logging.getLogger('kompassi')
 
 ONE_HOUR = timedelta(hours=1)
+SCHEDULE_GRID_CACHE_SECONDS = 60 * 60
+SCHEDULE_GRID_CACHE_KEY_TEMPLATE = 'programme:schedule_grid:{event_id}:{generation}:{view_key}:{include_unpublished}'
+SCHEDULE_GRID_GENERATION_CACHE_KEY_TEMPLATE = 'programme:schedule_grid_generation:{event_id}'
 
 
 class OrderingMixin(object):
@@ -44,51 +50,99 @@ class OrderingMixin(object):
         swappee.save()
 
 
-class ViewMethodsMixin(object):
-    @property
-    def programmes_by_start_time(self):
-        return self.get_programmes_by_start_time()
+class ScheduleGrid(object):
+    """
+    The rows of a schedule view as returned by ViewMethodsMixin.get_programmes_by_start_time. Built from one query
+    per model: continuations and rowspans are computed by sweeping the sorted start times per room. Cached per
+    (view, include_unpublished) until a programme, room, category, view or time block of the event changes.
+    """
 
-    def get_programmes_by_start_time(self, include_unpublished=False, request=None):
-        results = []
-        prev_start_time = None
-        cont_criteria = dict() if include_unpublished else dict(state='published')
-        rooms = self.rooms.all()
+    def __init__(self, rows, overlaps):
+        self.rows = rows
+        self.overlaps = overlaps
+
+    @classmethod
+    def get(cls, view, include_unpublished=False, use_cache=True):
+        cache = caches['default']
+        generation = cache.get(SCHEDULE_GRID_GENERATION_CACHE_KEY_TEMPLATE.format(event_id=view.event.id), 0)
+        cache_key = SCHEDULE_GRID_CACHE_KEY_TEMPLATE.format(
+            event_id=view.event.id,
+            generation=generation,
+            view_key=view.schedule_grid_key,
+            include_unpublished=int(include_unpublished),
+        )
+
+        if use_cache:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        grid = cls.build(view, include_unpublished)
+        cache.set(cache_key, grid, SCHEDULE_GRID_CACHE_SECONDS)
+
+        return grid
+
+    @classmethod
+    def build(cls, view, include_unpublished=False):
+        rooms = list(view.rooms)
+        start_times = view.start_times()
 
         criteria = dict(
-            category__event=self.event,
             length__isnull=False,
             start_time__isnull=False,
-            room__in=rooms,
+            room__in=[room.id for room in rooms],
         )
         if not include_unpublished:
             criteria.update(state='published')
 
         # programme_index[start_time][room] = list of programmes
-        # TODO select_related
         programme_index = defaultdict(lambda: defaultdict(list))
-        programmes = (
+        programmes_by_room_id = defaultdict(list)
+        for programme in (
             Programme.objects.filter(**criteria)
                 .select_related('category__event')
                 .select_related('room')
                 .prefetch_related('tags')
-        )
-        for programme in programmes:
-            programme_index[programme.start_time][programme.room_id].append(programme)
+        ):
+            programmes_by_room_id[programme.room_id].append(programme)
+            if programme.category.event_id == view.event.id:
+                programme_index[programme.start_time][programme.room_id].append(programme)
+
+        # continues_at[room_id] = set of start times at which the latest programme started earlier has not ended
+        continues_at = defaultdict(set)
+        for room_id, programmes in programmes_by_room_id.items():
+            programmes.sort(key=lambda programme: (programme.start_time, programme.end_time))
+            latest_programme = None
+            i = 0
+
+            for start_time in start_times:
+                while i < len(programmes) and programmes[i].start_time < start_time:
+                    latest_programme = programmes[i]
+                    i += 1
+
+                if latest_programme is not None and start_time < latest_programme.end_time:
+                    continues_at[room_id].add(start_time)
+
+        def rowspan(programme):
+            return bisect_left(start_times, programme.end_time) - bisect_left(start_times, programme.start_time)
+
+        rows = []
+        overlaps = []
+        prev_start_time = None
 
-        for start_time in self.start_times():
+        for start_time in start_times:
             cur_row = []
 
             incontinuity = prev_start_time and (start_time - prev_start_time > ONE_HOUR)
             incontinuity = 'incontinuity' if incontinuity else ''
             prev_start_time = start_time
 
-            results.append((start_time, incontinuity, cur_row))
+            rows.append((start_time, incontinuity, cur_row))
             for room in rooms:
                 programmes = programme_index[start_time][room.id]
                 num_programmes = len(programmes)
                 if num_programmes == 0:
-                    if room.programme_continues_at(start_time, **cont_criteria):
+                    if start_time in continues_at[room.id]:
                         # programme still continues, handled by rowspan
                         pass
                     else:
@@ -97,24 +151,48 @@ class ViewMethodsMixin(object):
                 else:
                     if num_programmes > 1:
                         logger.warn('Room %s has multiple programs starting at %s', room, start_time)
-
-                        if (
-                            request is not None and
-                            self.event.programme_event_meta.is_user_admin(request.user)
-                        ):
-                            messages.warning(request,
-                                'Tilassa {room} on päällekkäisiä ohjelmanumeroita kello {start_time}'.format(
-                                    room=room,
-                                    start_time=format_datetime(start_time.astimezone(tzlocal())),
-                                )
-                            )
+                        overlaps.append((room.name, start_time))
 
                     programme = programmes[0]
+                    cur_row.append((programme, rowspan(programme)))
+
+        return cls(rows, overlaps)
+
+
+def invalidate_schedule_grids(event_id):
+    """
+    Drops the cached ScheduleGrids of all views of the event.
+    """
+    cache_key = SCHEDULE_GRID_GENERATION_CACHE_KEY_TEMPLATE.format(event_id=event_id)
+    caches['default'].set(cache_key, uuid4().hex, None)
+
+
+class ViewMethodsMixin(object):
+    @property
+    def programmes_by_start_time(self):
+        return self.get_programmes_by_start_time()
 
-                    rowspan = self.rowspan(programme)
-                    cur_row.append((programme, rowspan))
+    @property
+    def schedule_grid_key(self):
+        return self.pk
 
-        return results
+    def get_programmes_by_start_time(self, include_unpublished=False, request=None):
+        grid = ScheduleGrid.get(self, include_unpublished)
+
+        if (
+            grid.overlaps and
+            request is not None and
+            self.event.programme_event_meta.is_user_admin(request.user)
+        ):
+            for room_name, start_time in grid.overlaps:
+                messages.warning(request,
+                    'Tilassa {room} on päällekkäisiä ohjelmanumeroita kello {start_time}'.format(
+                        room=room_name,
+                        start_time=format_datetime(start_time.astimezone(tzlocal())),
+                    )
+                )
+
+        return grid.rows
 
     def start_times(self, programme=None):
         result = [t.start_time for t in SpecialStartTime.objects.filter(event=self.event)]
@@ -215,6 +293,8 @@ class ViewRoom(models.Model, OrderingMixin):
 
 
 class AllRoomsPseudoView(ViewMethodsMixin):
+    schedule_grid_key = 'all'
+
     def __init__(self, event):
         self.name = _('All rooms')
         self.public = True
@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import time
+from hashlib import sha1
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils import translation
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+
+logger = logging.getLogger('kompassi')
+
+SCHEDULE_SNAPSHOT_DELAY_SECONDS = 10
+SCHEDULE_SNAPSHOT_MANIFEST_CACHE_SECONDS = 5 * 60
+SCHEDULE_SNAPSHOT_MAX_AGE_SECONDS = 15 * 60
+SCHEDULE_SNAPSHOT_MANIFEST_CACHE_KEY_TEMPLATE = 'programme:schedule_snapshot_manifest:{event_id}'
+SCHEDULE_SNAPSHOT_PENDING_CACHE_KEY_TEMPLATE = 'programme:schedule_snapshot_pending:{event_id}'
+SCHEDULE_SNAPSHOT_MANIFEST_NAME = 'manifest.json'
+
+# name -> (content type, rendered separately for each language)
+SCHEDULE_SNAPSHOTS = dict(
+    schedule=('text/html; charset=utf-8', True),
+    schedule_fragment=('text/html; charset=utf-8', True),
+    json=('application/json', False),
+    plaintext=('text/plain; charset=utf-8', False),
+    taggedtext=('text/plain; charset=utf-16', False),
+)
+
+
+def get_snapshot_storage():
+    """
+    Snapshots are not stored under MEDIA_ROOT but in PROGRAMME_SNAPSHOT_ROOT, and served only via the schedule views
+    so that their access checks still apply.
+    """
+    return FileSystemStorage(location=settings.PROGRAMME_SNAPSHOT_ROOT)
+
+
+def get_snapshot_key(name, language_code=None):
+    content_type, per_language = SCHEDULE_SNAPSHOTS[name]
+    if per_language:
+        return '{name}.{language_code}'.format(
+            name=name,
+            language_code=language_code or translation.get_language() or settings.LANGUAGE_CODE,
+        )
+    else:
+        return name
+
+
+def get_manifest_path(event):
+    return '{event_slug}/{name}'.format(event_slug=event.slug, name=SCHEDULE_SNAPSHOT_MANIFEST_NAME)
+
+
+def get_manifest(event, max_age_seconds=None):
+    """
+    Returns the manifest of the snapshots of the event, or an empty dict if there are none. The manifest maps
+    snapshot keys to dicts of etag, path and content_type. If max_age_seconds is given, a manifest written longer
+    ago than that counts as none.
+
+    The manifest is written by the background worker, so a cached copy is only used while the modification time
+    of the manifest file stays the same.
+    """
+    storage = get_snapshot_storage()
+    cache = caches['default']
+    cache_key = SCHEDULE_SNAPSHOT_MANIFEST_CACHE_KEY_TEMPLATE.format(event_id=event.id)
+
+    try:
+        mtime = os.stat(storage.path(get_manifest_path(event))).st_mtime_ns
+    except FileNotFoundError:
+        return dict()
+
+    if max_age_seconds is not None and time.time() - mtime / 1e9 > max_age_seconds:
+        return dict()
+
+    cached = cache.get(cache_key)
+    if cached is not None:
+        cached_mtime, manifest = cached
+        if cached_mtime == mtime:
+            return manifest
+
+    try:
+        with storage.open(get_manifest_path(event)) as manifest_file:
+            manifest = json.loads(manifest_file.read().decode('UTF-8'))
+    except FileNotFoundError:
+        return dict()
+
+    cache.set(cache_key, (mtime, manifest), SCHEDULE_SNAPSHOT_MANIFEST_CACHE_SECONDS)
+
+    return manifest
+
+
+def snapshot_response(request, event, name):
+    """
+    Serves the snapshot of the event with conditional GET support. Returns None if there is no snapshot, in which
+    case the caller should render the response live.
+
+    Snapshots older than SCHEDULE_SNAPSHOT_MAX_AGE_SECONDS are not served so that a stuck worker cannot freeze the
+    schedule. Instead they are rendered live and a refresh is queued.
+    """
+    manifest = get_manifest(event, max_age_seconds=SCHEDULE_SNAPSHOT_MAX_AGE_SECONDS)
+    if not manifest and get_manifest(event):
+        refresh_schedule_snapshots(event.id)
+
+    snapshot = manifest.get(get_snapshot_key(name))
+    if snapshot is None:
+        return None
+
+    etag = quote_etag(snapshot['etag'])
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        try:
+            with get_snapshot_storage().open(snapshot['path']) as snapshot_file:
+                data = snapshot_file.read()
+        except IOError:
+            logger.exception('Schedule snapshot %s missing', snapshot['path'])
+            return None
+
+        response = HttpResponse(data, snapshot['content_type'])
+
+    response['ETag'] = etag
+    return response
+
+
+def refresh_schedule_snapshots(event_id):
+    """
+    Re-renders the snapshots of the event in the background once the current transaction has been committed.
+    Changes within SCHEDULE_SNAPSHOT_DELAY_SECONDS are rendered together. If background tasks are not available,
+    the snapshots are dropped instead and the schedule views render live.
+    """
+    if 'background_tasks' not in settings.INSTALLED_APPS:
+        transaction.on_commit(lambda: drop_schedule_snapshots(event_id))
+        return
+
+    from .tasks import programme_render_schedule_snapshots
+
+    def _refresh():
+        cache = caches['default']
+        pending_cache_key = SCHEDULE_SNAPSHOT_PENDING_CACHE_KEY_TEMPLATE.format(event_id=event_id)
+
+        if cache.add(pending_cache_key, True, SCHEDULE_SNAPSHOT_DELAY_SECONDS * 6):
+            programme_render_schedule_snapshots.apply_async(
+                args=[event_id],
+                countdown=SCHEDULE_SNAPSHOT_DELAY_SECONDS,
+            )
+
+    transaction.on_commit(_refresh)
+
+
+def drop_schedule_snapshots(event_id):
+    from core.models import Event
+
+    event = Event.objects.filter(id=event_id).first()
+    if event is not None and get_manifest(event):
+        write_manifest(event, dict())
+
+
+def write_manifest(event, manifest):
+    """
+    Stores the manifest and removes snapshot files that neither it nor the previous manifest refer to. Files of the
+    previous manifest are kept for requests that are still serving them.
+    """
+    storage = get_snapshot_storage()
+    previous_manifest = get_manifest(event)
+
+    # replaced atomically so that readers never see a missing or partially written manifest
+    path = get_manifest_path(event)
+    temp_path = storage.save(path + '.tmp', ContentFile(json.dumps(manifest).encode('UTF-8')))
+    os.replace(storage.path(temp_path), storage.path(path))
+
+    paths_to_keep = {path}
+    paths_to_keep.update(snapshot['path'] for snapshot in manifest.values())
+    paths_to_keep.update(snapshot['path'] for snapshot in previous_manifest.values())
+
+    if storage.exists(event.slug):
+        unused_dirs, filenames = storage.listdir(event.slug)
+        for filename in filenames:
+            file_path = '{event_slug}/{filename}'.format(event_slug=event.slug, filename=filename)
+            if file_path not in paths_to_keep:
+                storage.delete(file_path)
+
+
+def render_schedule_snapshots(event):
+    """
+    Renders all snapshots of the event as an anonymous user would see them and stores them as files named after
+    their ETags.
+    """
+    from .views.public_views import (
+        get_programmes_json,
+        get_schedule_tabs,
+        actual_schedule_view,
+        render_adobe_taggedtext,
+        render_plaintext,
+    )
+    from django.test import RequestFactory
+    from core.utils import url
+
+    caches['default'].delete(SCHEDULE_SNAPSHOT_PENDING_CACHE_KEY_TEMPLATE.format(event_id=event.id))
+
+    def make_request(path, language_code=settings.LANGUAGE_CODE):
+        request = RequestFactory().get(path, HTTP_ACCEPT_LANGUAGE=language_code)
+        request.user = AnonymousUser()
+        request.LANGUAGE_CODE = language_code
+        return request
+
+    def render_schedule(language_code, template=None, show_programme_actions=False):
+        request = make_request(url('programme_schedule_view', event.slug), language_code)
+        vars = dict(
+            login_page=True,
+            tabs=get_schedule_tabs(request, event),
+        )
+        return actual_schedule_view(request, event,
+            template=template,
+            vars=vars,
+            show_programme_actions=show_programme_actions,
+        ).content
+
+    renderers = dict(
+        schedule=lambda language_code: render_schedule(language_code,
+            show_programme_actions=True,
+        ),
+        schedule_fragment=lambda language_code: render_schedule(language_code,
+            template='programme_schedule_fragment.pug',
+        ),
+        json=lambda language_code: json.dumps(get_programmes_json(event), cls=DjangoJSONEncoder).encode('UTF-8'),
+        plaintext=lambda language_code: render_plaintext(make_request(
+            url('programme_plaintext_view', event.slug),
+        ), event).encode('UTF-8'),
+        taggedtext=lambda language_code: render_adobe_taggedtext(make_request(
+            url('programme_internal_adobe_taggedtext_view', event.slug),
+        ), event),
+    )
+
+    storage = get_snapshot_storage()
+    manifest = dict()
+
+    for name, (content_type, per_language) in SCHEDULE_SNAPSHOTS.items():
+        language_codes = [code for (code, unused) in settings.LANGUAGES] if per_language else [None]
+
+        for language_code in language_codes:
+            with translation.override(language_code or settings.LANGUAGE_CODE):
+                data = renderers[name](language_code or settings.LANGUAGE_CODE)
+
+            etag = sha1(data).hexdigest()
+            key = get_snapshot_key(name, language_code)
+            path = '{event_slug}/{key}.{etag}'.format(event_slug=event.slug, key=key, etag=etag)
+
+            if not storage.exists(path):
+                storage.save(path, ContentFile(data))
+
+            manifest[key] = dict(
+                etag=etag,
+                path=path,
+                content_type=content_type,
+            )
+
+    write_manifest(event, manifest)
+
+    return manifest
@@ -7,3 +7,12 @@ def programme_apply_state_async(programme_pk):
 
     programme = Programme.objects.get(pk=programme_pk)
     programme._apply_state_async()
+
+
+@shared_task(ignore_result=True)
+def programme_render_schedule_snapshots(event_id):
+    from core.models import Event
+    from .schedule_snapshot import render_schedule_snapshots
+
+    event = Event.objects.get(id=event_id)
+    render_schedule_snapshots(event)
@@ -1,4 +1,11 @@
-from django.test import TestCase
+import os
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now
 
 from datetime import datetime, timedelta
@@ -9,7 +16,18 @@ from access.models import SlackAccess, GroupPrivilege, Privilege
 from labour.models import Signup
 
 from .utils import next_full_hour
-from .models import ProgrammeEventMeta, ProgrammeRole, Programme, Room
+from .models import FreeformOrganizer, ProgrammeEventMeta, ProgrammeRole, Programme, Room, TimeBlock
+from .models.schedule import AllRoomsPseudoView, ScheduleGrid
+from .conflict_index import ConflictIndex, ProgrammeSlot
+from .views.public_views import get_programmes_json
+from .schedule_snapshot import (
+    SCHEDULE_SNAPSHOT_MAX_AGE_SECONDS,
+    get_manifest,
+    get_manifest_path,
+    get_snapshot_storage,
+    snapshot_response,
+    write_manifest,
+)
 
 
 class UtilsTestCase(TestCase):
@@ -142,3 +160,201 @@ class ProgrammeTestCase(TestCase):
 
         assert not Programme.get_future_programmes(person).exists()
         assert Programme.get_past_programmes(person).exists()
+
+
+class ScheduleGridTestCase(TestCase):
+    def test_schedule_grid(self):
+        programme, unused = Programme.get_or_create_dummy()
+        event = programme.category.event
+        t = datetime(2019, 7, 27, 10, 0, 0, tzinfo=tzlocal())
+
+        TimeBlock.objects.create(event=event, start_time=t, end_time=t + timedelta(hours=3))
+
+        programme.room.event = event
+        programme.room.save()
+        programme.start_time = t + timedelta(hours=1)
+        programme.length = 120
+        programme.save()
+
+        view = AllRoomsPseudoView(event)
+        rows = view.get_programmes_by_start_time()
+
+        assert [start_time for (start_time, incontinuity, cur_row) in rows] == [
+            t + timedelta(hours=i) for i in range(4)
+        ]
+        assert rows[0][2] == [(None, None)]
+        assert rows[1][2] == [(programme, 2)]
+        assert rows[2][2] == []
+        assert rows[3][2] == [(None, None)]
+
+        assert rows == ScheduleGrid.build(view).rows
+
+        # cached grid is dropped when the programme changes
+        programme.length = 60
+        programme.save()
+
+        rows = view.get_programmes_by_start_time()
+        assert rows[1][2] == [(programme, 1)]
+        assert rows[2][2] == [(None, None)]
+
+
+class ScheduleSnapshotTestCase(TestCase):
+    def test_snapshot_response(self):
+        meta, unused = ProgrammeEventMeta.get_or_create_dummy()
+        event = meta.event
+        factory = RequestFactory()
+
+        with TemporaryDirectory() as snapshot_root, override_settings(PROGRAMME_SNAPSHOT_ROOT=snapshot_root):
+            write_manifest(event, dict())
+            assert snapshot_response(factory.get('/'), event, 'json') is None
+
+            path = '{event_slug}/json.abc123'.format(event_slug=event.slug)
+            get_snapshot_storage().save(path, ContentFile(b'[]'))
+            write_manifest(event, dict(json=dict(etag='abc123', path=path, content_type='application/json')))
+            assert get_manifest(event)['json']['etag'] == 'abc123'
+
+            response = snapshot_response(factory.get('/'), event, 'json')
+            assert response.status_code == 200
+            assert response.content == b'[]'
+            assert response['ETag'] == '"abc123"'
+
+            response = snapshot_response(factory.get('/', HTTP_IF_NONE_MATCH='"abc123"'), event, 'json')
+            assert response.status_code == 304
+
+            write_manifest(event, dict())
+            assert snapshot_response(factory.get('/'), event, 'json') is None
+
+    def test_stale_snapshot_is_not_served(self):
+        meta, unused = ProgrammeEventMeta.get_or_create_dummy()
+        event = meta.event
+        factory = RequestFactory()
+
+        with TemporaryDirectory() as snapshot_root, override_settings(PROGRAMME_SNAPSHOT_ROOT=snapshot_root):
+            path = '{event_slug}/json.abc123'.format(event_slug=event.slug)
+            get_snapshot_storage().save(path, ContentFile(b'[]'))
+            write_manifest(event, dict(json=dict(etag='abc123', path=path, content_type='application/json')))
+
+            with mock.patch('programme.schedule_snapshot.refresh_schedule_snapshots') as refresh:
+                assert snapshot_response(factory.get('/'), event, 'json').status_code == 200
+                assert not refresh.called
+
+                stale_time = now().timestamp() - SCHEDULE_SNAPSHOT_MAX_AGE_SECONDS - 60
+                os.utime(get_snapshot_storage().path(get_manifest_path(event)), (stale_time, stale_time))
+
+                assert snapshot_response(factory.get('/'), event, 'json') is None
+                refresh.assert_called_once_with(event.id)
+
+    def test_host_change_refreshes_snapshots(self):
+        pr, unused = ProgrammeRole.get_or_create_dummy()
+        event_id = pr.programme.category.event_id
+
+        with mock.patch('programme.handlers.schedule.refresh_schedule_snapshots') as refresh:
+            pr.is_active = False
+            pr.save()
+            refresh.assert_called_with(event_id)
+
+            refresh.reset_mock()
+            FreeformOrganizer.objects.create(programme=pr.programme, text='Dummy organizer')
+            refresh.assert_called_with(event_id)
+
+            refresh.reset_mock()
+            pr.role.is_public = False
+            pr.role.save()
+            refresh.assert_called_with(event_id)
+
+            refresh.reset_mock()
+            pr.delete()
+            refresh.assert_called_with(event_id)
+
+
+class ProgrammeJSONTestCase(TestCase):
+    def test_programme_json_query_count(self):
+        pr, unused = ProgrammeRole.get_or_create_dummy()
+        pr.role.is_public = True
+        pr.role.save()
+
+        event = pr.programme.category.event
+
+        def count_queries(format):
+            with CaptureQueriesContext(connection) as context:
+                programmes_json = get_programmes_json(event, format=format)
+            return len(programmes_json), len(context.captured_queries)
+
+        def add_programme(n):
+            programme, unused = Programme.get_or_create_dummy(title='Dummy program {n}'.format(n=n))
+            ProgrammeRole.objects.create(programme=programme, person=pr.person, role=pr.role)
+            FreeformOrganizer.objects.create(programme=programme, text='Dummy organizer {n}'.format(n=n))
+
+        add_programme(1)
+
+        for format in ['default', 'desucon', 'ropecon']:
+            num_programmes, num_queries = count_queries(format)
+            assert num_programmes == 2
+
+            for n in range(2, 6):
+                add_programme(n)
+
+            more_programmes, more_queries = count_queries(format)
+            assert more_programmes > num_programmes
+            assert more_queries == num_queries
+
+            # reset for the next format
+            Programme.objects.filter(title__startswith='Dummy program ').exclude(title='Dummy program 1').delete()
+
+        programme_json = [p for p in get_programmes_json(event) if p['title'] == 'Dummy program 1'][0]
+        assert programme_json['formatted_hosts'] == 'Dummy organizer 1, {name}'.format(name=pr.person.display_name)
+
+
+class ConflictIndexTestCase(TestCase):
+    def test_conflict_index(self):
+        t = datetime(2019, 7, 27, 10, 0, 0, tzinfo=tzlocal())
+
+        def slot(room_id, start_hour, end_hour, person_ids=()):
+            return ProgrammeSlot(
+                room_id=room_id,
+                start_time=t + timedelta(hours=start_hour),
+                end_time=t + timedelta(hours=end_hour),
+                person_ids=tuple(person_ids),
+            )
+
+        slots = {
+            1: slot(1, 0, 2),
+            2: slot(1, 1, 3),  # partially overlaps 1 in room 1
+            3: slot(1, 3, 4),  # starts when 2 ends, no conflict
+            4: slot(2, 0, 5, [10]),
+            5: slot(3, 2, 3, [10]),  # same host as 4
+        }
+
+        index = ConflictIndex(slots)
+        conflicts = index.get_conflicts()
+
+        assert [(c.kind, c.key_id, c.programme_ids) for c in conflicts] == [
+            ('room', 1, (1, 2)),
+            ('person', 10, (4, 5)),
+        ]
+        assert conflicts[0].start_time == t + timedelta(hours=1)
+        assert conflicts[0].end_time == t + timedelta(hours=2)
+
+        # move 3 on top of 2 and 4 out of the way of 5
+        slots.update({3: slot(1, 2, 4), 4: slot(2, 0, 2, [10])})
+        del slots[1]
+
+        index = ConflictIndex(slots)
+        assert [c.programme_ids for c in index.get_conflicts()] == [(2, 3)]
+        assert index.get_conflicts(programme_id=5) == []
+
+    def test_build(self):
+        programme, unused = Programme.get_or_create_dummy()
+        programme.start_time = datetime(2019, 7, 27, 10, 0, 0, tzinfo=tzlocal())
+        programme.length = 60
+        programme.save()
+
+        other, unused = Programme.get_or_create_dummy(title='Other dummy program')
+        other.start_time = programme.start_time + timedelta(minutes=30)
+        other.length = 60
+        other.save()
+
+        conflicts = ConflictIndex.build(programme.category.event).get_conflicts()
+        assert [(c.kind, c.programme_ids) for c in conflicts] == [
+            ('room', tuple(sorted((programme.id, other.id)))),
+        ]
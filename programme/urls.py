@@ -11,6 +11,7 @@ from .views import (
     programme_admin_change_invitation_role_view,
     programme_admin_cold_offers_view,
     programme_admin_cold_offers_view,
+    programme_admin_conflicts_api_view,
     programme_admin_create_view,
     programme_admin_detail_view,
     programme_admin_email_list_view,
@@ -50,7 +51,7 @@ urlpatterns = [
     url(
         r'^events/(?P<event_slug>[a-z0-9-]+)/programme/?$',
         programme_schedule_view,
-        dict(show_programme_actions=True),
+        dict(show_programme_actions=True, snapshot='schedule'),
         name='programme_schedule_view',
     ),
 
@@ -71,7 +72,7 @@ urlpatterns = [
     url(
         r'^events/(?P<event_slug>[a-z0-9-]+)/programme/fragment/?$',
         programme_schedule_view,
-        dict(template='programme_schedule_fragment.pug'),
+        dict(template='programme_schedule_fragment.pug', snapshot='schedule_fragment'),
         name='programme_schedule_fragment'
     ),
 
@@ -147,6 +148,12 @@ urlpatterns = [
         name='programme_json_view',
     ),
 
+    url(
+        r'^api/v1/events/(?P<event_slug>[a-z0-9-]+)/programme/conflicts/?$',
+        programme_admin_conflicts_api_view,
+        name='programme_admin_conflicts_api_view',
+    ),
+
     url(
         r'^events/(?P<event_slug>[a-z0-9-]+)/programme/desucon\.json$',
         programme_json_view,
@@ -0,0 +1,46 @@
+from django.views.decorators.http import require_safe
+
+from api.utils import api_view
+from core.models import Person
+
+from ..conflict_index import get_conflict_index
+from ..helpers import programme_admin_required
+from ..models import Programme, Room
+
+
+@programme_admin_required
+@require_safe
+@api_view
+def programme_admin_conflicts_api_view(request, vars, event):
+    """
+    Lists programmes of the event that overlap in the same room or with the same host. ?programme=<id> limits the
+    list to the conflicts of one programme.
+    """
+    programme_id = request.GET.get('programme')
+    programme_id = int(programme_id) if programme_id else None
+
+    conflicts = get_conflict_index(event).get_conflicts(programme_id)
+
+    programme_ids = {programme_id for conflict in conflicts for programme_id in conflict.programme_ids}
+    titles = dict(Programme.objects.filter(id__in=programme_ids).values_list('id', 'title'))
+
+    room_ids = {conflict.key_id for conflict in conflicts if conflict.kind == 'room'}
+    room_names = dict(Room.objects.filter(id__in=room_ids).values_list('id', 'name'))
+
+    person_ids = {conflict.key_id for conflict in conflicts if conflict.kind == 'person'}
+    person_names = {person.id: person.display_name for person in Person.objects.filter(id__in=person_ids)}
+
+    return [
+        dict(
+            kind=conflict.kind,
+            room=room_names.get(conflict.key_id) if conflict.kind == 'room' else None,
+            person=person_names.get(conflict.key_id) if conflict.kind == 'person' else None,
+            start_time=conflict.start_time,
+            end_time=conflict.end_time,
+            programmes=[
+                dict(id=programme_id, title=titles.get(programme_id))
+                for programme_id in conflict.programme_ids
+            ],
+        )
+        for conflict in conflicts
+    ]
@@ -24,6 +24,7 @@ from ..helpers import (
     programme_event_required,
     public_programme_required,
 )
+from ..schedule_snapshot import snapshot_response
 
 
 def get_schedule_tabs(request, event):
@@ -48,8 +49,7 @@ SCHEDULE_TEMPLATES = dict(
 
 
 @public_programme_required
-@cache_control(public=True, max_age=5 * 60)
-@cache_page(5 * 60)  # XXX remove once nginx cache is in place
+@cache_control(public=True, max_age=60)
 @require_safe
 def programme_schedule_view(
     request,
@@ -57,7 +57,13 @@ def programme_schedule_view(
     internal_programmes=False,
     template=None,
     show_programme_actions=False,
+    snapshot=None,
 ):
+    if snapshot:
+        response = snapshot_response(request, event, snapshot)
+        if response is not None:
+            return response
+
     vars = dict(
         # hide the user menu to prevent it getting cached
         login_page=True,
@@ -206,6 +212,14 @@ def programme_mobile_schedule_view(request, event):
 @programme_event_required
 @require_safe
 def programme_internal_adobe_taggedtext_view(request, event):
+    response = snapshot_response(request, event, 'taggedtext')
+    if response is not None:
+        return response
+
+    return HttpResponse(render_adobe_taggedtext(request, event), 'text/plain; charset=utf-16')
+
+
+def render_adobe_taggedtext(request, event):
     vars = dict(programmes_by_start_time=AllRoomsPseudoView(event).get_programmes_by_start_time(request=request))
     data = render_to_string('programme_schedule.taggedtext', vars, request=request)
 
@@ -213,37 +227,43 @@ def programme_internal_adobe_taggedtext_view(request, event):
     data = data.replace('\r\n', '\n').replace('\n', '\r\n')
 
     # encode to UTF-16; the LE at the end means no BOM, which is absolutely critical
-    data = data.encode('UTF-16LE')
-
-    return HttpResponse(data, 'text/plain; charset=utf-16')
+    return data.encode('UTF-16LE')
 
 
 @programme_event_required
 @require_safe
 def programme_plaintext_view(request, event):
+    response = snapshot_response(request, event, 'plaintext')
+    if response is not None:
+        return response
+
+    return HttpResponse(render_plaintext(request, event), 'text/plain; charset=utf-8')
+
+
+def render_plaintext(request, event):
     vars = dict(programmes_by_start_time=AllRoomsPseudoView(event).get_programmes_by_start_time(request=request))
-    data = render_to_string('programme_plaintext_view.txt', vars, request=request)
-    return HttpResponse(data, 'text/plain; charset=utf-8')
+    return render_to_string('programme_plaintext_view.txt', vars, request=request)
 
 
 @programme_event_required
 @require_safe
 @api_view
 def programme_json_view(request, event, format='default', include_unpublished=False):
+    if format == 'default' and not include_unpublished:
+        response = snapshot_response(request, event, 'json')
+        if response is not None:
+            return response
+
+    return get_programmes_json(event, format=format, include_unpublished=include_unpublished)
+
+
+def get_programmes_json(event, format='default', include_unpublished=False):
     criteria = dict(category__event=event)
 
     if not include_unpublished:
         criteria.update(state='published')
 
-    programmes = (
-        Programme.objects.filter(**criteria)
-            .select_related('category__event')
-            .select_related('room')
-            .prefetch_related('tags')
-
-            # Does not do the needful due to formatted_organizers operating on the "through" model
-            # .prefetch_related('organizers')
-    )
+    programmes = Programme.prefetch_for_json(Programme.objects.filter(**criteria))
 
     return [programme.as_json(format=format) for programme in programmes]
 
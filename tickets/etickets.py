@@ -0,0 +1,175 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from hashlib import sha256
+from tempfile import NamedTemporaryFile
+from time import time
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger('kompassi')
+
+# Cached PDFs that have not been served for this long are removed by cleanup_etickets_cache
+ETICKETS_CACHE_MAX_AGE = timedelta(days=30)
+
+
+def _get_print_logo_mtime(meta):
+    if not meta.print_logo_path:
+        return None
+
+    try:
+        return os.stat(meta.print_logo_path).st_mtime
+    except OSError:
+        logger.warning('Print logo %s of %s is missing', meta.print_logo_path, meta.event)
+        return None
+
+
+def get_etickets_cache_key(order, lippukala_order, codes):
+    """
+    Content address of the rendered PDF: changes whenever anything printed on the tickets changes, including the
+    status of the codes and a logo file replaced in place.
+    """
+    meta = order.event.tickets_event_meta
+
+    digest = sha256()
+    for part in [
+        order.event.slug,
+        order.reference_number,
+        meta.print_logo_path,
+        _get_print_logo_mtime(meta),
+        meta.print_logo_width_mm,
+        meta.print_logo_height_mm,
+        lippukala_order.address_text,
+        lippukala_order.free_text,
+    ] + [
+        value
+        for code in codes
+        for value in (code.id, code.code, code.literate_code, code.product_text, code.status)
+    ]:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+def _get_cache_path(cache_key):
+    return os.path.join(settings.TICKETS_ETICKETS_CACHE_DIR, cache_key[:2], cache_key + '.pdf')
+
+
+def _write_atomically(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as temp_file:
+        temp_file.write(content)
+
+    os.replace(temp_file.name, path)
+
+
+def render_etickets_pdf(order):
+    """
+    Renders the electronic tickets of the order, reusing a previous rendering from the on-disk cache if nothing on
+    the tickets has changed since.
+    """
+    from lippukala.printing import OrderPrinter
+
+    lippukala_order = order.lippukala_order
+    codes = list(lippukala_order.code_set.order_by('id'))
+    cache_key = get_etickets_cache_key(order, lippukala_order, codes)
+
+    cache_path = _get_cache_path(cache_key) if settings.TICKETS_ETICKETS_CACHE_DIR else None
+    if cache_path:
+        try:
+            with open(cache_path, 'rb') as cached_file:
+                pdf = cached_file.read()
+        except FileNotFoundError:
+            pass
+        else:
+            # keeps the file from expiring while it is in use
+            try:
+                os.utime(cache_path)
+            except OSError:
+                pass
+
+            return pdf
+
+    meta = order.event.tickets_event_meta
+
+    printer = OrderPrinter(
+        print_logo_path=meta.print_logo_path,
+        print_logo_size_cm=meta.print_logo_size_cm,
+    )
+    printer.process_order(lippukala_order)
+    pdf = printer.finish()
+
+    if cache_path:
+        try:
+            _write_atomically(cache_path, pdf)
+        except OSError:
+            logger.exception('Failed to write e-ticket cache file %s', cache_path)
+
+    return pdf
+
+
+def cleanup_etickets_cache(max_age=ETICKETS_CACHE_MAX_AGE):
+    """
+    Removes cached PDFs that have not been rendered or served within max_age. Returns the number of files removed.
+    """
+    cache_dir = settings.TICKETS_ETICKETS_CACHE_DIR
+    if not cache_dir or not os.path.isdir(cache_dir):
+        return 0
+
+    expires_before = time() - max_age.total_seconds()
+    num_removed = 0
+
+    for dir_path, unused, filenames in os.walk(cache_dir):
+        for filename in filenames:
+            path = os.path.join(dir_path, filename)
+            try:
+                if os.stat(path).st_mtime < expires_before:
+                    os.unlink(path)
+                    num_removed += 1
+            except FileNotFoundError:
+                # removed concurrently
+                pass
+
+    return num_removed
+
+
+def _prerender_order(order_id):
+    from .models import Order
+
+    order = Order.objects.select_related('event__ticketseventmeta').get(id=order_id)
+    render_etickets_pdf(order)
+
+
+def prerender_etickets(event, max_workers=None):
+    """
+    Renders the electronic tickets of all paid orders of the event into the on-disk cache using a pool of worker
+    processes. Returns the number of orders rendered.
+    """
+    from lippukala.models import Order as LippukalaOrder
+    from .models import Order
+
+    order_ids = list(
+        Order.objects.filter(
+            event=event,
+            payment_date__isnull=False,
+            cancellation_time__isnull=True,
+            reference_number__in=LippukalaOrder.objects.filter(event=event.slug).values('reference_number'),
+        ).order_by('id').values_list('id', flat=True)
+    )
+
+    if not order_ids:
+        return 0
+
+    # Forked workers must not share the database connections of the parent process.
+    connections.close_all()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for unused in executor.map(_prerender_order, order_ids, chunksize=16):
+            pass
+
+    return len(order_ids)
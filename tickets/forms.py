@@ -11,6 +11,7 @@ from core.utils import horizontal_form_helper, indented_without_label, initializ
 from .models import (
     AccommodationInformation,
     Customer,
+    LimitGroup,
     Order,
     OrderProduct,
     Product,
@@ -191,6 +192,28 @@ class CreateBatchForm(forms.Form):
         self.fields['product'].queryset = Product.objects.filter(event=event)
 
 
+class StatsByDateForm(forms.Form):
+    product = forms.ModelChoiceField(queryset=Product.objects.all(), required=False, label="Tuote")
+    limit_group = forms.ModelChoiceField(queryset=LimitGroup.objects.all(), required=False, label="Loppuunmyyntiryhmä")
+    resolution = forms.ChoiceField(
+        choices=[
+            ('day', "Päivä"),
+            ('hour', "Tunti"),
+        ],
+        required=False,
+        label="Tarkkuus",
+    )
+    cumulative = forms.BooleanField(required=False, label="Kumulatiivinen")
+
+    def __init__(self, *args, **kwargs):
+        event = kwargs.pop('event')
+
+        super(StatsByDateForm, self).__init__(*args, **kwargs)
+
+        self.fields['product'].queryset = Product.objects.filter(event=event)
+        self.fields['limit_group'].queryset = LimitGroup.objects.filter(event=event)
+
+
 class ShirtOrderForm(forms.ModelForm):
     class Meta:
         model = ShirtOrder
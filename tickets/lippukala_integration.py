@@ -1,5 +1,7 @@
 # encoding: utf-8
 
+from random import SystemRandom
+
 # https://docs.google.com/spreadsheet/ccc?key=0Annwjrq9JeBldGQ3aEFRakpJeGtISUVpTnpJRl92dUE&usp=drive_web#gid=0
 KEYSPACE = list(set("""
 ahma    arkki   ääni    höyry   kulta   aita    piano   hylly   hame    kahvi   viiva
@@ -50,3 +52,133 @@ KEYSPACES = {
 }
 
 select_queue = lambda order: Queue.ONE_QUEUE
+
+
+# Upper bound for rounds of drawing candidate codes before giving up. Each round only draws as many candidates as
+# are still missing, so this is only hit if the code space is (nearly) exhausted.
+MAX_ALLOCATION_ROUNDS = 100
+MAX_INSERT_ATTEMPTS = 3
+
+_random = SystemRandom()
+
+
+def make_code(lippukala_order, prefix, product_text, code_str):
+    """
+    Returns an unsaved Code with the given code. The literate code is spelled out by lippukala itself just like
+    Code.save() would do, so that it does not matter that the code is not drawn by lippukala.
+    """
+    from lippukala.models import Code
+
+    code = Code(
+        order=lippukala_order,
+        prefix=prefix,
+        product_text=product_text,
+        code=code_str,
+    )
+    code.literate_code = code._generate_literate_code()
+
+    return code
+
+
+def allocate_codes(num_codes):
+    """
+    Draws num_codes distinct random codes that are not used by any existing Code. Uniqueness against the database is
+    checked with one query per round instead of one per code.
+    """
+    from django.conf import settings
+    from lippukala.models import Code
+
+    min_digits = getattr(settings, 'LIPPUKALA_CODE_MIN_N_DIGITS', 7)
+    max_digits = getattr(settings, 'LIPPUKALA_CODE_MAX_N_DIGITS', 7)
+
+    codes = set()
+
+    for unused in range(MAX_ALLOCATION_ROUNDS):
+        if len(codes) >= num_codes:
+            break
+
+        candidates = set()
+        while len(candidates) < num_codes - len(codes):
+            num_digits = _random.randint(min_digits, max_digits)
+            candidate = "".join(_random.choice("0123456789") for i in range(num_digits))
+            if candidate not in codes:
+                candidates.add(candidate)
+
+        taken = set(Code.objects.filter(code__in=candidates).values_list('code', flat=True))
+        codes.update(candidates - taken)
+
+    if len(codes) < num_codes:
+        raise RuntimeError('Unable to allocate {num_codes} unused codes, is the code space exhausted?'.format(
+            num_codes=num_codes,
+        ))
+
+    return list(codes)
+
+
+def create_codes(orders):
+    """
+    Creates the lippukala orders and codes for the electronic tickets of the given orders with a constant number of
+    queries. Orders without electronic tickets are skipped.
+
+    Returns a dict of order id → (lippukala_order, codes).
+    """
+    from django.db import IntegrityError, transaction
+    from lippukala.models import Code, Order as LippukalaOrder
+    from .models import OrderProduct
+
+    orders = {order.id: order for order in orders}
+
+    order_products_by_order = {}
+    for op in OrderProduct.objects.filter(
+        order_id__in=orders.keys(),
+        count__gt=0,
+        product__electronic_ticket=True,
+    ).select_related('product').order_by('id'):
+        order_products_by_order.setdefault(op.order_id, []).append(op)
+
+    if not order_products_by_order:
+        return {}
+
+    order_ids = sorted(order_products_by_order.keys())
+    lippukala_orders = LippukalaOrder.objects.bulk_create([
+        LippukalaOrder(
+            address_text=orders[order_id].formatted_address,
+            free_text=orders[order_id].event.tickets_event_meta.ticket_free_text,
+            reference_number=orders[order_id].reference_number,
+            event=orders[order_id].event.slug,
+        )
+        for order_id in order_ids
+    ])
+
+    # (order_id, lippukala_order, prefix, product_text) per code to be created
+    slots = []
+    for order_id, lippukala_order in zip(order_ids, lippukala_orders):
+        prefix = select_queue(orders[order_id])
+        for op in order_products_by_order[order_id]:
+            num_codes = op.count * op.product.electronic_tickets_per_product
+            slots.extend([(order_id, lippukala_order, prefix, op.product.electronic_ticket_title)] * num_codes)
+
+    for attempt in range(MAX_INSERT_ATTEMPTS):
+        codes = [
+            make_code(lippukala_order, prefix, product_text, code)
+            for ((order_id, lippukala_order, prefix, product_text), code) in zip(slots, allocate_codes(len(slots)))
+        ]
+
+        try:
+            # a concurrent allocation may have grabbed some of our codes in the meanwhile
+            with transaction.atomic():
+                Code.objects.bulk_create(codes)
+        except IntegrityError:
+            if attempt == MAX_INSERT_ATTEMPTS - 1:
+                raise
+        else:
+            break
+
+    result = {
+        order_id: (lippukala_order, [])
+        for (order_id, lippukala_order) in zip(order_ids, lippukala_orders)
+    }
+    for (order_id, unused, unused, unused), code in zip(slots, codes):
+        result[order_id][1].append(code)
+
+    return result
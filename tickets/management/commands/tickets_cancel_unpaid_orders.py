@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    args = '[event_slug...]'
+    help = 'Cancel confirmed orders that have not been paid in time (meant to be run periodically eg. from cron)'
+
+    def add_arguments(self, parser):
+        from tickets.models import UNPAID_CANCEL_HOURS, CANCEL_CHUNK_SIZE
+
+        parser.add_argument(
+            'event_slugs',
+            nargs='+',
+            metavar='EVENT_SLUG',
+        )
+
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=UNPAID_CANCEL_HOURS,
+            help='Cancel orders confirmed more than this many hours ago (default: %(default)s)',
+        )
+
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CANCEL_CHUNK_SIZE,
+            help='Number of orders to cancel in one transaction (default: %(default)s)',
+        )
+
+        parser.add_argument(
+            '--send-email',
+            action='store_true',
+            default=False,
+            help='Send cancellation notices to the customers',
+        )
+
+    def handle(self, *args, **options):
+        from core.models import Event
+        from tickets.models import Order
+
+        for event_slug in options['event_slugs']:
+            event = Event.objects.get(slug=event_slug)
+
+            num_cancelled_orders = Order.cancel_unpaid_orders(
+                event=event,
+                hours=options['hours'],
+                send_email=options['send_email'],
+                chunk_size=options['chunk_size'],
+            )
+
+            self.stdout.write('{event_slug}: cancelled {num_cancelled_orders} orders'.format(
+                event_slug=event_slug,
+                num_cancelled_orders=num_cancelled_orders,
+            ))
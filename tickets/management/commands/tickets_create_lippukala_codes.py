@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    args = '[event_slug...]'
+    help = 'Create missing electronic ticket codes for paid orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'event_slugs',
+            nargs='+',
+            metavar='EVENT_SLUG',
+        )
+
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of orders to process in one transaction',
+        )
+
+    def handle(self, *args, **options):
+        from django.db import transaction
+        from lippukala.models import Order as LippukalaOrder
+
+        from core.models import Event
+        from tickets.lippukala_integration import create_codes
+        from tickets.models import Order
+
+        chunk_size = options['chunk_size']
+
+        for event_slug in options['event_slugs']:
+            event = Event.objects.get(slug=event_slug)
+
+            order_ids = list(
+                Order.objects.filter(
+                    event=event,
+                    confirm_time__isnull=False,
+                    payment_date__isnull=False,
+                    cancellation_time__isnull=True,
+                    order_product_set__count__gt=0,
+                    order_product_set__product__electronic_ticket=True,
+                )
+                .exclude(
+                    reference_number__in=LippukalaOrder.objects.filter(event=event.slug).values('reference_number'),
+                )
+                .order_by('id')
+                .values_list('id', flat=True)
+                .distinct()
+            )
+
+            num_codes = 0
+            for i in range(0, len(order_ids), chunk_size):
+                orders = Order.objects.filter(
+                    id__in=order_ids[i:i + chunk_size],
+                ).select_related('customer', 'event__ticketseventmeta')
+
+                with transaction.atomic():
+                    created = create_codes(orders)
+
+                num_codes += sum(len(codes) for (lippukala_order, codes) in created.values())
+
+                self.stdout.write('{event_slug}: {num_orders}/{total_orders} orders processed'.format(
+                    event_slug=event_slug,
+                    num_orders=min(i + chunk_size, len(order_ids)),
+                    total_orders=len(order_ids),
+                ))
+
+            self.stdout.write('{event_slug}: created {num_codes} codes for {num_orders} orders'.format(
+                event_slug=event_slug,
+                num_codes=num_codes,
+                num_orders=len(order_ids),
+            ))
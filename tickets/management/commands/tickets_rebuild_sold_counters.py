@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    args = '[event_slug...]'
+    help = 'Verify the sold counters of limit groups and products against orders and fix them if necessary'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'event_slugs',
+            nargs='+',
+            metavar='EVENT_SLUG',
+        )
+
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            default=False,
+            help='Only report counters that are out of sync, do not fix them',
+        )
+
+    def handle(self, *args, **options):
+        from core.models import Event
+        from tickets.models import rebuild_sold_counters
+
+        for event_slug in options['event_slugs']:
+            event = Event.objects.get(slug=event_slug)
+
+            mismatches = rebuild_sold_counters(event, dry_run=options['dry_run'])
+
+            for target, counted, actual in mismatches:
+                self.stdout.write('{event_slug}: {target_type} {target_id} ({description}): counted {counted}, actual {actual}'.format(
+                    event_slug=event_slug,
+                    target_type=target.__class__.__name__,
+                    target_id=target.pk,
+                    description=getattr(target, 'description', None) or getattr(target, 'name', ''),
+                    counted=counted,
+                    actual=actual,
+                ))
+
+            self.stdout.write('{event_slug}: {num_mismatches} counters out of sync{fixed}'.format(
+                event_slug=event_slug,
+                num_mismatches=len(mismatches),
+                fixed=' (not fixed)' if options['dry_run'] else '',
+            ))
@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from tickets.etickets import ETICKETS_CACHE_MAX_AGE
+
+
+class Command(BaseCommand):
+    args = '[event_slug...]'
+    help = 'Pre-render the electronic tickets of all paid orders into the e-ticket cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'event_slugs',
+            nargs='+',
+            metavar='EVENT_SLUG',
+        )
+
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Number of worker processes (default: number of CPUs)',
+        )
+
+        parser.add_argument(
+            '--max-age-days',
+            type=int,
+            default=ETICKETS_CACHE_MAX_AGE.days,
+            help='Remove cached e-tickets not used for this many days (default: %(default)s)',
+        )
+
+    def handle(self, *args, **options):
+        from core.models import Event
+        from tickets.etickets import cleanup_etickets_cache, prerender_etickets
+
+        num_removed = cleanup_etickets_cache(max_age=timedelta(days=options['max_age_days']))
+        self.stdout.write('removed {num_removed} expired e-tickets from the cache'.format(num_removed=num_removed))
+
+        for event_slug in options['event_slugs']:
+            event = Event.objects.get(slug=event_slug)
+
+            num_orders = prerender_etickets(event, max_workers=options['workers'])
+
+            self.stdout.write('{event_slug}: rendered e-tickets of {num_orders} orders'.format(
+                event_slug=event_slug,
+                num_orders=num_orders,
+            ))
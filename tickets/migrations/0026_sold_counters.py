@@ -0,0 +1,31 @@
+# Generated by Django 2.1.5 on 2019-02-17 12:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+import tickets.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0025_auto_20181130_0739'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LimitGroupCounter',
+            fields=[
+                ('limit_group', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counter', serialize=False, to='tickets.LimitGroup')),
+                ('amount_sold', models.IntegerField(default=0)),
+            ],
+            bases=(tickets.models.SoldCounterMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='ProductCounter',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counter', serialize=False, to='tickets.Product')),
+                ('amount_sold', models.IntegerField(default=0)),
+            ],
+            bases=(tickets.models.SoldCounterMixin, models.Model),
+        ),
+    ]
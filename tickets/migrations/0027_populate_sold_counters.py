@@ -0,0 +1,46 @@
+# Generated by Django 2.1.5 on 2019-02-17 12:05
+
+from collections import Counter
+
+from django.db import migrations
+from django.db.models import Sum
+
+
+def populate_sold_counters(apps, schema_editor):
+    OrderProduct = apps.get_model('tickets', 'orderproduct')
+    Product = apps.get_model('tickets', 'product')
+    LimitGroup = apps.get_model('tickets', 'limitgroup')
+    ProductCounter = apps.get_model('tickets', 'productcounter')
+    LimitGroupCounter = apps.get_model('tickets', 'limitgroupcounter')
+
+    amount_sold_by_product = dict(
+        OrderProduct.objects.filter(
+            order__confirm_time__isnull=False,
+            order__cancellation_time__isnull=True,
+        ).order_by().values_list('product_id').annotate(Sum('count'))
+    )
+
+    amount_sold_by_limit_group = Counter()
+    for product_id, limit_group_id in Product.limit_groups.through.objects.values_list('product_id', 'limitgroup_id'):
+        amount_sold_by_limit_group[limit_group_id] += amount_sold_by_product.get(product_id, 0)
+
+    ProductCounter.objects.bulk_create([
+        ProductCounter(product_id=product_id, amount_sold=amount_sold_by_product.get(product_id, 0))
+        for product_id in Product.objects.values_list('id', flat=True)
+    ])
+
+    LimitGroupCounter.objects.bulk_create([
+        LimitGroupCounter(limit_group_id=limit_group_id, amount_sold=amount_sold_by_limit_group[limit_group_id])
+        for limit_group_id in LimitGroup.objects.values_list('id', flat=True)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0026_sold_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_sold_counters, elidable=True),
+    ]
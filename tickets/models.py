@@ -1,9 +1,12 @@
+from collections import Counter, namedtuple
 from datetime import datetime, timedelta, date
 from datetime import time as dtime
 from time import mktime
 import logging
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import m2m_changed, pre_save, post_save, post_delete
+from django.dispatch import receiver
 from django.template.loader import render_to_string
 from django.core.mail import EmailMessage
 from django.conf import settings
@@ -31,6 +34,11 @@ from .receipt import render_receipt
 logger = logging.getLogger('kompassi')
 LOW_AVAILABILITY_THRESHOLD = 10
 UNPAID_CANCEL_HOURS = 24
+CANCEL_CHUNK_SIZE = 500
+
+
+class SoldOutError(RuntimeError):
+    pass
 
 
 class TicketsEventMeta(ContactEmailMixin, EventMetaBase):
@@ -202,66 +210,85 @@ class Batch(models.Model):
 
     @classmethod
     def create(cls, event, max_items=100, product=None):
-        # XXX concurrency disaster waiting to happen
-        # solution: only I do the botching^Wbatching
-
-        batch = cls(event=event)
-        batch.save()
-
-        orders = event.order_set.filter(
-            # Order is confirmed
-            confirm_time__isnull=False,
-
-            # Order is paid
-            payment_date__isnull=False,
-
-            # Order has not yet been allocated into a Batch
-            batch__isnull=True,
-
-            # Order has not been cancelled
-            cancellation_time__isnull=True
-        )
-
-        if product is not None:
-            orders = orders.filter(order_product_set__product=product)
-
-        orders = orders.order_by("confirm_time")
-
-        accepted = 0
+        """
+        Allocates up to max_items paid orders that require shipping into a new batch, oldest first. If product is
+        given, only orders that contain at least one of it are allocated.
 
-        for order in orders:
-            # TODO do this in the database
-            # Some orders need not be shipped.
-            if not order.requires_shipping:
-                continue
+        The orders are selected and locked in one query, so concurrently created batches never share orders.
+        """
+        with transaction.atomic():
+            batch = cls(event=event)
+            batch.save()
+
+            orders = event.order_set.annotate(
+                has_shippable_products=models.Exists(OrderProduct.objects.filter(
+                    order=models.OuterRef('pk'),
+                    count__gt=0,
+                    product__requires_shipping=True,
+                )),
+            ).filter(
+                # Order is confirmed
+                confirm_time__isnull=False,
+
+                # Order is paid
+                payment_date__isnull=False,
+
+                # Order has not yet been allocated into a Batch
+                batch__isnull=True,
+
+                # Order has not been cancelled
+                cancellation_time__isnull=True,
+
+                # Some orders need not be shipped.
+                has_shippable_products=True,
+            )
 
             # Some orders have zero for the product we want.
-            if product is not None and not order.order_product_set.filter(product=product, count__gte=1).exists():
-                continue
+            if product is not None:
+                orders = orders.annotate(
+                    contains_product=models.Exists(OrderProduct.objects.filter(
+                        order=models.OuterRef('pk'),
+                        count__gt=0,
+                        product=product,
+                    )),
+                ).filter(contains_product=True)
+
+            order_ids = list(
+                orders.select_for_update().order_by('confirm_time').values_list('id', flat=True)[:max_items]
+            )
 
-            order.batch = batch
-            order.save()
+            Order.objects.filter(id__in=order_ids).update(batch=batch)
 
-            accepted += 1
-            if accepted >= max_items:
-                break
+            batch._invalidate_stats()
 
         return batch
 
-    def render(self, c):
-        for order in self.order_set.all():
-            order.render(c)
+    def render(self, c, chunk_size=500):
+        """
+        Renders the receipts of the batch onto the canvas c. The orders are fetched chunk_size at a time together
+        with their customers and order products to keep both the number of queries and memory use in check.
+        """
+        order_ids = list(self.order_set.order_by('id').values_list('id', flat=True))
+
+        for i in range(0, len(order_ids), chunk_size):
+            orders = Order.objects.filter(id__in=order_ids[i:i + chunk_size]).order_by('id').select_related(
+                'customer',
+                'event__ticketseventmeta',
+                'event__venue',
+            ).prefetch_related('order_product_set__product')
+
+            for order in orders:
+                order.render(c)
 
     @property
     def can_cancel(self):
         return not self.is_delivered
 
     def cancel(self):
-        for order in self.order_set.all():
-            order.batch = None
-            order.save()
-
-        self.delete()
+        with transaction.atomic():
+            self.order_set.update(batch=None)
+            self._invalidate_stats()
+            self.delete()
 
     @property
     def can_confirm(self):
@@ -273,8 +300,13 @@ class Batch(models.Model):
 
         self.delivery_time = delivery_time
         self.save()
+        self._invalidate_stats()
         self.send_delivery_confirmation_messages()
 
+    def _invalidate_stats(self):
+        from .stats import invalidate_stats
+        invalidate_stats(self.event_id)
+
     def send_delivery_confirmation_messages(self):
         if 'background_tasks' in settings.INSTALLED_APPS:
             from .tasks import batch_send_delivery_confirmation_messages
@@ -313,6 +345,15 @@ class LimitGroup(models.Model):
 
     @property
     def amount_sold(self):
+        try:
+            return self.counter.amount_sold
+        except LimitGroupCounter.DoesNotExist:
+            return LimitGroupCounter.rebuild(self).amount_sold
+
+    def compute_amount_sold(self):
+        """
+        Computes the amount sold from the orders. Expensive; use amount_sold instead.
+        """
         amount_sold = OrderProduct.objects.filter(
             product__limit_groups=self,
             order__confirm_time__isnull=False,
@@ -441,10 +482,19 @@ class Product(models.Model):
 
     @property
     def amount_available(self):
-        return min(group.amount_available for group in self.limit_groups.all())
+        return min(group.amount_available for group in self.limit_groups.select_related('counter'))
 
     @property
     def amount_sold(self):
+        try:
+            return self.counter.amount_sold
+        except ProductCounter.DoesNotExist:
+            return ProductCounter.rebuild(self).amount_sold
+
+    def compute_amount_sold(self):
+        """
+        Computes the amount sold from the orders. Expensive; use amount_sold instead.
+        """
         cnt = OrderProduct.objects.filter(
             product=self,
             order__confirm_time__isnull=False,
@@ -494,6 +544,140 @@ class Product(models.Model):
         return [weekend, saturday, sunday]
 
 
+class SoldCounterMixin(object):
+    """
+    Common functionality for LimitGroupCounter and ProductCounter.
+
+    The counters hold the amount of items sold (that is, in confirmed and not cancelled orders) so that
+    availability checks need not aggregate over all OrderProducts of the event. They are kept up to date by
+    Order.confirm_order, Order.cancel, Order.uncancel and when the OrderProducts of an active order change.
+    If they do get out of sync, `manage.py tickets_rebuild_sold_counters` will fix them.
+    """
+
+    @classmethod
+    def rebuild(cls, target):
+        """
+        Recomputes the counter of `target` (a LimitGroup or a Product) from the orders and stores it.
+        """
+        amount_sold = target.compute_amount_sold()
+        counter, created = cls.objects.get_or_create(pk=target.pk, defaults=dict(amount_sold=amount_sold))
+
+        if not created and counter.amount_sold != amount_sold:
+            counter.amount_sold = amount_sold
+            counter.save()
+
+        return counter
+
+    @classmethod
+    def adjust(cls, deltas):
+        """
+        Given a dict of target_id => delta, adds the deltas to the respective counters. Missing counters are
+        rebuilt from the orders instead, so this needs to be called after the orders have been changed.
+
+        The counters are updated in primary key order to avoid deadlocks.
+        """
+        for target_id, delta in sorted(deltas.items()):
+            if not delta:
+                continue
+
+            if not cls.objects.filter(pk=target_id).update(amount_sold=models.F('amount_sold') + delta):
+                cls.rebuild(cls.target_model.objects.get(pk=target_id))
+
+
+class LimitGroupCounter(SoldCounterMixin, models.Model):
+    target_model = LimitGroup
+
+    limit_group = models.OneToOneField(LimitGroup,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='counter',
+    )
+    amount_sold = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "{self.limit_group}: {self.amount_sold}".format(self=self)
+
+
+class ProductCounter(SoldCounterMixin, models.Model):
+    target_model = Product
+
+    product = models.OneToOneField(Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='counter',
+    )
+    amount_sold = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "{self.product}: {self.amount_sold}".format(self=self)
+
+
+def adjust_sold_counters(product_deltas):
+    """
+    Given a dict of product_id => change in amount sold, updates the ProductCounters and the LimitGroupCounters
+    of the limit groups the products belong to.
+    """
+    product_deltas = {product_id: delta for (product_id, delta) in product_deltas.items() if delta}
+    if not product_deltas:
+        return
+
+    limit_group_deltas = Counter()
+    for product_id, limit_group_id in Product.limit_groups.through.objects.filter(
+        product_id__in=product_deltas.keys(),
+    ).values_list('product_id', 'limitgroup_id'):
+        limit_group_deltas[limit_group_id] += product_deltas[product_id]
+
+    ProductCounter.adjust(product_deltas)
+    LimitGroupCounter.adjust(limit_group_deltas)
+
+
+def rebuild_sold_counters(event, dry_run=False):
+    """
+    Recomputes the sold counters of all limit groups and products of the event with two grouped queries and
+    fixes those that are out of sync. Returns a list of (target, counted, actual) for counters that were
+    out of sync. Missing counters are created lazily, so they only count as out of sync if something was sold.
+    """
+    amount_sold_by_product = dict(
+        OrderProduct.objects.filter(
+            product__event=event,
+            order__confirm_time__isnull=False,
+            order__cancellation_time__isnull=True,
+        ).order_by().values_list('product_id').annotate(models.Sum('count'))
+    )
+
+    amount_sold_by_limit_group = Counter()
+    for product_id, limit_group_id in Product.limit_groups.through.objects.filter(
+        limitgroup__event=event,
+    ).values_list('product_id', 'limitgroup_id'):
+        amount_sold_by_limit_group[limit_group_id] += amount_sold_by_product.get(product_id, 0)
+
+    mismatches = []
+
+    with transaction.atomic():
+        for counter_model, actual_by_pk in [
+            (LimitGroupCounter, amount_sold_by_limit_group),
+            (ProductCounter, amount_sold_by_product),
+        ]:
+            targets = counter_model.target_model.objects.filter(event=event).order_by('pk')
+            counted_by_pk = dict(
+                counter_model.objects.select_for_update().filter(pk__in=targets).values_list('pk', 'amount_sold')
+            )
+
+            for target in targets:
+                counted = counted_by_pk.get(target.pk, 0)
+                actual = actual_by_pk.get(target.pk, 0)
+
+                if counted == actual:
+                    continue
+
+                mismatches.append((target, counted, actual))
+
+                if not dry_run:
+                    counter_model.objects.update_or_create(pk=target.pk, defaults=dict(amount_sold=actual))
+
+    return mismatches
+
+
 # TODO mayhaps combine with Person someday soon?
 class Customer(models.Model):
     # REVERSE: order = OneToOne(Order)
@@ -587,6 +771,48 @@ class Customer(models.Model):
         )
 
 
+OrderSummaryBase = namedtuple('OrderSummary', [
+    'order_products',
+    'products_price_cents',
+    'requires_shipping',
+    'requires_accommodation_information',
+    'contains_electronic_tickets',
+    't_shirts',
+    'messages',
+    'checkout_message',
+    'notify_emails',
+])
+
+
+class OrderSummary(OrderSummaryBase):
+    """
+    Everything about an order that depends on its order products, computed in one pass over them.
+    """
+
+    @classmethod
+    def from_order_products(cls, order_products):
+        order_products = list(order_products)
+        nonzero = [op for op in order_products if op.count > 0]
+
+        messages = []
+        for op in order_products:
+            md = op.product.mail_description
+            if md is not None and md not in messages:
+                messages.append(md)
+
+        return cls(
+            order_products=nonzero,
+            products_price_cents=sum(op.price_cents for op in order_products),
+            requires_shipping=any(op.product.requires_shipping for op in nonzero),
+            requires_accommodation_information=any(op.product.requires_accommodation_information for op in nonzero),
+            contains_electronic_tickets=any(op.product.electronic_ticket for op in nonzero),
+            t_shirts=sum(op.count for op in nonzero if op.product.requires_shirt_size),
+            messages=messages,
+            checkout_message=", ".join(op.description for op in nonzero),
+            notify_emails=[op.product.notify_email for op in nonzero if op.product.notify_email],
+        )
+
+
 class Order(models.Model):
     # REVERSE: order_product_set = ForeignKeyFrom(OrderProduct)
 
@@ -664,14 +890,33 @@ class Order(models.Model):
     def is_cancelled(self):
         return self.cancellation_time is not None
 
+    @property
+    def summary(self):
+        """
+        Uses the order products prefetched with `prefetch_related('order_product_set__product')` if available so that
+        lists of orders can be processed without a query per order. Otherwise costs one query.
+
+        Not cached, so it reflects changes to the order products made after the order was fetched unless those were
+        prefetched.
+        """
+        if 'order_product_set' in getattr(self, '_prefetched_objects_cache', {}):
+            order_products = self.order_product_set.all()
+        else:
+            order_products = self.order_product_set.select_related('product')
+
+        return OrderSummary.from_order_products(order_products)
+
     @property
     def price_cents(self):
-        # TODO Port to Django DB reduction functions if possible
-        return sum(op.price_cents for op in self.order_product_set.all()) + self.shipping_and_handling_cents
+        summary = self.summary
+        return summary.products_price_cents + self._get_shipping_and_handling_cents(summary.requires_shipping)
 
     @property
     def shipping_and_handling_cents(self):
-        return self.event.tickets_event_meta.shipping_and_handling_cents if self.requires_shipping else 0
+        return self._get_shipping_and_handling_cents(self.requires_shipping)
+
+    def _get_shipping_and_handling_cents(self, requires_shipping):
+        return self.event.tickets_event_meta.shipping_and_handling_cents if requires_shipping else 0
 
     @property
     def formatted_shipping_and_handling(self):
@@ -679,12 +924,11 @@ class Order(models.Model):
 
     @property
     def requires_shipping(self):
-        # TODO do this in the database, too
-        return any(op.product.requires_shipping for op in self.order_product_set.filter(count__gt=0))
+        return self.summary.requires_shipping
 
     @property
     def requires_accommodation_information(self):
-        return self.order_product_set.filter(count__gt=0, product__requires_accommodation_information=True).exists()
+        return self.summary.requires_accommodation_information
 
     @property
     def formatted_price(self):
@@ -706,9 +950,7 @@ class Order(models.Model):
 
     @property
     def t_shirts(self):
-        # TODO use db aggregate
-        queryset = self.order_product_set.filter(count__gt=0, product__requires_shirt_size=True)
-        return queryset.aggregate(models.Sum('count'))['count__sum'] or 0
+        return self.summary.t_shirts
 
     @property
     def reference_number_base(self):
@@ -726,6 +968,13 @@ class Order(models.Model):
     def formatted_order_number(self):
         return "#{:06d}".format(self.pk)
 
+    def _invalidate_stats(self):
+        from .stats import invalidate_stats
+        invalidate_stats(self.event_id)
+
+    def _get_counts_by_product(self):
+        return dict(self.order_product_set.values_list('product_id', 'count'))
+
     def clean_up_order_products(self):
         self.order_product_set.filter(count__lte=0).delete()
 
@@ -733,15 +982,64 @@ class Order(models.Model):
         self.shirt_orders.filter(count__lte=0).delete()
 
     def confirm_order(self):
+        """
+        Confirms the order, thereby reserving the products in it until the order is paid or the hold expires.
+
+        The limit groups of the ordered products are locked (in primary key order to avoid deadlocks) for the
+        duration of the availability check and the confirmation, so concurrent confirmations cannot oversell.
+        Raises SoldOutError if there is not enough left in some limit group, in which case nothing is changed.
+        """
         assert self.customer is not None
         assert not self.is_confirmed
 
-        self.clean_up_order_products()
-        self.clean_up_shirt_orders()
+        with transaction.atomic():
+            self.clean_up_order_products()
+            self.clean_up_shirt_orders()
 
-        self.reference_number = self._make_reference_number()
-        self.confirm_time = timezone.now()
-        self.save()
+            counts_by_product = self._get_counts_by_product()
+            self._reserve(counts_by_product)
+
+            self.reference_number = self._make_reference_number()
+            self.confirm_time = timezone.now()
+            self.save()
+
+            adjust_sold_counters(counts_by_product)
+            self._invalidate_stats()
+
+    def _reserve(self, counts_by_product):
+        """
+        Locks the limit groups of the given products and checks there is enough left in them.
+        Must be called inside a transaction. If there is not enough left, tries to release expired holds
+        before giving up with SoldOutError.
+        """
+        requested_by_limit_group = Counter()
+        for product_id, limit_group_id in Product.limit_groups.through.objects.filter(
+            product_id__in=counts_by_product.keys(),
+        ).values_list('product_id', 'limitgroup_id'):
+            requested_by_limit_group[limit_group_id] += counts_by_product[product_id]
+
+        def get_short_limit_groups():
+            limit_groups = LimitGroup.objects.filter(pk__in=requested_by_limit_group.keys()).order_by('pk')
+
+            # NOTE: Read the counters only after having acquired the locks. Rows joined to the locked ones
+            # would be read from the snapshot taken before waiting for the locks.
+            list(limit_groups.select_for_update().values_list('pk', flat=True))
+
+            return [
+                limit_group for limit_group in limit_groups.select_related('counter')
+                if limit_group.amount_available < requested_by_limit_group[limit_group.pk]
+            ]
+
+        short_limit_groups = get_short_limit_groups()
+        if not short_limit_groups:
+            return
+
+        if not Order.release_expired_holds(self.event, limit_groups=short_limit_groups):
+            raise SoldOutError(short_limit_groups)
+
+        short_limit_groups = get_short_limit_groups()
+        if short_limit_groups:
+            raise SoldOutError(short_limit_groups)
 
     def confirm_payment(self, payment_date=None, send_email=True):
         assert self.is_confirmed and not self.is_paid
@@ -752,6 +1050,7 @@ class Order(models.Model):
         self.payment_date = payment_date
 
         self.save()
+        self._invalidate_stats()
 
         if 'lippukala' in settings.INSTALLED_APPS:
             self.lippukala_create_codes()
@@ -762,11 +1061,18 @@ class Order(models.Model):
     def cancel(self, send_email=True):
         assert self.is_confirmed
 
-        if 'lippukala' in settings.INSTALLED_APPS:
-            self.lippukala_revoke_codes()
+        with transaction.atomic():
+            if 'lippukala' in settings.INSTALLED_APPS:
+                self.lippukala_revoke_codes()
 
-        self.cancellation_time = timezone.now()
-        self.save()
+            self.cancellation_time = timezone.now()
+            self.save()
+
+            adjust_sold_counters({
+                product_id: -count
+                for (product_id, count) in self._get_counts_by_product().items()
+            })
+            self._invalidate_stats()
 
         if send_email:
             self.send_confirmation_message("cancellation_notice")
@@ -774,11 +1080,15 @@ class Order(models.Model):
     def uncancel(self, send_email=True):
         assert self.is_cancelled
 
-        if 'lippukala' in settings.INSTALLED_APPS:
-            self.lippukala_reinstate_codes()
+        with transaction.atomic():
+            if 'lippukala' in settings.INSTALLED_APPS:
+                self.lippukala_reinstate_codes()
 
-        self.cancellation_time = None
-        self.save()
+            self.cancellation_time = None
+            self.save()
+
+            adjust_sold_counters(self._get_counts_by_product())
+            self._invalidate_stats()
 
         if send_email:
             self.send_confirmation_message("uncancellation_notice")
@@ -789,18 +1099,7 @@ class Order(models.Model):
 
     @property
     def messages(self):
-        seen = set()
-        result = list()
-
-        for op in self.order_product_set.all():
-            md = op.product.mail_description
-
-            if md is not None:
-                if md not in seen:
-                    seen.add(md)
-                    result.append(md)
-
-        return result
+        return self.summary.messages
 
     @property
     def email_vars(self):
@@ -841,7 +1140,7 @@ class Order(models.Model):
 
     @property
     def checkout_message(self):
-        return ", ".join(i.description for i in self.order_product_set.filter(count__gte=1))
+        return self.summary.checkout_message
 
     def checkout_mac(self, request):
         return compute_payment_request_mac(request, self)
@@ -849,13 +1148,28 @@ class Order(models.Model):
     def checkout_return_url(self, request):
         return request.build_absolute_uri(url('payments_process_view', self.event.slug))
 
+    @property
+    def hold_expires_at(self):
+        """
+        A confirmed order holds its products until it is paid. If it is not paid within UNPAID_CANCEL_HOURS,
+        the hold expires and the order may be cancelled to release the products for others to buy.
+        """
+        if self.confirm_time and not self.is_paid and not self.is_cancelled:
+            return self.confirm_time + timedelta(hours=UNPAID_CANCEL_HOURS)
+        else:
+            return None
+
+    @property
+    def is_hold_expired(self):
+        return self.hold_expires_at is not None and self.hold_expires_at <= timezone.now()
+
     @property
     def reservation_valid_until(self):
         return self.confirm_time + timedelta(seconds=self.event.tickets_event_meta.reservation_seconds) if self.confirm_time else None
 
     @property
     def contains_electronic_tickets(self):
-        return self.order_product_set.filter(count__gt=0, product__electronic_ticket=True).exists()
+        return self.summary.contains_electronic_tickets
 
     @property
     def etickets_delivered(self):
@@ -883,26 +1197,9 @@ class Order(models.Model):
         if 'lippukala' not in settings.INSTALLED_APPS:
             raise NotImplementedError('lippukala is not installed')
 
-        if not self.contains_electronic_tickets:
-            return
-
-        from lippukala.models import Code, Order as LippukalaOrder
-
-        lippukala_order = LippukalaOrder.objects.create(
-            address_text=self.formatted_address,
-            free_text=self.event.tickets_event_meta.ticket_free_text,
-            reference_number=self.reference_number,
-            event=self.event.slug,
-        )
-
-        for op in self.order_product_set.filter(count__gt=0, product__electronic_ticket=True):
-            codes = [Code.objects.create(
-                order=lippukala_order,
-                prefix=self.lippukala_prefix,
-                product_text=op.product.electronic_ticket_title,
-            ) for i in range(op.count * op.product.electronic_tickets_per_product)]
+        from tickets.lippukala_integration import create_codes
 
-        return lippukala_order, codes
+        return create_codes([self]).get(self.id)
 
     def lippukala_revoke_codes(self):
         if 'lippukala' not in settings.INSTALLED_APPS:
@@ -943,17 +1240,9 @@ class Order(models.Model):
         if 'lippukala' not in settings.INSTALLED_APPS:
             raise NotImplementedError('lippukala not installed')
 
-        from lippukala.printing import OrderPrinter
+        from .etickets import render_etickets_pdf
 
-        meta = self.event.tickets_event_meta
-
-        printer = OrderPrinter(
-            print_logo_path=meta.print_logo_path,
-            print_logo_size_cm=meta.print_logo_size_cm,
-        )
-        printer.process_order(self.lippukala_order)
-
-        return printer.finish()
+        return render_etickets_pdf(self)
 
     def send_confirmation_message(self, msgtype):
         if 'background_tasks' in settings.INSTALLED_APPS:
@@ -966,18 +1255,17 @@ class Order(models.Model):
         # don't fail silently, warn admins instead
         msgbcc = []
         meta = self.event.tickets_event_meta
+        summary = self.summary
 
         if meta.ticket_spam_email:
             msgbcc.append(meta.ticket_spam_email)
 
-        for op in self.order_product_set.filter(count__gt=0):
-            if op.product.notify_email:
-                msgbcc.append(op.product.notify_email)
+        msgbcc.extend(summary.notify_emails)
 
         attachments = []
 
         if msgtype == "payment_confirmation":
-            if 'lippukala' in settings.INSTALLED_APPS and self.contains_electronic_tickets:
+            if 'lippukala' in settings.INSTALLED_APPS and summary.contains_electronic_tickets:
                 attachments.append(('e-lippu.pdf', self.get_etickets_pdf(), 'application/pdf'))
 
                 msgsubject = "{self.event.name}: E-lippu ({self.formatted_order_number})".format(self=self)
@@ -1059,15 +1347,106 @@ class Order(models.Model):
         )
 
     @classmethod
-    def cancel_unpaid_orders(cls, event, hours=UNPAID_CANCEL_HOURS, send_email=False):
-        orders = cls.get_unpaid_orders_to_cancel(event=event, hours=hours)
-        count = orders.count()
+    def release_expired_holds(cls, event, limit_groups):
+        """
+        Cancels those unpaid orders that have products in the given limit groups and whose hold has expired.
+        Returns the number of orders cancelled.
+        """
+        orders = cls.get_unpaid_orders_to_cancel(event=event).filter(
+            order_product_set__count__gt=0,
+            order_product_set__product__limit_groups__in=limit_groups,
+        ).distinct()
+
+        return len(cls.bulk_cancel(orders.values_list('id', flat=True)))
+
+    @classmethod
+    def cancel_unpaid_orders(cls, event, hours=UNPAID_CANCEL_HOURS, send_email=False, chunk_size=CANCEL_CHUNK_SIZE):
+        """
+        Cancels unpaid orders older than `hours` in chunks of `chunk_size` orders, each in its own transaction.
+        Orders locked by someone else (eg. being paid right now) are skipped. Returns the number of orders cancelled.
+        """
+        count = 0
+
+        while True:
+            with transaction.atomic():
+                order_ids = list(
+                    cls.get_unpaid_orders_to_cancel(event=event, hours=hours)
+                    .select_for_update(skip_locked=True)
+                    .order_by('id')
+                    .values_list('id', flat=True)[:chunk_size]
+                )
+
+                if not order_ids:
+                    break
+
+                order_ids = cls.bulk_cancel(order_ids)
 
-        for order in orders:
-            order.cancel(send_email=send_email)
+            if send_email:
+                cls.send_confirmation_messages(order_ids, "cancellation_notice")
+
+            count += len(order_ids)
 
         return count
 
+    @classmethod
+    def bulk_cancel(cls, order_ids):
+        """
+        Cancels those of the given orders that are confirmed and not yet cancelled with a constant number of queries
+        regardless of the number of orders. Unlike `cancel`, does not send email. Returns the ids of the orders
+        cancelled.
+        """
+        from .stats import invalidate_stats
+
+        with transaction.atomic():
+            order_ids = list(cls.objects.filter(
+                id__in=list(order_ids),
+                confirm_time__isnull=False,
+                cancellation_time__isnull=True,
+            ).select_for_update().order_by('id').values_list('id', flat=True))
+
+            if not order_ids:
+                return order_ids
+
+            orders = cls.objects.filter(id__in=order_ids)
+
+            if 'lippukala' in settings.INSTALLED_APPS:
+                from lippukala.models import Code, UNUSED, MANUAL_INTERVENTION_REQUIRED
+
+                Code.objects.filter(
+                    order__reference_number__in=orders.values('reference_number'),
+                    status=UNUSED,
+                ).update(status=MANUAL_INTERVENTION_REQUIRED)
+
+            orders.update(cancellation_time=timezone.now())
+
+            adjust_sold_counters({
+                product_id: -count
+                for (product_id, count) in OrderProduct.objects.filter(
+                    order_id__in=order_ids,
+                ).order_by().values_list('product_id').annotate(models.Sum('count'))
+            })
+
+            for event_id in set(orders.values_list('event_id', flat=True)):
+                invalidate_stats(event_id)
+
+        return order_ids
+
+    @classmethod
+    def send_confirmation_messages(cls, order_ids, msgtype):
+        if 'background_tasks' in settings.INSTALLED_APPS:
+            from .tasks import order_send_confirmation_messages
+            order_send_confirmation_messages.delay(list(order_ids), msgtype)
+        else:
+            cls._send_confirmation_messages(order_ids, msgtype)
+
+    @classmethod
+    def _send_confirmation_messages(cls, order_ids, msgtype):
+        for order in cls.objects.filter(id__in=order_ids).select_related(
+            'customer',
+            'event__ticketseventmeta',
+        ).prefetch_related('order_product_set__product'):
+            order._send_confirmation_message(msgtype)
+
 
 class OrderProduct(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="order_product_set")
@@ -1102,6 +1481,44 @@ class OrderProduct(models.Model):
         unique_together = [('order', 'product')]
 
 
+@receiver(pre_save, sender=OrderProduct)
+def order_product_pre_save(sender, instance, **kwargs):
+    # OrderProducts of active orders are sometimes edited by admins. Figure out what to do to the sold counters.
+    instance._sold_count_deltas = Counter()
+
+    if kwargs.get('raw') or not instance.order.is_active:
+        return
+
+    if instance.pk is not None:
+        for product_id, count in OrderProduct.objects.filter(pk=instance.pk).values_list('product_id', 'count'):
+            instance._sold_count_deltas[product_id] -= count
+
+    instance._sold_count_deltas[instance.product_id] += instance.count
+
+
+@receiver(post_save, sender=OrderProduct)
+def order_product_post_save(sender, instance, **kwargs):
+    adjust_sold_counters(getattr(instance, '_sold_count_deltas', {}))
+    instance._sold_count_deltas = Counter()
+
+
+@receiver(post_delete, sender=OrderProduct)
+def order_product_post_delete(sender, instance, **kwargs):
+    if Order.objects.filter(
+        id=instance.order_id,
+        confirm_time__isnull=False,
+        cancellation_time__isnull=True,
+    ).exists():
+        adjust_sold_counters({instance.product_id: -instance.count})
+
+
+@receiver(m2m_changed, sender=Product.limit_groups.through)
+def product_limit_groups_changed(sender, instance, action, **kwargs):
+    # Products moved in or out of limit groups after sales take their sold amounts with them.
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        rebuild_sold_counters(instance.event)
+
+
 class AccommodationInformation(models.Model, CsvExportMixin):
     order_product = models.ForeignKey(OrderProduct, on_delete=models.CASCADE, blank=True, null=True, related_name="accommodation_information_set")
 
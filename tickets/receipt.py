@@ -56,13 +56,19 @@ def render_receipt(order, c):
 
     ypos = 180*mm
 
-    for op in order.order_product_set.filter(product__requires_shipping=True):
+    # NOTE use the prefetched order products if any, see Batch.render
+    order_products = order.order_product_set.all()
+
+    for op in order_products:
+        if not op.product.requires_shipping:
+            continue
+
         c.drawString(BASE_INDENT, ypos, "%d kpl" % op.count)
         c.drawString(DEEP_INDENT, ypos, op.product.name)
 
         ypos -= 10*mm
 
-    non_ship = order.order_product_set.filter(product__requires_shipping=False)
+    non_ship = [op for op in order_products if not op.product.requires_shipping]
     if non_ship:
         c.drawString(BASE_INDENT, ypos, "Seuraavista tilaamistanne tuotteista saatte lisäohjeita sähköpostitse ennen tapahtumaa:")
         ypos -= 10*mm
@@ -0,0 +1,163 @@
+from datetime import timedelta
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Q, Sum, When
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils.timezone import localtime
+
+from .models import Order, OrderProduct
+
+
+STATS_CACHE_SECONDS = 60
+STATS_CACHE_KEY_TEMPLATE = 'tickets:stats:{event_id}'
+
+
+def get_stats(event, use_cache=True):
+    """
+    Returns the sales statistics of the event as a JSON serializable dict. The statistics are computed with two
+    grouped queries (one over products, one over orders) and cached for STATS_CACHE_SECONDS. The cache is
+    invalidated when orders change state.
+    """
+    cache = caches['default']
+    cache_key = STATS_CACHE_KEY_TEMPLATE.format(event_id=event.id)
+
+    if use_cache:
+        cached = cache.get(cache_key)
+        if cached:
+            return cached
+
+    stats = compute_stats(event)
+    cache.set(cache_key, stats, STATS_CACHE_SECONDS)
+
+    return stats
+
+
+def invalidate_stats(event_id):
+    """
+    Drops the cached statistics of the event once the current transaction has been committed.
+    """
+    cache_key = STATS_CACHE_KEY_TEMPLATE.format(event_id=event_id)
+    transaction.on_commit(lambda: caches['default'].delete(cache_key))
+
+
+def _sum_if(then, **conditions):
+    return Sum(Case(When(then=then, **conditions), default=0, output_field=IntegerField()))
+
+
+def compute_stats(event):
+    meta = event.tickets_event_meta
+
+    products = event.product_set.annotate(
+        sold_count=_sum_if(
+            'order_product_set__count',
+            order_product_set__order__confirm_time__isnull=False,
+            order_product_set__order__cancellation_time__isnull=True,
+        ),
+        paid_count=_sum_if(
+            'order_product_set__count',
+            order_product_set__order__confirm_time__isnull=False,
+            order_product_set__order__cancellation_time__isnull=True,
+            order_product_set__order__payment_date__isnull=False,
+        ),
+    )
+
+    # Joining order products for the shipping columns duplicates order rows, hence the distinct counts.
+    active = Q(cancellation_time__isnull=True)
+    paid = active & Q(payment_date__isnull=False)
+    requires_shipping = Q(order_product_set__product__requires_shipping=True)
+    orders = Order.objects.filter(
+        event=event,
+        confirm_time__isnull=False,
+    ).aggregate(
+        num_confirmed_orders=Count('id', distinct=True),
+        num_cancelled_orders=Count('id', distinct=True, filter=~active),
+        num_paid_orders=Count('id', distinct=True, filter=paid),
+        num_delivered_orders=Count('id', distinct=True, filter=paid & Q(batch__delivery_time__isnull=False)),
+        num_req_delivery=Count('id', distinct=True, filter=active & requires_shipping),
+        num_req_delivery_paid=Count('id', distinct=True, filter=paid & requires_shipping),
+    )
+
+    stats = {key: value or 0 for (key, value) in orders.items()}
+
+    stats['shipping_and_handling_total_cents'] = stats['num_req_delivery'] * meta.shipping_and_handling_cents
+    stats['shipping_and_handling_paid_cents'] = stats['num_req_delivery_paid'] * meta.shipping_and_handling_cents
+
+    stats['products'] = [
+        dict(
+            id=product.id,
+            name=product.name,
+            price_cents=product.price_cents,
+            count=product.sold_count or 0,
+            cents=(product.sold_count or 0) * product.price_cents,
+            paid_count=product.paid_count or 0,
+            paid_cents=(product.paid_count or 0) * product.price_cents,
+        )
+        for product in products
+    ]
+
+    stats['total_cents'] = (
+        sum(product['cents'] for product in stats['products']) +
+        stats['shipping_and_handling_total_cents']
+    )
+    stats['total_paid_cents'] = (
+        sum(product['paid_cents'] for product in stats['products']) +
+        stats['shipping_and_handling_paid_cents']
+    )
+
+    return stats
+
+
+SALES_BY_DATE_RESOLUTIONS = dict(
+    day=(TruncDate, timedelta(days=1)),
+    hour=(TruncHour, timedelta(hours=1)),
+)
+
+
+def get_sales_by_date(event, product=None, limit_group=None, resolution='day', cumulative=False):
+    """
+    Returns a list of (period, count) tuples of sold items by order confirmation time in the current time zone,
+    with empty periods filled in. Period is a date for the "day" resolution and a datetime for "hour".
+    """
+    trunc, step = SALES_BY_DATE_RESOLUTIONS[resolution]
+
+    order_products = OrderProduct.objects.filter(
+        order__event=event,
+        order__confirm_time__isnull=False,
+        order__cancellation_time__isnull=True,
+        count__gt=0,
+    )
+
+    if product is not None:
+        order_products = order_products.filter(product=product)
+
+    if limit_group is not None:
+        order_products = order_products.filter(product__limit_groups=limit_group)
+
+    counts_by_period = dict(
+        order_products
+        .annotate(period=trunc('order__confirm_time'))
+        .values('period')
+        .annotate(count=Sum('count'))
+        .values_list('period', 'count')
+    )
+
+    if not counts_by_period:
+        return []
+
+    result = []
+    total = 0
+    cur_period = min(counts_by_period)
+    max_period = max(counts_by_period)
+
+    while cur_period <= max_period:
+        count = counts_by_period.get(cur_period, 0)
+        total += count
+        result.append((cur_period, total if cumulative else count))
+
+        cur_period += step
+        if resolution == 'hour':
+            # keep the UTC offset right over DST transitions
+            cur_period = localtime(cur_period)
+
+    return result
@@ -15,5 +15,15 @@ def batch_send_delivery_confirmation_messages(batch_id):
 def order_send_confirmation_message(order_id, msgtype):
     from .models import Order
 
-    order = Order.objects.get(pk=order_id)
-    order._send_confirmation_message(msgtype)
\ No newline at end of file
+    order = Order.objects.select_related(
+        'customer',
+        'event__ticketseventmeta',
+    ).prefetch_related('order_product_set__product').get(pk=order_id)
+    order._send_confirmation_message(msgtype)
+
+
+@shared_task(ignore_result=True)
+def order_send_confirmation_messages(order_ids, msgtype):
+    from .models import Order
+
+    Order._send_confirmation_messages(order_ids, msgtype)
@@ -1,6 +1,38 @@
-from django.test import TestCase
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from unittest import mock, skipUnless
 
-from .models import LimitGroup, Product, Order
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils.timezone import localtime
+
+from reportlab.pdfgen import canvas
+
+from .models import (
+    Batch,
+    Customer,
+    LimitGroup,
+    Order,
+    Product,
+    rebuild_sold_counters,
+    SoldOutError,
+    TicketsEventMeta,
+    UNPAID_CANCEL_HOURS,
+)
+from .etickets import (
+    cleanup_etickets_cache,
+    get_etickets_cache_key,
+    prerender_etickets,
+    render_etickets_pdf,
+    _get_cache_path,
+)
+from .lippukala_integration import allocate_codes, make_code
+from .stats import compute_stats, get_sales_by_date
 
 
 class LimitGroupsTestCase(TestCase):
@@ -30,3 +62,401 @@ class LimitGroupsTestCase(TestCase):
         assert not weekend.in_stock
         assert not saturday.in_stock
         assert sunday.in_stock
+
+    def test_sold_counters(self):
+        limit_saturday, limit_sunday = LimitGroup.get_or_create_dummies()
+        weekend, saturday, sunday = Product.get_or_create_dummies()
+
+        order, unused = Order.get_or_create_dummy()
+        order.order_product_set.create(product=saturday, count=3)
+        order.order_product_set.create(product=weekend, count=2)
+
+        # not confirmed yet
+        assert limit_saturday.amount_sold == 0
+
+        order.confirm_order()
+        limit_saturday.refresh_from_db()
+        limit_sunday.refresh_from_db()
+        assert limit_saturday.amount_sold == limit_saturday.compute_amount_sold() == 5
+        assert limit_sunday.amount_sold == limit_sunday.compute_amount_sold() == 2
+
+        order.cancel(send_email=False)
+        limit_saturday.refresh_from_db()
+        assert limit_saturday.amount_sold == 0
+
+        order.uncancel(send_email=False)
+        order_product = order.order_product_set.get(product=weekend)
+        order_product.count = 4
+        order_product.save()
+
+        weekend.refresh_from_db()
+        assert weekend.amount_sold == weekend.compute_amount_sold() == 4
+        assert rebuild_sold_counters(order.event, dry_run=True) == []
+
+    def test_sold_counters_follow_limit_groups(self):
+        limit_saturday, limit_sunday = LimitGroup.get_or_create_dummies()
+        weekend, saturday, sunday = Product.get_or_create_dummies()
+
+        order, unused = Order.get_or_create_dummy()
+        order.order_product_set.create(product=weekend, count=2)
+        order.confirm_order()
+
+        weekend.limit_groups.remove(limit_sunday)
+        limit_sunday.refresh_from_db()
+        assert limit_sunday.amount_sold == limit_sunday.compute_amount_sold() == 0
+
+        limit_sunday.product_set.add(weekend)
+        limit_sunday.refresh_from_db()
+        assert limit_sunday.amount_sold == limit_sunday.compute_amount_sold() == 2
+
+        weekend.limit_groups.clear()
+        limit_saturday.refresh_from_db()
+        assert limit_saturday.amount_sold == limit_saturday.compute_amount_sold() == 0
+        assert rebuild_sold_counters(order.event, dry_run=True) == []
+
+    def test_cancel_unpaid_orders(self):
+        limit_saturday, limit_sunday = LimitGroup.get_or_create_dummies()
+        weekend, saturday, sunday = Product.get_or_create_dummies()
+
+        order, unused = Order.get_or_create_dummy()
+        order.order_product_set.create(product=saturday, count=3)
+        order.confirm_order()
+
+        assert Order.cancel_unpaid_orders(event=order.event, chunk_size=1) == 0
+
+        order.confirm_time -= timedelta(hours=UNPAID_CANCEL_HOURS + 1)
+        order.save()
+
+        assert Order.cancel_unpaid_orders(event=order.event, chunk_size=1) == 1
+
+        order.refresh_from_db()
+        limit_saturday.refresh_from_db()
+        assert order.is_cancelled
+        assert limit_saturday.amount_sold == 0
+        assert rebuild_sold_counters(order.event, dry_run=True) == []
+
+
+class OrderSummaryTestCase(TestCase):
+    def test_summary_from_prefetch(self):
+        weekend, saturday, sunday = Product.get_or_create_dummies()
+
+        order, unused = Order.get_or_create_dummy()
+        order.order_product_set.create(product=saturday, count=2)
+        order.order_product_set.create(product=sunday, count=0)
+
+        order = Order.objects.select_related('event__ticketseventmeta').prefetch_related(
+            'order_product_set__product',
+        ).get(id=order.id)
+
+        with self.assertNumQueries(0):
+            assert order.price_cents == 2 * saturday.price_cents + order.event.tickets_event_meta.shipping_and_handling_cents
+            assert order.requires_shipping
+            assert order.contains_electronic_tickets == saturday.electronic_ticket
+            assert order.checkout_message == "2x {saturday.name}".format(saturday=saturday)
+
+
+class BatchTestCase(TestCase):
+    def test_create_and_render(self):
+        weekend, saturday, sunday = Product.get_or_create_dummies()
+
+        orders = []
+        for i, product in enumerate([saturday, sunday, saturday]):
+            customer = Customer.objects.create(
+                first_name='Dummy',
+                last_name='Testinen {i}'.format(i=i),
+                email='dummy{i}@example.com'.format(i=i),
+                address='Testikuja 5 A 19',
+                zip_code='12354',
+                city='Testilä',
+            )
+            order = Order.objects.create(event=saturday.event, customer=customer)
+            order.order_product_set.create(product=product, count=1)
+            order.confirm_order()
+            order.confirm_payment(send_email=False)
+            orders.append(order)
+
+        batch = Batch.create(event=saturday.event, max_items=1, product=saturday)
+        assert list(batch.order_set.values_list('id', flat=True)) == [orders[0].id]
+
+        batch = Batch.create(event=saturday.event, max_items=10)
+        assert set(batch.order_set.values_list('id', flat=True)) == {orders[1].id, orders[2].id}
+
+        output = BytesIO()
+        c = canvas.Canvas(output)
+        with self.assertNumQueries(4):
+            batch.render(c)
+        c.save()
+        assert output.getvalue().startswith(b'%PDF')
+
+        batch.cancel()
+        assert not Order.objects.filter(id__in=[order.id for order in orders[1:]], batch__isnull=False).exists()
+
+
+def make_paid_order(product, count):
+    order = Order.objects.create(event=product.event, customer=Customer.get_or_create_dummy()[0])
+    order.order_product_set.create(product=product, count=count)
+    order.confirm_order()
+    order.confirm_payment(send_email=False)
+    return order
+
+
+class LippukalaTestCase(TestCase):
+    def test_literate_code_matches_lippukala(self):
+        from lippukala.models import Code, Order as LippukalaOrder
+
+        lippukala_order = LippukalaOrder.objects.create(event='dummy', reference_number='123')
+
+        # drawn and spelled out by lippukala itself
+        saved = Code.objects.create(order=lippukala_order, prefix='1', product_text='Dummy')
+        assert make_code(lippukala_order, '1', 'Dummy', saved.code).literate_code == saved.literate_code
+
+        for code in allocate_codes(20):
+            assert code.isdigit()
+            assert settings.LIPPUKALA_CODE_MIN_N_DIGITS <= len(code) <= settings.LIPPUKALA_CODE_MAX_N_DIGITS
+            assert make_code(lippukala_order, '1', 'Dummy', code).literate_code
+
+    def test_create_codes(self):
+        weekend, saturday, sunday = Product.get_or_create_dummies()
+        saturday.electronic_tickets_per_product = 2
+        saturday.save()
+
+        order = make_paid_order(saturday, 3)
+
+        codes = order.lippukala_order.code_set.all()
+        assert codes.count() == 6
+        assert {code.product_text for code in codes} == {saturday.electronic_ticket_title}
+        assert len({code.code for code in codes}) == 6
+
+    def test_create_codes_retries_taken_codes(self):
+        from lippukala.models import Code
+        from .lippukala_integration import create_codes
+
+        weekend, saturday, sunday = Product.get_or_create_dummies()
+        taken_order = make_paid_order(saturday, 1)
+        taken_code = taken_order.lippukala_order.code_set.get().code
+
+        order = Order.objects.create(event=saturday.event, customer=Customer.get_or_create_dummy()[0])
+        order.order_product_set.create(product=saturday, count=1)
+        order.confirm_order()
+
+        # as if a concurrent allocation had grabbed the code after we checked it
+        free_codes = allocate_codes(1)
+        with mock.patch('tickets.lippukala_integration.allocate_codes', side_effect=[[taken_code], free_codes]):
+            lippukala_order, codes = create_codes([order])[order.id]
+
+        assert [code.code for code in codes] == free_codes
+        assert Code.objects.filter(code=taken_code).count() == 1
+
+    def test_create_lippukala_codes_command(self):
+        weekend, saturday, sunday = Product.get_or_create_dummies()
+
+        with_codes = make_paid_order(saturday, 1)
+        without_codes = make_paid_order(sunday, 2)
+        without_codes.lippukala_order.delete()
+
+        call_command('tickets_create_lippukala_codes', saturday.event.slug, stdout=StringIO())
+        assert with_codes.lippukala_order.code_set.count() == 1
+        assert without_codes.lippukala_order.code_set.count() == 2
+
+        # nothing left to backfill
+        output = StringIO()
+        call_command('tickets_create_lippukala_codes', saturday.event.slug, stdout=output)
+        assert 'created 0 codes for 0 orders' in output.getvalue()
+
+
+class EticketsTestCase(TestCase):
+    def test_cache_key(self):
+        from lippukala.models import MANUAL_INTERVENTION_REQUIRED
+
+        weekend, saturday, sunday = Product.get_or_create_dummies()
+        order = make_paid_order(saturday, 2)
+        lippukala_order = order.lippukala_order
+        codes = list(lippukala_order.code_set.order_by('id'))
+        meta = order.event.tickets_event_meta
+
+        def get_key():
+            return get_etickets_cache_key(order, lippukala_order, codes)
+
+        keys = [get_key()]
+        assert get_key() == keys[0]
+
+        codes[0].status = MANUAL_INTERVENTION_REQUIRED
+        keys.append(get_key())
+
+        lippukala_order.address_text = 'Toinen osoite 1'
+        keys.append(get_key())
+
+        codes.pop()
+        keys.append(get_key())
+
+        with NamedTemporaryFile() as logo_file:
+            meta.print_logo_path = logo_file.name
+            keys.append(get_key())
+
+            # replaced in place
+            os.utime(logo_file.name, (0, 0))
+            keys.append(get_key())
+
+        assert len(set(keys)) == len(keys)
+
+    def test_render_etickets_pdf(self):
+        weekend, saturday, sunday = Product.get_or_create_dummies()
+
+        meta = saturday.event.tickets_event_meta
+        meta.print_logo_path = settings.LIPPUKALA_PRINT_LOGO_PATH
+        meta.print_logo_width_mm = 30
+        meta.print_logo_height_mm = 30
+        meta.save()
+
+        order = make_paid_order(saturday, 2)
+        order = Order.objects.select_related('event__ticketseventmeta').get(id=order.id)
+
+        with TemporaryDirectory() as cache_dir, self.settings(TICKETS_ETICKETS_CACHE_DIR=cache_dir):
+            # the logo path is handed to lippukala as is
+            pdf = render_etickets_pdf(order)
+            assert pdf.startswith(b'%PDF')
+
+            codes = list(order.lippukala_order.code_set.order_by('id'))
+            cache_path = _get_cache_path(get_etickets_cache_key(order, order.lippukala_order, codes))
+            with open(cache_path, 'rb') as cache_file:
+                assert cache_file.read() == pdf
+
+            # served from the cache as long as the tickets stay the same
+            with open(cache_path, 'wb') as cache_file:
+                cache_file.write(b'cached')
+            assert render_etickets_pdf(order) == b'cached'
+
+            order.lippukala_revoke_codes()
+            assert render_etickets_pdf(order).startswith(b'%PDF')
+
+        with self.settings(TICKETS_ETICKETS_CACHE_DIR=''):
+            assert render_etickets_pdf(order).startswith(b'%PDF')
+
+    def test_cleanup_etickets_cache(self):
+        with TemporaryDirectory() as cache_dir, self.settings(TICKETS_ETICKETS_CACHE_DIR=cache_dir):
+            old_path = _get_cache_path('aa' * 32)
+            new_path = _get_cache_path('bb' * 32)
+            for path in [old_path, new_path]:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as cache_file:
+                    cache_file.write(b'%PDF')
+
+            old_time = (localtime() - timedelta(days=31)).timestamp()
+            os.utime(old_path, (old_time, old_time))
+
+            assert cleanup_etickets_cache() == 1
+            assert not os.path.exists(old_path)
+            assert os.path.exists(new_path)
+
+            meta, unused = TicketsEventMeta.get_or_create_dummy()
+            output = StringIO()
+            call_command('tickets_render_etickets', meta.event.slug, '--max-age-days=0', stdout=output)
+            assert 'removed 1 expired' in output.getvalue()
+            assert not os.path.exists(new_path)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Worker processes need a database they can connect to')
+class EticketsPrerenderTestCase(TransactionTestCase):
+    def test_prerender_etickets(self):
+        weekend, saturday, sunday = Product.get_or_create_dummies()
+        orders = [make_paid_order(product, 1) for product in [saturday, sunday, weekend]]
+
+        with TemporaryDirectory() as cache_dir, self.settings(TICKETS_ETICKETS_CACHE_DIR=cache_dir):
+            assert prerender_etickets(saturday.event, max_workers=2) == len(orders)
+
+            for order in orders:
+                order = Order.objects.select_related('event__ticketseventmeta').get(id=order.id)
+                codes = list(order.lippukala_order.code_set.order_by('id'))
+                cache_path = _get_cache_path(get_etickets_cache_key(order, order.lippukala_order, codes))
+                assert os.path.exists(cache_path)
+
+
+class StatsTestCase(TestCase):
+    def test_compute_stats(self):
+        weekend, saturday, sunday = Product.get_or_create_dummies()
+
+        order, unused = Order.get_or_create_dummy()
+        order.order_product_set.create(product=saturday, count=2)
+        order.order_product_set.create(product=weekend, count=1)
+        order.confirm_order()
+
+        stats = compute_stats(order.event)
+        assert stats['num_confirmed_orders'] == 1
+        assert stats['num_paid_orders'] == 0
+        assert stats['num_req_delivery'] == 1
+
+        saturday_stats, = [product for product in stats['products'] if product['id'] == saturday.id]
+        assert saturday_stats['count'] == 2
+        assert saturday_stats['paid_count'] == 0
+        assert stats['total_cents'] == 3 * 1800
+
+        order.confirm_payment(send_email=False)
+        order.cancel(send_email=False)
+
+        stats = compute_stats(order.event)
+        assert stats['num_confirmed_orders'] == 1
+        assert stats['num_cancelled_orders'] == 1
+        assert stats['num_paid_orders'] == 0
+        assert stats['total_cents'] == 0
+
+    def test_sales_by_date(self):
+        weekend, saturday, sunday = Product.get_or_create_dummies()
+
+        order, unused = Order.get_or_create_dummy()
+        order.order_product_set.create(product=saturday, count=2)
+        order.order_product_set.create(product=weekend, count=1)
+        order.confirm_order()
+
+        today = localtime(order.confirm_time).date()
+        assert get_sales_by_date(order.event) == [(today, 3)]
+        assert get_sales_by_date(order.event, product=saturday) == [(today, 2)]
+
+        (hour, count), = get_sales_by_date(order.event, resolution='hour', cumulative=True)
+        assert hour.date() == today
+        assert count == 3
+
+        order.cancel(send_email=False)
+        assert get_sales_by_date(order.event) == []
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Row level locking requires PostgreSQL')
+class ReservationConcurrencyTestCase(TransactionTestCase):
+    NUM_ORDERS = 200
+    LIMIT = 50
+    NUM_WORKERS = 16
+
+    def test_no_overselling(self):
+        meta, unused = TicketsEventMeta.get_or_create_dummy()
+        limit_group = LimitGroup.objects.create(event=meta.event, description='Rush hour', limit=self.LIMIT)
+        product, unused = Product.get_or_create_dummy('Rush hour product', [limit_group])
+
+        order_ids = []
+        for i in range(self.NUM_ORDERS):
+            customer = Customer.objects.create(
+                first_name='Dummy',
+                last_name='Testinen {i}'.format(i=i),
+                email='dummy{i}@example.com'.format(i=i),
+                address='Testikuja 5 A 19',
+                zip_code='12354',
+                city='Testilä',
+            )
+            order = Order.objects.create(event=meta.event, customer=customer)
+            order.order_product_set.create(product=product, count=1)
+            order_ids.append(order.id)
+
+        def confirm(order_id):
+            try:
+                Order.objects.get(id=order_id).confirm_order()
+                return True
+            except SoldOutError:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.NUM_WORKERS) as executor:
+            results = list(executor.map(confirm, order_ids))
+
+        limit_group.refresh_from_db()
+        assert results.count(True) == self.LIMIT
+        assert limit_group.amount_sold == limit_group.compute_amount_sold() == self.LIMIT
+        assert Order.objects.filter(id__in=order_ids, confirm_time__isnull=False).count() == self.LIMIT
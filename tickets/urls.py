@@ -15,6 +15,7 @@ from .views import (
     tickets_admin_order_view,
     tickets_admin_orders_view,
     tickets_admin_shirts_view,
+    tickets_admin_stats_api_view,
     tickets_admin_stats_by_date_view,
     tickets_admin_stats_view,
     tickets_admin_tools_view,
@@ -52,6 +53,8 @@ urlpatterns = [
     url(r'events/(?P<event_slug>[a-z0-9-]+)/tickets/admin/shirts\.(?P<format>csv|tsv|xlsx)$', tickets_admin_shirts_view, name="tickets_admin_shirts_export_view"),
 
     url(r'events/(?P<event_slug>[a-z0-9-]+)/tickets/admin/tools$', tickets_admin_tools_view, name="tickets_admin_tools_view"),
+
+    url(r'^api/v1/events/(?P<event_slug>[a-z0-9-]+)/tickets/stats/?$', tickets_admin_stats_api_view, name="tickets_admin_stats_api_view"),
 ]
 
 if 'lippukala' in settings.INSTALLED_APPS:
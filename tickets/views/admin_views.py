@@ -1,11 +1,10 @@
-import datetime
-from collections import defaultdict
+from tempfile import TemporaryFile
 
 from django.conf import settings
 from django.contrib import messages
 from django.core.paginator import Paginator, InvalidPage, EmptyPage
 from django.db.models import Sum, Q, Case, When, IntegerField
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils.timezone import now
 from django.views.decorators.http import require_safe, require_http_methods
@@ -19,6 +18,7 @@ except ImportError:
     from warnings import warn
     warn('Failed to import ReportLab. Generating receipts will fail.')
 
+from api.utils import api_view
 from core.batches_view import batches_view
 from core.csv_export import csv_response, CSV_EXPORT_FORMATS, EXPORT_FORMATS
 from core.utils import url, initialize_form, slugify, login_redirect
@@ -31,8 +31,10 @@ from ..forms import (
     CustomerForm,
     OrderProductForm,
     SearchForm,
+    StatsByDateForm,
 )
 from ..helpers import tickets_admin_required, tickets_event_required, perform_search
+from ..stats import get_sales_by_date, get_stats
 from ..utils import format_price
 from ..models import (
     AccommodationInformation,
@@ -51,6 +53,7 @@ __all__ = [
     "tickets_admin_menu_items",
     "tickets_admin_order_view",
     "tickets_admin_orders_view",
+    "tickets_admin_stats_api_view",
     "tickets_admin_stats_by_date_view",
     "tickets_admin_stats_view",
 ]
@@ -69,106 +72,88 @@ tickets_admin_batches_view = tickets_admin_required(batches_view(
 def tickets_admin_batch_view(request, vars, event, batch_id):
     batch = get_object_or_404(Batch, id=int(batch_id), event=event)
 
-    response = HttpResponse(content_type="application/pdf")
-    response["Content-Disposition"] = 'filename=batch%03d.pdf' % batch.id
-    c = canvas.Canvas(response)
+    # Render into a temporary file that is then streamed so that the whole PDF is never held in memory at once.
+    # The file is deleted when FileResponse closes it.
+    output = TemporaryFile()
+    c = canvas.Canvas(output, pageCompression=1)
     batch.render(c)
     c.save()
+    output.seek(0)
+
+    response = FileResponse(output, content_type="application/pdf")
+    response["Content-Disposition"] = 'filename=batch%03d.pdf' % batch.id
 
     return response
 
 
 @tickets_admin_required
+@require_safe
 def tickets_admin_stats_view(request, vars, event):
-    meta = event.tickets_event_meta
-
-    confirmed_orders = event.order_set.filter(confirm_time__isnull=False)
-    cancelled_orders = confirmed_orders.filter(cancellation_time__isnull=False)
-    paid_orders = confirmed_orders.filter(cancellation_time__isnull=True, payment_date__isnull=False)
-    delivered_orders = paid_orders.filter(batch__delivery_time__isnull=False)
-
-    req_delivery = confirmed_orders.filter(cancellation_time__isnull=True, order_product_set__product__requires_shipping=True).distinct()
-    num_req_delivery = req_delivery.count()
-    num_req_delivery_paid = paid_orders.filter(order_product_set__product__requires_shipping=True).distinct().count()
-    shipping_and_handling_paid_cents = num_req_delivery_paid * meta.shipping_and_handling_cents
-    shipping_and_handling_paid = format_price(shipping_and_handling_paid_cents)
-
-    shipping_and_handling_total_cents = num_req_delivery * meta.shipping_and_handling_cents
-    shipping_and_handling_total = format_price(shipping_and_handling_total_cents)
-
-    data = []
-    total_cents = 0
-    total_paid_cents = 0
-
-    for product in event.product_set.all():
-        soldop_set = product.order_product_set.filter(order__confirm_time__isnull=False, order__cancellation_time__isnull=True)
-        paidop_set = soldop_set.filter(order__payment_date__isnull=False)
-
-        count = soldop_set.aggregate(count=Sum('count'))['count']
-        count = count if count is not None else 0
-
-        paid_count = paidop_set.aggregate(count=Sum('count'))['count']
-        paid_count = paid_count if paid_count is not None else 0
-
-        cents = count * product.price_cents
-        total_cents += cents
-
-        paid_cents = paid_count * product.price_cents
-        total_paid_cents += paid_cents
-
-        item = dict(product=product, count=count, cents=format_price(cents), paid_count=paid_count, paid_cents=format_price(paid_cents))
-        data.append(item)
-
-    total_cents += shipping_and_handling_total_cents
-    total_paid_cents += shipping_and_handling_paid_cents
+    stats = get_stats(event)
 
-    total_price = format_price(total_cents)
-    total_paid_price = format_price(total_paid_cents)
+    data = [
+        dict(
+            product,
+            cents=format_price(product['cents']),
+            paid_cents=format_price(product['paid_cents']),
+        )
+        for product in stats['products']
+    ]
 
     vars.update(
         data=data,
-        num_confirmed_orders=confirmed_orders.count(),
-        num_cancelled_orders=cancelled_orders.count(),
-        num_paid_orders=paid_orders.count(),
-        num_delivered_orders=delivered_orders.count(),
-        num_req_delivery=num_req_delivery,
-        num_req_delivery_paid=num_req_delivery_paid,
-        shipping_and_handling_total=shipping_and_handling_total,
-        shipping_and_handling_paid=shipping_and_handling_paid,
-
-        total_price=total_price,
-        total_paid_price=total_paid_price
+        limit_groups=event.limitgroup_set.select_related('counter'),
+        num_confirmed_orders=stats['num_confirmed_orders'],
+        num_cancelled_orders=stats['num_cancelled_orders'],
+        num_paid_orders=stats['num_paid_orders'],
+        num_delivered_orders=stats['num_delivered_orders'],
+        num_req_delivery=stats['num_req_delivery'],
+        num_req_delivery_paid=stats['num_req_delivery_paid'],
+        shipping_and_handling_total=format_price(stats['shipping_and_handling_total_cents']),
+        shipping_and_handling_paid=format_price(stats['shipping_and_handling_paid_cents']),
+
+        total_price=format_price(stats['total_cents']),
+        total_paid_price=format_price(stats['total_paid_cents']),
     )
 
     return render(request, "tickets_admin_stats_view.pug", vars)
 
 
 @tickets_admin_required
-def tickets_admin_stats_by_date_view(request, vars, event, raw=False):
-    confirmed_orders = event.order_set.filter(confirm_time__isnull=False, cancellation_time__isnull=True, order_product_set__product__name__contains='lippu').distinct()
-    tickets_by_date = defaultdict(int)
-
-    for order in confirmed_orders:
-        date = order.confirm_time.date()
-
-        # XXX this deserves an "XXX"
-        for op in order.order_product_set.filter(product__name__contains='lippu').distinct():
-            tickets_by_date[date] += op.count
-
-    min_date = min(tickets_by_date.keys())
-    max_date = max(tickets_by_date.keys())
-
-    cur_date = min_date
-
-    tsv = list()
+@require_safe
+@api_view
+def tickets_admin_stats_api_view(request, vars, event):
+    return dict(
+        get_stats(event),
+        limit_groups=[
+            dict(
+                id=limit_group.id,
+                description=limit_group.description,
+                limit=limit_group.limit,
+                amount_sold=limit_group.amount_sold,
+                amount_available=limit_group.amount_available,
+            )
+            for limit_group in event.limitgroup_set.select_related('counter')
+        ],
+    )
 
-    while cur_date <= max_date:
-        tickets = tickets_by_date[cur_date]
-        tsv.append("%s\t%s" % (cur_date.isoformat(), tickets))
 
-        cur_date += datetime.timedelta(1)
+@tickets_admin_required
+@require_safe
+def tickets_admin_stats_by_date_view(request, vars, event, raw=False):
+    form = StatsByDateForm(request.GET, event=event)
+    if not form.is_valid():
+        return HttpResponse('invalid filter', status=400)
+
+    sales_by_date = get_sales_by_date(
+        event,
+        product=form.cleaned_data['product'],
+        limit_group=form.cleaned_data['limit_group'],
+        resolution=form.cleaned_data['resolution'] or 'day',
+        cumulative=form.cleaned_data['cumulative'],
+    )
 
-    tsv = "\n".join(tsv)
+    tsv = "\n".join("%s\t%s" % (period.isoformat(), count) for (period, count) in sales_by_date)
 
     if raw:
         response = HttpResponse(tsv, content_type="text/plain")
@@ -182,7 +167,7 @@ def tickets_admin_stats_by_date_view(request, vars, event, raw=False):
 @tickets_admin_required
 @require_http_methods(["GET","POST"])
 def tickets_admin_orders_view(request, vars, event):
-    orders = []
+    orders = event.order_set.none()
     form = initialize_form(SearchForm, request)
 
     if request.method == "POST":
@@ -196,6 +181,7 @@ def tickets_admin_orders_view(request, vars, event):
     except ValueError:
         page = 1
 
+    orders = orders.select_related('customer', 'event__ticketseventmeta')
     paginator = Paginator(orders, 100)
 
     try:
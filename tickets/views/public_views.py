@@ -16,6 +16,7 @@ from ..models import (
     OrderProduct,
     ShirtOrder,
     ShirtSize,
+    SoldOutError,
 )
 from ..utils import *
 
@@ -429,14 +430,17 @@ class ConfirmPhase(Phase):
     delay_complete = True
 
     def validate(self, request, event, form):
-        errors = multiform_validate(form)
         order = get_order(request, event)
-        order_products = order.order_product_set.filter(count__gt=0)
+        action = request.POST.get("action", "cancel")
 
-        if any(i.product.amount_available < i.count for i in order_products):
-            messages.error(request, 'Valitsemasi tuote on valitettavasti juuri myyty loppuun.')
-            errors.append("soldout_confirm")
-            return errors
+        # The availability check and the confirmation need to happen atomically or we will oversell.
+        # Hence the order is confirmed here and not in save.
+        if action == 'next' and not order.is_confirmed:
+            try:
+                order.confirm_order()
+            except SoldOutError:
+                messages.error(request, 'Valitsemasi tuote on valitettavasti juuri myyty loppuun.')
+                return ["soldout_confirm"]
 
         return []
 
@@ -453,11 +457,8 @@ class ConfirmPhase(Phase):
         return is_phase_completed(request, event, self.prev_phase) and not order.is_paid
 
     def save(self, request, event, form):
-        order = get_order(request, event)
-        action = request.POST.get("action", "cancel")
-
-        if action == 'next' and not order.is_confirmed:
-            order.confirm_order()
+        # Confirmed in validate
+        pass
 
     def can_go_back(self, request, event):
         order = get_order(request, event)